@@ -0,0 +1,34 @@
+"""
+基准测试公共夹具:在 import impress_api 之前装入 fake_uno
+
+FAKE_UNO_LATENCY_US 环境变量设置每次模拟桥接调用的延迟（微秒，默认 0）。
+"""
+
+import logging
+import os
+
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("pytest_benchmark")
+
+import fake_uno
+
+OFFICE = fake_uno.install()
+OFFICE.bridge.latency = float(os.environ.get("FAKE_UNO_LATENCY_US", "0")) / 1e6
+
+import impress_api  # noqa: E402
+
+logging.getLogger().setLevel(logging.WARNING)
+impress_api.logger.setLevel(logging.WARNING)
+
+
+@pytest.fixture(scope="session")
+def office():
+    return OFFICE
+
+
+@pytest.fixture(scope="session")
+def client():
+    impress_api.app.config["TESTING"] = True
+    return impress_api.app.test_client()
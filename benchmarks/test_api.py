@@ -0,0 +1,956 @@
+"""
+各功能端点的行为测试（与基准共用 fake_uno 夹具）
+
+    pytest benchmarks/test_api.py
+"""
+
+import base64
+import gzip
+import json
+import queue
+import struct
+import threading
+import time
+import zlib
+
+import pytest
+
+import fake_uno
+import impress_api
+import impress_codec
+from impress_deadline import hung_calls
+from impress_events import tracker
+from impress_geometry import geometry, spatial
+from impress_metrics import ERRORS
+from impress_rpc import METHOD_NOT_FOUND, SERVER_ERROR, RpcSession
+from impress_templates import TemplateCache
+from impress_trajectory import DELTA, KEYFRAME, Recorder, TrajectoryReader
+
+
+def _errors(route):
+    return sum(v for (r, _), v in list(ERRORS._values.items()) if r == route)
+
+
+def test_unhandled_exception_counted_once(client, office, monkeypatch):
+    office.reset()
+
+    def boom(*args, **kwargs):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(impress_api, "get_presentation_info", boom)
+    before = _errors("/api/presentation/info")
+    response = client.get("/api/presentation/info")
+    assert response.status_code == 500
+    assert _errors("/api/presentation/info") - before == 1
+    assert ERRORS.get("/api/presentation/info", "exception") >= 1
+
+
+def test_chrome_trace_requires_server_opt_in(client, office, monkeypatch, tmp_path):
+    office.reset(shapes=3)
+    monkeypatch.setattr(impress_api, "UNO_TRACE_DIR", str(tmp_path))
+    response = client.get("/api/slide/0?uno_trace=chrome")
+    assert "X-Uno-Trace-Summary" in response.headers
+    assert "X-Uno-Trace-File" not in response.headers
+    assert list(tmp_path.iterdir()) == []
+
+    monkeypatch.setattr(impress_api, "UNO_TRACE_ALLOW_CHROME", True)
+    monkeypatch.setattr(impress_api, "UNO_TRACE_MAX_FILES", 2)
+    for _ in range(4):
+        response = client.get("/api/slide/0", headers={"X-Uno-Trace": "chrome"})
+        assert "X-Uno-Trace-File" in response.headers
+    assert len(list(tmp_path.iterdir())) == 2
+
+
+def test_concurrent_change_during_write_invalidates_other_slide(client, office):
+    doc = office.reset(slides=3, shapes=1)
+    key = tracker.watch(doc)
+    start = tracker.generation(key)
+    etag = client.get("/api/slide/2").headers["ETag"]
+    pages = doc.getDrawPages()
+
+    with tracker.writing(key, 0):
+        pages.getByIndex(0).getByIndex(0).setString("own write")
+        other = threading.Thread(target=pages.getByIndex(2).getByIndex(0).setString, args=("gui",))
+        other.start()
+        other.join()
+
+    assert tracker.changed_since(key, start, 2)
+    assert client.get("/api/slide/2", headers={"If-None-Match": etag}).status_code == 200
+
+    # 只有写操作自己的修改时，其他页不失效
+    start = tracker.generation(key)
+    with tracker.writing(key, 0):
+        pages.getByIndex(0).getByIndex(0).setString("own write again")
+    assert tracker.changed_since(key, start, 0)
+    assert not tracker.changed_since(key, start, 1)
+
+
+def test_create_app_starts_background_connect_once(monkeypatch):
+    calls = []
+    monkeypatch.setattr(impress_api, "_services_started", False)
+    monkeypatch.setattr(impress_api, "SUPERVISE", False)
+    monkeypatch.setattr(impress_api, "EAGER_CONNECT", True)
+    monkeypatch.setattr(impress_api.connection, "start_background", lambda: calls.append(1))
+    assert impress_api.create_app() is impress_api.app
+    impress_api.create_app()
+    assert calls == [1]
+
+
+class _SlowManager:
+    """connect() 阻塞到 release 被设置，模拟 soffice 启动慢"""
+
+    desktop = None
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    def mark_dead(self, reason):
+        pass
+
+    def connect(self, kind):
+        self.release.wait(5)
+        return object()
+
+    def warm_up(self):
+        pass
+
+
+class _FakeProcess:
+    pid = -1
+    returncode = None
+
+    def poll(self):
+        return None
+
+
+def test_supervisor_status_responds_during_recycle(monkeypatch, tmp_path):
+    import impress_supervisor
+
+    monkeypatch.setattr(impress_supervisor, "SOFFICE_PROFILE", str(tmp_path))
+    monkeypatch.setattr(impress_supervisor.subprocess, "Popen", lambda *a, **k: _FakeProcess())
+    manager = _SlowManager()
+    sup = impress_supervisor.SofficeSupervisor(manager)
+    sup._thread = threading.current_thread()  # 视为已启用
+
+    worker = threading.Thread(target=sup.recycle, args=("test",))
+    worker.start()
+    try:
+        for _ in range(100):
+            if sup.process is not None:
+                break
+            threading.Event().wait(0.01)
+        results = []
+        probe = threading.Thread(
+            target=lambda: results.append((sup.status(), sup.episode_finished()))
+        )
+        probe.start()
+        probe.join(1)
+        assert not probe.is_alive(), "status() blocked while soffice was starting"
+        status, recycle_started = results[0]
+        assert status["phase"] == "recycling" and status["recycling"]
+        assert recycle_started is False
+    finally:
+        manager.release.set()
+        worker.join(5)
+    assert sup.status()["phase"] == "running"
+
+
+class _FailingManager(_SlowManager):
+    """connect() 按 results 依次返回，模拟 soffice 进程活着但桥接连不上"""
+
+    def __init__(self, results):
+        super().__init__()
+        self.results = list(results)
+
+    def connect(self, kind):
+        return self.results.pop(0)
+
+
+def test_supervisor_check_skips_recycle_in_progress(monkeypatch, tmp_path):
+    import impress_supervisor
+
+    monkeypatch.setattr(impress_supervisor, "SOFFICE_PROFILE", str(tmp_path))
+    monkeypatch.setattr(impress_supervisor.subprocess, "Popen", lambda *a, **k: _FakeProcess())
+    sup = impress_supervisor.SofficeSupervisor(_SlowManager())
+    sup._thread = threading.current_thread()
+
+    # 回收中进程已被摘下:巡检不能判定为 "exited"
+    sup.phase = "recycling"
+    assert sup.check() is None
+    sup.phase = "running"
+    sup._recycling.set()
+    assert sup.check() is None
+    sup._recycling.clear()
+
+    # 巡检看到的进程已被别的回收换掉:不再重启第二次
+    stale, sup.process = _FakeProcess(), _FakeProcess()
+    spawned = []
+    monkeypatch.setattr(sup, "terminate", lambda process: None)
+    monkeypatch.setattr(sup, "spawn", lambda reason: spawned.append(reason))
+    assert sup.recycle("exited", expected=stale) is None
+    assert spawned == [] and sup.restarts == 0
+    sup.recycle("exited", expected=sup.process)
+    assert spawned == ["exited"]
+
+
+def test_supervisor_retries_failed_start(monkeypatch):
+    import impress_supervisor
+
+    monkeypatch.setattr(impress_supervisor, "UNRESPONSIVE_LIMIT", 2)
+    sup = impress_supervisor.SofficeSupervisor(_FailingManager([None, object()]))
+    sup.process, sup.phase = _FakeProcess(), "failed"
+    assert sup.check() is None and sup.unresponsive == 1
+    assert sup.check() is None
+    assert sup.phase == "running" and sup.unresponsive == 0
+
+    sup = impress_supervisor.SofficeSupervisor(_FailingManager([None, None]))
+    sup.process, sup.phase = _FakeProcess(), "failed"
+    assert sup.check() is None
+    assert sup.check() == "unresponsive"
+
+
+def _wait_for_hung_calls():
+    for _ in range(500):
+        if not hung_calls():
+            return
+        time.sleep(0.01)
+
+
+def test_deadline_keeps_other_documents(client, office):
+    office.reset(shapes=20)
+    doc_id = client.post("/api/documents/open", json={"hidden": True}).json["doc_id"]
+    try:
+        office.bridge.latency = 0.002
+        response = client.get("/api/slide/0", headers={"X-Deadline": "0.05"})
+        assert response.status_code == 504
+        assert response.json["bridge_reset"] is False
+        office.bridge.latency = 0.0
+        _wait_for_hung_calls()
+
+        info = client.get(f"/api/presentation/info?doc_id={doc_id}")
+        assert info.status_code == 200, info.json
+        assert impress_api.connection.status()["state"] == "connected"
+    finally:
+        office.bridge.latency = 0.0
+        _wait_for_hung_calls()
+        client.delete(f"/api/documents/{doc_id}")
+
+
+def test_calls_hung_forever_do_not_block_later_requests(client, office, monkeypatch):
+    office.reset(shapes=2)
+    release = threading.Event()
+    get_slide_content = impress_api.get_slide_content
+
+    def stuck(*args, **kwargs):
+        release.wait()
+        return get_slide_content(*args, **kwargs)
+
+    monkeypatch.setattr(impress_api, "get_slide_content", stuck)
+    try:
+        for _ in range(impress_api.MAX_HUNG_CALLS + 1):
+            response = client.get("/api/slide/0", headers={"X-Deadline": "0.05"})
+            assert response.status_code == 504
+            assert response.json["bridge_reset"] is False
+        assert hung_calls() > impress_api.MAX_HUNG_CALLS
+
+        # 桥接仍能响应:其他请求照常执行
+        health = client.get("/api/health", headers={"X-Deadline": "1"})
+        assert health.status_code == 200, health.json
+        monkeypatch.setattr(impress_api, "get_slide_content", get_slide_content)
+        assert client.get("/api/slide/0", headers={"X-Deadline": "1"}).status_code == 200
+
+        # 桥接被重置后，旧桥上的卡住调用不再计数
+        impress_api.connection.mark_dead("test: bridge reset")
+        assert hung_calls() == 0
+        assert client.get("/api/slide/0", headers={"X-Deadline": "1"}).status_code == 200
+    finally:
+        release.set()
+        _wait_for_hung_calls()
+
+
+def test_presentation_content_slide_timeout_keeps_bridge(client, office):
+    office.reset(slides=3, shapes=20)
+    doc_id = client.post("/api/documents/open", json={"hidden": True}).json["doc_id"]
+    try:
+        office.bridge.latency = 0.002
+        response = client.get("/api/presentation/content", headers={"X-Deadline": "0.05"})
+        lines = [json.loads(line) for line in response.get_data().splitlines()]
+        office.bridge.latency = 0.0
+        _wait_for_hung_calls()
+        assert lines[0]["type"] == "presentation"
+        assert lines[-1]["type"] == "error"
+        assert lines[-1]["bridge_reset"] is False
+        assert client.get(f"/api/presentation/info?doc_id={doc_id}").status_code == 200
+    finally:
+        office.bridge.latency = 0.0
+        _wait_for_hung_calls()
+        client.delete(f"/api/documents/{doc_id}")
+
+
+def test_doc_ids_survive_reconnect_to_same_office(client, office):
+    office.reset()
+    doc_id = client.post("/api/documents/open", json={"hidden": True}).json["doc_id"]
+    try:
+        impress_api.connection.mark_dead("test: bridge dropped")
+        response = client.get(f"/api/presentation/info?doc_id={doc_id}")
+        assert response.status_code == 200, response.json
+        assert doc_id in [d["doc_id"] for d in client.get("/api/documents").json["documents"]]
+    finally:
+        client.delete(f"/api/documents/{doc_id}")
+
+
+def test_doc_ids_dropped_after_office_restart(client, office):
+    office.reset()
+    doc_id = client.post("/api/documents/open", json={"hidden": True}).json["doc_id"]
+    office.restart()
+    impress_api.connection.mark_dead("test: soffice restarted")
+    response = client.get(f"/api/presentation/info?doc_id={doc_id}")
+    assert response.status_code == 404
+    assert response.json["doc_id"] == doc_id
+
+
+def test_centered_paragraph_reads_back_as_center(client, office):
+    doc = office.reset(shapes=1)
+    shape = doc.getDrawPages().getByIndex(0).getByIndex(0)
+    shape.createTextCursor().setPropertyValue("ParaAdjust", 3)  # ParagraphAdjust.CENTER
+
+    info = client.get("/api/slide/0?include_formatting=true&runs=true").json
+    shape_info = info["shapes"][0]
+    assert shape_info["formatting"]["alignment"] == "center"
+    assert {run["alignment"] for run in shape_info["runs"]["runs"]} == {"center"}
+
+    response = client.post(
+        "/api/slide/format",
+        json={"edits": [{"shape_index": 0, "formatting": {"alignment": "justify"}}]},
+    )
+    assert response.status_code == 200
+    info = client.get("/api/slide/0?include_formatting=true").json
+    assert info["shapes"][0]["formatting"]["alignment"] == "justify"
+
+
+def test_trajectory_roundtrip(tmp_path):
+    states = [
+        [{"shapes": ["a"]}],
+        [{"shapes": ["a"]}, {"shapes": ["b"]}],
+        [{"shapes": ["a2"]}, {"shapes": ["b"]}],
+        [{"shapes": ["a2"]}],
+        [{"shapes": ["a2"]}, {"shapes": []}, {"shapes": ["c"]}],
+    ]
+    current = {"step": 0}
+
+    def capture():
+        return states[current["step"]], current["step"], 0
+
+    path = tmp_path / "episode.traj"
+    recorder = Recorder("episode", "doc", capture, str(path), keyframe_interval=3)
+    for step in range(len(states)):
+        current["step"] = step
+        assert recorder.step(label=f"s{step}") == step
+    recorder.stop(final_step=False)
+
+    # 帧头:<IBI（payload 长度、类型、步号）+ zlib 压缩的 JSON
+    data = path.read_bytes()
+    length, kind, step = struct.unpack_from("<IBI", data)
+    assert (kind, step) == (KEYFRAME, 0)
+    first = json.loads(zlib.decompress(data[9 : 9 + length]))
+    assert first["slides"] == states[0] and first["label"] == "s0"
+
+    reader = TrajectoryReader(str(path))
+    assert [kind for _, kind, _, _ in reader.frames] == [KEYFRAME, DELTA, DELTA, KEYFRAME, DELTA]
+    assert reader.record(2)["changed"] == [[0, {"shapes": ["a2"]}]]
+    for step, expected in enumerate(states):
+        state = reader.state_at(step)
+        assert state["slides"] == expected
+        assert state["generation"] == step and state["label"] == f"s{step}"
+
+    # 写到一半的最后一帧被忽略
+    with open(path, "ab") as f:
+        f.write(struct.pack("<IBI", 100, DELTA, 5) + b"partial")
+    assert len(TrajectoryReader(str(path))) == len(states)
+
+
+def test_trajectory_stop_does_not_wait_for_hung_capture(tmp_path):
+    release = threading.Event()
+    calls = []
+
+    def capture():
+        calls.append(1)
+        if len(calls) > 1:
+            release.wait(5)
+        return [{"shapes": []}], len(calls), 0
+
+    recorder = Recorder("hung", "doc", capture, str(tmp_path / "hung.traj"))
+    recorder.step()
+    worker = threading.Thread(target=recorder.step)
+    worker.start()
+    try:
+        while len(calls) < 2:
+            time.sleep(0.01)
+        stopper = threading.Thread(target=recorder.stop, kwargs={"final_step": False})
+        stopper.start()
+        stopper.join(1)
+        assert not stopper.is_alive(), "stop() blocked on a hung capture"
+    finally:
+        release.set()
+        worker.join(5)
+    assert recorder.steps == 1
+
+
+def _cached_slides(cache, doc_key):
+    return sorted(k[1] for k in cache._slides if k[0] == doc_key)
+
+
+def test_geometry_evicted_on_slide_delete_and_close(client, office):
+    office.reset()
+    doc_id = client.post("/api/documents/open", json={"hidden": True}).json["doc_id"]
+    doc = impress_api.documents.get(doc_id)
+    pages = doc.getDrawPages()
+    for _ in range(2):
+        pages.insertNewByIndex(pages.getCount())
+    doc_key = tracker.watch(doc)
+    for index in range(3):
+        response = client.get(f"/api/slide/{index}/hit-test?x=0&y=0&doc_id={doc_id}")
+        assert response.status_code == 200
+    assert _cached_slides(geometry, doc_key) == _cached_slides(spatial, doc_key) == [0, 1, 2]
+
+    assert client.delete(f"/api/slide/2?doc_id={doc_id}").json["total_slides"] == 2
+    assert _cached_slides(geometry, doc_key) == _cached_slides(spatial, doc_key) == [0, 1]
+
+    # 页在别处被删掉:查询返回 404 时丢弃超出页数的页
+    pages.remove(pages.getByIndex(1))
+    assert client.get(f"/api/slide/1/hit-test?x=0&y=0&doc_id={doc_id}").status_code == 404
+    assert _cached_slides(geometry, doc_key) == [0]
+
+    client.delete(f"/api/documents/{doc_id}")
+    assert _cached_slides(geometry, doc_key) == _cached_slides(spatial, doc_key) == []
+    assert not tracker.is_tracked(doc_key)
+
+
+def test_search_index_evicted_on_slide_delete_and_close(client, office):
+    doc = office.reset(slides=3, shapes=1)
+    pages = doc.getDrawPages()
+    for index in range(3):
+        pages.getByIndex(index).getByIndex(0).setString(f"needle {index}")
+    doc_key = tracker.watch(doc)
+    hits = client.get("/api/search?q=needle").json["results"]
+    assert [hit["slide_index"] for hit in hits] == [0, 1, 2]
+
+    client.delete("/api/slide/2")
+    index = impress_api.search_index._docs[doc_key]
+    assert sorted(index.slides) == [0, 1]
+    assert all(slide_index < 2 for members in index.postings.values() for slide_index, _ in members)
+    hits = client.get("/api/search?q=needle 2").json["results"]
+    assert hits == []
+
+    doc.close(True)
+    assert doc_key not in impress_api.search_index._docs
+
+
+def test_snapshots_limited_per_document_and_evicted_on_close(client, office, monkeypatch):
+    monkeypatch.setattr(impress_api.snapshots, "max_per_doc", 2)
+    doc = office.reset(slides=3, shapes=1)
+    doc_key = tracker.watch(doc)
+    ids = [client.post("/api/snapshots").json["snapshot_id"] for _ in range(3)]
+    listed = [s["snapshot_id"] for s in client.get("/api/snapshots").json["snapshots"]]
+    assert listed == ids[1:]
+    assert client.get(f"/api/snapshots/{ids[0]}/diff").status_code == 404
+
+    client.delete("/api/slide/2")
+    assert _cached_slides(impress_api.snapshots, doc_key) == [0, 1]
+
+    doc.close(True)
+    assert _cached_slides(impress_api.snapshots, doc_key) == []
+    assert not any(s.doc_key == doc_key for s in impress_api.snapshots._snapshots.values())
+
+
+def test_response_format_negotiation(client, office, monkeypatch):
+    msgpack = pytest.importorskip("msgpack")
+    office.reset(shapes=50)
+    plain = client.get("/api/slide/0")
+    assert plain.mimetype == "application/json"
+    assert "Content-Encoding" not in plain.headers
+    expected = plain.json
+
+    negotiations = ({"headers": {"Accept": "application/msgpack"}}, {"query_string": {"format": "msgpack"}})
+    for kwargs in negotiations:
+        response = client.get("/api/slide/0", **kwargs)
+        assert response.mimetype == "application/msgpack"
+        assert msgpack.unpackb(response.get_data()) == expected
+
+    monkeypatch.setattr(impress_codec, "_zstd_compressor", None)
+    monkeypatch.setattr(impress_codec, "COMPRESS_MIN_BYTES", 1024)
+    response = client.get("/api/slide/0", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert json.loads(gzip.decompress(response.get_data())) == expected
+
+    # 低于阈值不压缩
+    small = client.get("/api/health", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in small.headers
+
+
+class _FakeSocket:
+    """flask-sock 连接的替身:receive() 从 incoming 取包，send() 的包放进 outgoing"""
+
+    def __init__(self):
+        self.incoming = queue.Queue()
+        self.outgoing = queue.Queue()
+
+    def receive(self):
+        return self.incoming.get()
+
+    def send(self, data):
+        self.outgoing.put(json.loads(data))
+
+    def request(self, payload):
+        self.incoming.put(json.dumps(payload))
+        return self.outgoing.get(timeout=5)
+
+
+def test_rpc_session_dispatches_batches_and_pushes_events(office):
+    doc = office.reset(slides=2, shapes=3)
+    ws = _FakeSocket()
+    session = threading.Thread(
+        target=RpcSession(impress_api.app, ws, impress_api.hub, impress_api.event_document_key).serve
+    )
+    session.start()
+    try:
+        reply = ws.request({"jsonrpc": "2.0", "id": 1, "method": "slide.get", "params": {"index": 1}})
+        assert reply["id"] == 1 and len(reply["result"]["shapes"]) == 3
+
+        # 流水线 + 批量:通知不回包，回包按请求顺序
+        replies = ws.request(
+            [
+                {"jsonrpc": "2.0", "id": 2, "method": "GET /api/presentation/info"},
+                {"jsonrpc": "2.0", "method": "health"},
+                {"jsonrpc": "2.0", "id": 3, "method": "no.such.method"},
+                {"jsonrpc": "2.0", "id": 4, "method": "slide.get", "params": {"index": 9}},
+            ]
+        )
+        assert [r["id"] for r in replies] == [2, 3, 4]
+        assert replies[0]["result"]["total_slides"] == 2
+        assert replies[1]["error"]["code"] == METHOD_NOT_FOUND
+        assert replies[2]["error"]["code"] == SERVER_ERROR
+        assert replies[2]["error"]["data"]["status"] == 404
+
+        assert ws.request({"jsonrpc": "2.0", "id": 5, "method": "events.subscribe"})["result"]
+        doc.getDrawPages().getByIndex(0).getByIndex(0).setString("pushed")
+        notification = ws.outgoing.get(timeout=5)
+        assert notification["method"] == "document.modified"
+        assert "id" not in notification
+        assert notification["params"]["doc"] == tracker.key(doc)
+    finally:
+        ws.incoming.put(None)
+        session.join(5)
+    assert not session.is_alive()
+
+
+def test_rpc_events_only_for_the_subscribed_document(client, office):
+    doc = office.reset(slides=1, shapes=1)
+    doc_id = client.post("/api/documents/open", json={"hidden": True}).json["doc_id"]
+    hidden_key = tracker.watch(impress_api.documents.get(doc_id))
+    ws = _FakeSocket()
+    session = threading.Thread(
+        target=RpcSession(impress_api.app, ws, impress_api.hub, impress_api.event_document_key).serve
+    )
+    session.start()
+    try:
+        reply = ws.request({"jsonrpc": "2.0", "id": 1, "method": "events.subscribe"})
+        assert reply["result"]["doc"] == tracker.key(doc)
+        tracker.bump(hidden_key)
+        doc.getDrawPages().getByIndex(0).getByIndex(0).setString("current")
+        assert ws.outgoing.get(timeout=5)["params"]["doc"] == tracker.key(doc)
+
+        # 改为订阅另一个文档:当前文档的修改不再推送
+        reply = ws.request(
+            {"jsonrpc": "2.0", "id": 2, "method": "events.subscribe", "params": {"doc_id": doc_id}}
+        )
+        assert reply["result"]["doc"] == hidden_key
+        doc.getDrawPages().getByIndex(0).getByIndex(0).setString("ignored")
+        tracker.bump(hidden_key)
+        assert ws.outgoing.get(timeout=5)["params"]["doc"] == hidden_key
+        assert ws.outgoing.empty()
+    finally:
+        ws.incoming.put(None)
+        session.join(5)
+        client.delete(f"/api/documents/{doc_id}")
+    assert not session.is_alive()
+
+
+def _sse_events(response):
+    """逐个解析 SSE 事件为 (event, id, data)，跳过 keepalive 注释"""
+    for chunk in response.response:
+        chunk = chunk.decode() if isinstance(chunk, bytes) else chunk
+        if chunk.startswith(":"):
+            continue
+        fields = dict(line.split(": ", 1) for line in chunk.strip().splitlines())
+        yield fields["event"], fields.get("id"), json.loads(fields["data"])
+
+
+def test_events_stream_selection_summary_and_modifications(client, office, monkeypatch):
+    monkeypatch.setattr(impress_api, "SSE_KEEPALIVE", 0.05)
+    doc = office.reset(shapes=2)
+    response = client.get("/api/events", buffered=False)
+    assert response.mimetype == "text/event-stream"
+    events = _sse_events(response)
+    try:
+        event, _, data = next(events)
+        assert event == "selection" and data["selection_count"] == 0
+
+        shape = doc.getDrawPages().getByIndex(0).getByIndex(1)
+        doc.getCurrentController().select(shape)
+        event, event_id, data = next(events)
+        assert event == "selection"
+        assert int(event_id) == tracker.selection_generation(tracker.key(doc))
+        assert data["selection_count"] == 1
+        assert data["shapes"][0]["text"] == shape.getString()
+        assert "formatting" not in data["shapes"][0]
+
+        shape.setString("edited")
+        event, _, data = next(events)
+        assert event == "modified"
+        assert data["generation"] == tracker.generation(tracker.key(doc))
+    finally:
+        response.close()
+
+    # 只订阅修改事件时不推送选区；没有事件时先收到 keepalive
+    response = client.get("/api/events?types=modified", buffered=False)
+    events = _sse_events(response)
+    try:
+        doc.getCurrentController().select(None)
+        shape.setString("edited again")
+        event, _, _ = next(events)
+        assert event == "modified"
+    finally:
+        response.close()
+
+
+def test_reads_reconnect_after_office_restart(client, office, monkeypatch):
+    office.reset(slides=2, shapes=3)
+    assert client.get("/api/slide/0").status_code == 200
+    reconnects = impress_api.connection.status()["reconnects"]
+
+    # soffice 重启:旧 Desktop 的调用抛 DisposedException，读接口自动重连
+    office.restart(slides=2, shapes=4)
+    response = client.get("/api/slide/0")
+    assert response.status_code == 200
+    assert len(response.json["shapes"]) == 4
+    health = client.get("/api/health").json
+    assert health["connection"]["state"] == "connected"
+    assert health["connection"]["reconnects"] == reconnects + 1
+
+    # 读到一半桥接断开:重连后重试一次
+    calls = []
+    get_slide_content = impress_api.get_slide_content
+
+    def flaky(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == 1:
+            raise fake_uno.DisposedException("Binary URP bridge disposed during call")
+        return get_slide_content(*args, **kwargs)
+
+    monkeypatch.setattr(impress_api, "get_slide_content", flaky)
+    response = client.get("/api/slide/1")
+    assert response.status_code == 200 and len(calls) == 2
+    assert impress_api.connection.status()["reconnects"] == reconnects + 2
+
+    # 重连不上时返回 503 并附带连接状态
+    def disconnect(*args, **kwargs):
+        monkeypatch.setattr(impress_api.connection, "get_desktop", lambda: None)
+        raise fake_uno.DisposedException("Binary URP bridge disposed during call")
+
+    monkeypatch.setattr(impress_api, "get_slide_content", disconnect)
+    response = client.get("/api/slide/1")
+    assert response.status_code == 503
+    assert response.json["connection"]["state"] == "disconnected"
+
+
+def test_reads_probe_only_after_disconnect_like_failures(client, office, monkeypatch):
+    office.reset(slides=2, shapes=2)
+    probes = []
+    probe = impress_api.connection.probe
+    monkeypatch.setattr(impress_api.connection, "probe", lambda: probes.append(1) or probe())
+
+    # 普通的 404 与 error 字段不探测桥接
+    assert client.get("/api/slide/9").status_code == 404
+    monkeypatch.setattr(impress_api, "get_presentation_info", lambda *a: {"error": "boom"})
+    assert client.get("/api/presentation/info").json == {"error": "boom"}
+    assert probes == []
+
+    # 辅助函数吞掉的断开异常:探测一次，桥接可用则原样返回
+    def disposed(doc):
+        impress_api.note_read_error(fake_uno.DisposedException("bridge disposed"))
+        return None
+
+    monkeypatch.setattr(impress_api, "get_current_slide", disposed)
+    assert client.get("/api/slide/current").status_code == 404
+    assert probes == [1]
+
+
+def test_field_and_type_projection(client, office):
+    office.reset(shapes=20, table=(3, 3), notes="speaker notes")
+    full = client.get("/api/slide/0?include_formatting=true").json
+    assert "notes" in full and "formatting" in full["shapes"][0]
+
+    response = client.get("/api/slide/0?fields=text,position")
+    shapes = response.json["shapes"]
+    assert "notes" not in response.json
+    assert {key for shape in shapes for key in shape} == {"index", "text", "position"}
+    assert [s["text"] for s in shapes] == [s.get("text") for s in full["shapes"]]
+
+    # 未请求的字段不读 UNO
+    before = office.bridge.calls
+    client.get("/api/slide/0?fields=text")
+    projected = office.bridge.calls - before
+    before = office.bridge.calls
+    client.get("/api/slide/0?include_formatting=true")
+    assert projected < (office.bridge.calls - before) / 2
+
+    tables = client.get("/api/slide/0?fields=table&types=TableShape").json["shapes"]
+    assert [list(s) for s in tables] == [["index", "table"]]
+    assert tables[0]["index"] == 20 and tables[0]["table"]["rows"] == 3
+
+    office.select_all()
+    selection = client.get("/api/slide/selection?fields=text,size&types=TextShape").json
+    assert selection["shapes"] and all(set(s) == {"index", "text", "size"} for s in selection["shapes"])
+
+    response = client.get("/api/slide/0?fields=text,colour")
+    assert response.status_code == 400
+    assert "colour" in response.json["error"] and "text" in response.json["available"]
+
+
+def test_add_image_traced_keeps_cache_free_of_request_proxies(client, office):
+    from impress_graphics import graphics
+    from impress_uno_trace import TracedUno
+
+    office.reset()
+    graphics.clear()
+    body = {"data": base64.b64encode(b"\x89PNG" + bytes(64)).decode(), "width": 4000}
+    traced = {"X-Uno-Trace": "summary"}
+    first = client.post("/api/slide/add-image", json=body, headers=traced)
+    assert first.status_code == 200, first.json
+    assert first.json["graphic_cached"] is False
+    assert (first.json["width"], first.json["height"]) == (4000, 3000)  # 640x480 原图比例
+    assert not any(isinstance(g, TracedUno) for g in graphics._graphics.values())
+
+    second = client.post(
+        "/api/slide/add-image", json={**body, "width": None, "height": 1500}, headers=traced
+    )
+    assert second.json["graphic_cached"] is True
+    assert (second.json["width"], second.json["height"]) == (2000, 1500)
+    assert office.decoded_graphics == 1
+
+
+def test_document_registry_keeps_raw_handles_when_traced(client, office):
+    from impress_uno_trace import TracedUno
+
+    office.reset()
+    traced = {"X-Uno-Trace": "summary"}
+    opened = client.post("/api/documents/open", json={"hidden": True}, headers=traced).json
+    adopted = client.post("/api/documents/adopt", headers=traced).json
+    try:
+        for doc_id in (opened["doc_id"], adopted["doc_id"]):
+            assert not isinstance(impress_api.documents.get(doc_id), TracedUno)
+    finally:
+        client.delete(f"/api/documents/{opened['doc_id']}")
+
+
+def test_format_batch_groups_edits_per_shape_and_range(client, office, monkeypatch):
+    doc = office.reset(shapes=2)
+    calls = []
+    set_values = fake_uno.FakeTextCursor.setPropertyValues
+
+    def counting(self, names, values):
+        calls.append(tuple(names))
+        return set_values(self, names, values)
+
+    monkeypatch.setattr(fake_uno.FakeTextCursor, "setPropertyValues", counting)
+    edits = [
+        {"shape_index": 0, "formatting": {"bold": True}},
+        {"shape_index": 0, "formatting": {"font_size": 30}},
+        {"shape_index": 1, "start": 0, "end": 5, "formatting": {"italic": True}},
+        {"shape_index": 0, "formatting": {"color": 255, "font_size": 32}},
+        {"shape_index": 1, "formatting": {"italic": False}},
+        # 与上一项重叠且在其之后:不能并入第 3 项，否则会被上一项覆盖
+        {"shape_index": 1, "start": 0, "end": 5, "formatting": {"italic": True}},
+        {"shape_index": 0, "formatting": {"colour": 1}},
+        {"shape_index": 0, "start": 3, "end": 999, "formatting": {"bold": True}},
+    ]
+    response = client.post("/api/slide/format", json={"edits": edits})
+    results = response.json["results"]
+    assert response.json["applied"] == 6
+    assert "colour" in results[6]["error"] and "Invalid range" in results[7]["error"]
+    assert calls == [
+        ("CharColor", "CharHeight", "CharWeight"),
+        ("CharPosture",),
+        ("CharPosture",),
+        ("CharPosture",),
+    ]
+
+    shapes = doc.getDrawPages().getByIndex(0)
+    first = shapes.getByIndex(0).createTextCursor()
+    assert (first.CharWeight, first.CharHeight, first.CharColor) == (150.0, 32.0, 255)
+    second = shapes.getByIndex(1).Text
+    assert [second._get_attr(i, "CharPosture") for i in (0, 6)] == [1, 0]
+
+
+def test_format_batch_reports_the_failing_edit_of_a_group(client, office, monkeypatch):
+    office.reset(shapes=1)
+    monkeypatch.delitem(fake_uno.CHAR_DEFAULTS, "CharStrikeout")
+    edits = [
+        {"shape_index": 0, "formatting": {"bold": True}},
+        {"shape_index": 0, "formatting": {"strikeout": True}},
+    ]
+    results = client.post("/api/slide/format", json={"edits": edits}).json["results"]
+    assert results[0]["status"] == "success"
+    assert "CharStrikeout" in results[1]["error"]
+
+
+def test_text_formatting_failures_reported_per_key(client, office):
+    office.reset()
+    body = {"text": "hello", "slide_index": 0, "formatting": {"bold": True, "alignment": "diagonal"}}
+    result = client.post("/api/slide/add-text", json=body).json
+    assert result["status"] == "success"
+    assert [e["key"] for e in result["formatting_errors"]] == ["alignment"]
+    shape = client.get("/api/slide/0?include_formatting=true").json["shapes"][result["shape_index"]]
+    assert shape["formatting"]["bold"] is True
+
+
+def test_search_matches_partial_words_with_original_offsets(client, office):
+    doc = office.reset(slides=2, shapes=2, table=(2, 2), notes="Speaker NOTES here")
+    page = doc.getDrawPages().getByIndex(0)
+    page.getByIndex(0).setString("İstanbul Shapes and reshaped SHAPE")
+    page.getByIndex(1).setString("unrelated")
+
+    hits = client.get("/api/search?q=shape").json["results"]
+    first = next(h for h in hits if h["slide_index"] == 0 and h["shape_index"] == 0)
+    text = first["text"]
+    assert [text[a:b] for a, b in first["matches"]] == ["Shape", "shape", "SHAPE"]
+    assert first["matches"][0] == [9, 14]
+
+    # 首词按后缀、末词按前缀匹配，中间词必须完全相同
+    hits = client.get("/api/search?q=bul shapes an").json["results"]
+    assert [(h["slide_index"], h["matches"]) for h in hits] == [(0, [[5, 18]])]
+    assert client.get("/api/search?q=bul shape an").json["results"] == []
+
+    cells = client.get("/api/search?q=r1c").json["results"]
+    assert {(h["kind"], h["row"]) for h in cells if h["slide_index"] == 0} == {("cell", 1)}
+    notes = client.get("/api/search?q=notes").json["results"]
+    assert notes and all(h["kind"] == "notes" for h in notes)
+
+    # 被替换的词移出词表，不再命中
+    page.getByIndex(0).setString("plain")
+    assert not [h for h in client.get("/api/search?q=hape").json["results"] if h["slide_index"] == 0]
+    vocabulary = impress_api.search_index._docs[tracker.key(doc)].vocabulary
+    assert "shapes" not in vocabulary.words and "reshaped" not in vocabulary.containing("hap")
+
+
+def test_template_cache_evicts_least_recently_used(tmp_path):
+    cache = TemplateCache(max_bytes=30)
+    a, b, c = (cache.put(bytes([i]) * 10, name) for i, name in enumerate("abc"))
+    assert cache.stats() == {"count": 3, "bytes": 30, "max_bytes": 30}
+
+    # 取用过的模板移到最近端，淘汰的是最久未用的 b
+    assert cache.get(a).name == "a"
+    d = cache.put(b"d" * 10, "d")
+    assert cache.get(b) is None
+    assert [t["sha256"] for t in cache.list()] == [d, a, c]
+    assert cache.stats()["bytes"] == 30
+
+    # 超过容量的单个文件不缓存，也不挤掉已有模板
+    big = cache.put(b"x" * 31, "big")
+    assert cache.get(big) is None and cache.stats()["count"] == 3
+
+    # 路径来源:文件变了重新读取，淘汰后再次加载会重新放回缓存
+    path = tmp_path / "deck.pptx"
+    path.write_bytes(b"e" * 10)
+    first = cache.from_path(str(path))
+    assert cache.from_path(str(path)) is cache.get(first.sha256)
+    path.write_bytes(b"f" * 12)
+    second = cache.from_path(str(path))
+    assert second.sha256 != first.sha256 and second.data == b"f" * 12
+    assert cache.stats()["bytes"] <= 30
+
+
+def test_add_table_fill_reads_back(client, office):
+    office.reset(slides=1, shapes=1)
+    response = client.post(
+        "/api/slide/add-table",
+        json={"rows": 3, "columns": 3, "data": [["Name", "Score"], ["a", 1.5], [None]]},
+    )
+    assert response.status_code == 200
+    assert response.json["shape_index"] == 1 and response.json["fill"] == "cells"
+
+    table = client.get("/api/slide/0").json["shapes"][1]["table"]
+    assert (table["rows"], table["columns"]) == (3, 3)
+    # 短行补空，None 写成空串，数字按字符串写入
+    assert table["data"] == [["Name", "Score", ""], ["a", "1.5", ""], ["", "", ""]]
+
+    # rows/columns 缺省取 data 的大小
+    response = client.post("/api/slide/add-table", json={"data": [["x"], ["y", "z"]]})
+    assert (response.json["rows"], response.json["columns"]) == (2, 2)
+    table = client.get("/api/slide/0").json["shapes"][2]["table"]
+    assert table["data"] == [["x", ""], ["y", "z"]]
+
+    response = client.post("/api/slide/add-table", json={"rows": 1, "columns": 1, "data": [["a", "b"]]})
+    assert response.status_code == 400
+
+
+def _ndjson(response):
+    assert response.mimetype == "application/x-ndjson"
+    return [json.loads(line) for line in response.data.splitlines() if line]
+
+
+def test_presentation_content_start_count_ranges(client, office):
+    office.reset(slides=5, shapes=1)
+    lines = _ndjson(client.get("/api/presentation/content?start=1&count=2"))
+    assert [line["type"] for line in lines] == ["presentation", "slide", "slide", "end"]
+    assert (lines[0]["total_slides"], lines[0]["start"], lines[0]["count"]) == (5, 1, 2)
+    assert [line["slide_index"] for line in lines[1:3]] == [1, 2]
+    assert lines[1]["shapes"][0]["text"] == "Slide 1 shape 0"
+    assert lines[-1]["slides"] == 2
+
+    # count 缺省读到末尾；超出范围截断到总页数
+    lines = _ndjson(client.get("/api/presentation/content?start=3"))
+    assert [line.get("slide_index") for line in lines[1:-1]] == [3, 4]
+    lines = _ndjson(client.get("/api/presentation/content?start=4&count=9"))
+    assert lines[0]["count"] == 1 and lines[-1]["slides"] == 1
+    lines = _ndjson(client.get("/api/presentation/content?start=7"))
+    assert lines[0]["count"] == 0 and [line["type"] for line in lines] == ["presentation", "end"]
+    lines = _ndjson(client.get("/api/presentation/content?count=0"))
+    assert lines[-1]["slides"] == 0
+
+    assert client.get("/api/presentation/content?start=-1").status_code == 400
+    assert client.get("/api/presentation/content?count=-2").status_code == 400
+
+
+def test_screen_boxes_follow_visible_area(client, office):
+    doc = office.reset(slides=1, shapes=2)
+    page = doc.getDrawPages().getByIndex(0)
+    page.getByIndex(0).Position = fake_uno.Point(5000, 2500)
+    page.getByIndex(0).Size = fake_uno.Size(7000, 3500)
+    page.getByIndex(1).Position = fake_uno.Point(20000, 9000)
+    controller = doc.getCurrentController()
+
+    # 编辑视图在屏幕 (300, 150)，1120x630 像素显示 28000x15750:0.04 px / (1/100 mm)
+    body = client.get("/api/slide/screen-boxes").json
+    transform = body["transform"]
+    assert (transform["scale_x"], transform["scale_y"]) == (0.04, 0.04)
+    assert (transform["offset_x"], transform["offset_y"]) == (300, 150)
+    assert body["shapes"][0]["box"] == {"x": 500, "y": 250, "width": 280, "height": 140}
+    assert [s["on_screen"] for s in body["shapes"]] == [True, True]
+
+    # 放大两倍并滚动到 (2000, 1000):偏移 = 窗口原点 - 可见区域原点 * 比例
+    controller.VisibleArea = fake_uno.Rectangle(2000, 1000, 14000, 7875)
+    body = client.get("/api/slide/screen-boxes").json
+    transform = body["transform"]
+    assert (transform["scale_x"], transform["scale_y"]) == (0.08, 0.08)
+    assert (transform["offset_x"], transform["offset_y"]) == (140, 70)
+    assert body["shapes"][0]["box"] == {"x": 540, "y": 270, "width": 560, "height": 280}
+    assert body["shapes"][1]["box"]["x"] == 1740
+    assert [s["on_screen"] for s in body["shapes"]] == [True, False]
+
+    # 屏幕坐标的命中测试按同一换算回到幻灯片坐标
+    hits = client.get("/api/slide/0/hit-test?x=600&y=300&coords=screen").json["shapes"]
+    assert [h["index"] for h in hits] == [0]
+    assert hits[0]["box"] == body["shapes"][0]["box"]
@@ -0,0 +1,268 @@
+"""
+各端点在 1 / 50 / 500 个形状与最多 30x30 表格下的基准
+
+    pytest benchmarks --benchmark-autosave
+    pytest benchmarks --benchmark-compare --benchmark-compare-fail=mean:20%
+"""
+
+import base64
+
+import pytest
+
+SHAPE_COUNTS = [1, 50, 500]
+TABLE_SIZES = [(5, 5), (15, 15), (30, 30)]
+
+READ_ENDPOINTS = [
+    "/api/presentation/info",
+    "/api/slide/current",
+    "/api/slide/current?include_formatting=false",
+    "/api/slide/0",
+    "/api/slide/0?include_formatting=true",
+    "/api/slide/0?include_formatting=true&format=msgpack",
+    "/api/slide/0?runs=true",
+    "/api/slide/0?fields=text",
+    "/api/slide/0?fields=position,size&types=TableShape",
+    "/api/slide/selection",
+    "/api/slide/selection/summary",
+    "/api/slide/text-selection",
+    "/api/slide/background",
+    "/api/health",
+    "/metrics",
+]
+
+
+def _get(client, url):
+    response = client.get(url)
+    assert response.status_code == 200, response.data
+    return response
+
+
+@pytest.mark.parametrize("url", READ_ENDPOINTS)
+@pytest.mark.parametrize("shapes", SHAPE_COUNTS)
+def test_read_endpoint(benchmark, client, office, url, shapes):
+    office.reset(shapes=shapes)
+    office.select_all()
+    benchmark.extra_info["bridge_calls"] = _bridge_calls(office, client, url)
+    benchmark(_get, client, url)
+
+
+@pytest.mark.parametrize("table", TABLE_SIZES, ids=lambda t: f"{t[0]}x{t[1]}")
+@pytest.mark.parametrize(
+    "url", ["/api/slide/current", "/api/slide/0", "/api/slide/selection"]
+)
+def test_table_read(benchmark, client, office, url, table):
+    office.reset(shapes=1, table=table)
+    office.select_all()
+    benchmark.extra_info["bridge_calls"] = _bridge_calls(office, client, url)
+    benchmark(_get, client, url)
+
+
+@pytest.mark.parametrize("shapes", SHAPE_COUNTS)
+def test_add_text(benchmark, client, office, shapes):
+    def setup():
+        office.reset(shapes=shapes)
+
+    body = {
+        "text": "benchmark",
+        "slide_index": 0,
+        "formatting": {"bold": True, "font_size": 24, "alignment": "center"},
+    }
+    benchmark.pedantic(
+        client.post,
+        args=("/api/slide/add-text",),
+        kwargs={"json": body},
+        setup=setup,
+        rounds=20,
+    )
+
+
+def test_add_image(benchmark, client, office):
+    def setup():
+        office.reset()
+
+    body = {
+        "data": base64.b64encode(b"\xff\xd8" + bytes(32 * 1024)).decode(),
+        "slide_index": 0,
+        "width": 4000,
+    }
+    client.post("/api/slide/add-image", json=body)  # 预先解码，之后都命中缓存
+    response = benchmark.pedantic(
+        client.post,
+        args=("/api/slide/add-image",),
+        kwargs={"json": body},
+        setup=setup,
+        rounds=20,
+    )
+    assert response.json["graphic_cached"]
+
+
+@pytest.mark.parametrize("table", TABLE_SIZES, ids=lambda t: f"{t[0]}x{t[1]}")
+def test_add_table(benchmark, client, office, table):
+    def setup():
+        office.reset()
+
+    rows, cols = table
+    body = {"data": [[f"R{r}C{c}" for c in range(cols)] for r in range(rows)]}
+    benchmark.extra_info["bridge_calls"] = _bridge_calls_for(
+        office, lambda: client.post("/api/slide/add-table", json=body)
+    )
+    response = benchmark.pedantic(
+        client.post,
+        args=("/api/slide/add-table",),
+        kwargs={"json": body},
+        setup=setup,
+        rounds=10,
+    )
+    assert response.json["status"] == "success"
+
+
+@pytest.mark.parametrize("shapes", SHAPE_COUNTS)
+def test_update_shape(benchmark, client, office, shapes):
+    office.reset(shapes=shapes)
+    body = {
+        "slide_index": 0,
+        "shape_index": shapes - 1,
+        "text": "updated",
+        "formatting": {"italic": True},
+    }
+    response = benchmark(client.put, "/api/slide/update-shape", json=body)
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize("shapes", [50])
+def test_format_batch(benchmark, client, office, shapes):
+    office.reset(shapes=shapes)
+    body = {
+        "slide_index": 0,
+        "edits": [
+            {"shape_index": i, "formatting": {"bold": True, "font_size": 20, "color": 255}}
+            for i in range(shapes)
+        ],
+    }
+    benchmark.extra_info["bridge_calls"] = _bridge_calls_for(
+        office, lambda: client.post("/api/slide/format", json=body)
+    )
+    response = benchmark(client.post, "/api/slide/format", json=body)
+    assert response.json["failed"] == 0
+
+
+@pytest.mark.parametrize("shapes", SHAPE_COUNTS)
+def test_new_and_delete_slide(benchmark, client, office, shapes):
+    office.reset(shapes=shapes)
+
+    def new_then_delete():
+        client.post("/api/slide/new", json={"position": 0})
+        return client.delete("/api/slide/0")
+
+    response = benchmark(new_then_delete)
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize("shapes", [1, 50])
+def test_presentation_content(benchmark, client, office, shapes):
+    """整份 20 页的 NDJSON 流式导出"""
+    office.reset(slides=20, shapes=shapes)
+
+    def dump():
+        response = client.get("/api/presentation/content")
+        return response.get_data()
+
+    body = benchmark(dump)
+    assert body.count(b"\n") == 22
+
+
+@pytest.mark.parametrize("shapes", SHAPE_COUNTS)
+def test_screen_boxes(benchmark, client, office, shapes):
+    """几何与视图换算都已缓存时的屏幕外接框"""
+    office.reset(shapes=shapes)
+    url = "/api/slide/screen-boxes"
+    _get(client, url)
+    benchmark.extra_info["bridge_calls"] = _bridge_calls(office, client, url)
+    response = benchmark(_get, client, url)
+    assert len(response.json["shapes"]) == shapes
+
+
+@pytest.mark.parametrize("shapes", SHAPE_COUNTS)
+def test_hit_test(benchmark, client, office, shapes):
+    """网格索引已建好时的点查询"""
+    office.reset(shapes=shapes)
+    url = "/api/slide/0/hit-test?x=1100&y=1100"
+    _get(client, url)
+    benchmark.extra_info["bridge_calls"] = _bridge_calls(office, client, url)
+    response = benchmark(_get, client, url)
+    assert response.json["shapes"][0]["index"] == 0
+
+
+def test_search(benchmark, client, office):
+    """100 页、索引已建好时的全文检索"""
+    office.reset(slides=100, shapes=20, table=(3, 3), notes="Speaker notes")
+    url = "/api/search?q=shape%207"
+    _get(client, url)
+    benchmark.extra_info["bridge_calls"] = _bridge_calls(office, client, url)
+    response = benchmark(_get, client, url)
+    assert response.json["count"] == 100
+
+
+def test_snapshot_diff(benchmark, client, office):
+    """20 页中改了一页后，快照与当前状态的 diff"""
+    office.reset(slides=20, shapes=20)
+    snapshot_id = client.post("/api/snapshots").json["snapshot_id"]
+    client.put(
+        "/api/slide/update-shape", json={"slide_index": 3, "shape_index": 0, "text": "edited"}
+    )
+    url = f"/api/snapshots/{snapshot_id}/diff"
+    _get(client, url)
+    benchmark.extra_info["bridge_calls"] = _bridge_calls(office, client, url)
+    response = benchmark(_get, client, url)
+    assert [s["slide_index"] for s in response.json["slides"]] == [3]
+
+
+def test_connect(benchmark, client, office):
+    response = benchmark(client.post, "/api/connect")
+    assert response.status_code == 200
+
+
+def test_template_load(benchmark, client, office):
+    sha256 = client.post(
+        "/api/templates?name=deck.pptx",
+        data=b"PK" + bytes(64 * 1024),
+        content_type="application/octet-stream",
+    ).json["sha256"]
+
+    def load_and_close():
+        response = client.post(
+            "/api/templates/load", json={"sha256": sha256, "hidden": True}
+        )
+        client.delete(f"/api/documents/{response.json['doc_id']}")
+        return response
+
+    response = benchmark(load_and_close)
+    assert response.status_code == 200
+
+
+def _bridge_calls(office, client, url):
+    """单次请求的桥接调用次数，记录到基准结果的 extra_info 里"""
+    return _bridge_calls_for(office, lambda: _get(client, url))
+
+
+@pytest.mark.parametrize(
+    "url", ["/api/slide/current", "/api/slide/0", "/api/presentation/info"]
+)
+@pytest.mark.parametrize("shapes", SHAPE_COUNTS)
+def test_conditional_get(benchmark, client, office, url, shapes):
+    office.reset(shapes=shapes)
+    etag = _get(client, url).headers["ETag"]
+
+    def revalidate():
+        response = client.get(url, headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        return response
+
+    benchmark.extra_info["bridge_calls"] = _bridge_calls_for(office, revalidate)
+    benchmark(revalidate)
+
+
+def _bridge_calls_for(office, fn):
+    before = office.bridge.calls
+    fn()
+    return office.bridge.calls - before
@@ -0,0 +1,975 @@
+"""
+进程内的假 UNO 模型（用于基准测试与压测，不需要 LibreOffice）
+
+覆盖 impress_api 用到的对象:Desktop、DrawPages、形状、文本光标、TableShape 模型、
+Controller/Selection、剪贴板。每次公开属性访问/方法调用都会经过 FakeBridge，
+可配置单次调用延迟来模拟 URP 桥接往返。
+
+用法:
+    import fake_uno
+    office = fake_uno.install()          # 必须在 import impress_api 之前
+    office.reset(slides=1, shapes=50)
+    import impress_api
+"""
+
+import sys
+import time
+import types
+
+CHAR_DEFAULTS = {
+    "CharFontName": "Liberation Sans",
+    "CharHeight": 18.0,
+    "CharColor": -1,
+    "CharWeight": 100.0,
+    "CharPosture": 0,
+    "CharStrikeout": 0,
+    "CharUnderline": 0,
+    "ParaAdjust": 0,
+}
+
+
+class FakeBridge:
+    """统计调用次数，并按 latency（秒）模拟每次桥接往返"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+
+    def tick(self):
+        self.calls += 1
+        if self.latency > 0:
+            if self.latency >= 0.001:
+                time.sleep(self.latency)
+            else:
+                # 亚毫秒级延迟 sleep 不准，忙等
+                end = time.perf_counter() + self.latency
+                while time.perf_counter() < end:
+                    pass
+
+
+BRIDGE = FakeBridge()
+
+
+class FakeUnoObject:
+    """所有公开属性访问都计为一次桥接调用"""
+
+    def __getattribute__(self, name):
+        if not name.startswith("_"):
+            BRIDGE.tick()
+        return object.__getattribute__(self, name)
+
+    def queryInterface(self, *args):
+        return self
+
+    def supportsService(self, name):
+        return name in self._services
+
+    _services = ()
+    _parent = None
+
+    def _notify_modified(self):
+        """沿 _parent 链找到所属文档并广播修改事件"""
+        node = self
+        while node is not None:
+            fire = getattr(type(node), "_fire_modified", None)
+            if fire is not None:
+                fire(node)
+                return
+            node = node._parent
+
+
+# ---------------------------------------------------------------- 结构体与枚举
+
+
+class Point:
+    def __init__(self, X=0, Y=0):
+        self.X = X
+        self.Y = Y
+
+
+class Size:
+    def __init__(self, Width=0, Height=0):
+        self.Width = Width
+        self.Height = Height
+
+
+class Rectangle:
+    def __init__(self, X=0, Y=0, Width=0, Height=0):
+        self.X = X
+        self.Y = Y
+        self.Width = Width
+        self.Height = Height
+
+
+class PropertyValue:
+    def __init__(self, Name="", Handle=0, Value=None, State=None):
+        self.Name = Name
+        self.Handle = Handle
+        self.Value = Value
+        self.State = State
+
+
+class Enum:
+    def __init__(self, typeName, value):
+        self.typeName = typeName
+        self.value = value
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, Enum)
+            and other.typeName == self.typeName
+            and other.value == self.value
+        )
+
+    def __hash__(self):
+        return hash((self.typeName, self.value))
+
+    def __repr__(self):
+        return f"<uno.Enum {self.typeName} ({self.value!r})>"
+
+
+class EventObject:
+    def __init__(self, Source=None):
+        self.Source = Source
+
+
+class DataFlavor:
+    def __init__(self, MimeType, HumanPresentableName=""):
+        self.MimeType = MimeType
+        self.HumanPresentableName = HumanPresentableName
+
+
+# ---------------------------------------------------------------- 文本
+
+
+class FakeText(FakeUnoObject):
+    """带逐字符属性的文本；光标按区间读写属性"""
+
+    def __init__(self, string=""):
+        self._string = ""
+        self._attrs = []
+        self.setString(string)
+
+    def getString(self):
+        return self._string
+
+    def setString(self, string):
+        self._string = string
+        self._attrs = [CHAR_DEFAULTS] * len(string)
+        self._notify_modified()
+
+    @property
+    def String(self):
+        return self._string
+
+    def createTextCursor(self):
+        return FakeTextCursor(self, 0, 0)
+
+    def createEnumeration(self):
+        """段落枚举:按换行切分"""
+        paragraphs = []
+        start = 0
+        for line in self._string.split("\n"):
+            paragraphs.append(FakeParagraph(self, start, start + len(line)))
+            start += len(line) + 1
+        return FakeEnumeration(paragraphs)
+
+    def _get_attr(self, start, name):
+        if not self._attrs:
+            return CHAR_DEFAULTS[name]
+        return self._attrs[min(start, len(self._attrs) - 1)][name]
+
+    def _set_attr(self, start, end, name, value):
+        if start == end:
+            start, end = 0, len(self._attrs)
+        for i in range(start, end):
+            self._attrs[i] = {**self._attrs[i], name: value}
+        self._notify_modified()
+
+
+class FakeEnumeration(FakeUnoObject):
+    def __init__(self, items):
+        self._items = list(items)
+        self._pos = 0
+
+    def hasMoreElements(self):
+        return self._pos < len(self._items)
+
+    def nextElement(self):
+        item = self._items[self._pos]
+        self._pos += 1
+        return item
+
+
+class FakeTextPortion(FakeUnoObject):
+    def __init__(self, text, start, end):
+        self._text = text
+        self._start = start
+        self._end = end
+
+    def getString(self):
+        return self._text._string[self._start : self._end]
+
+    def getPropertyValue(self, name):
+        return self._text._get_attr(self._start, name)
+
+    def getPropertyValues(self, names):
+        return tuple(self._text._get_attr(self._start, name) for name in names)
+
+
+class FakeParagraph(FakeTextPortion):
+    @property
+    def ParaAdjust(self):
+        return self._text._get_attr(self._start, "ParaAdjust")
+
+    def createEnumeration(self):
+        """文本片段枚举:属性相同的连续字符为一个片段"""
+        portions = []
+        attrs = self._text._attrs
+        start = self._start
+        for i in range(self._start + 1, self._end + 1):
+            if i == self._end or attrs[i] != attrs[start]:
+                portions.append(FakeTextPortion(self._text, start, i))
+                start = i
+        return FakeEnumeration(portions)
+
+
+class UnknownPropertyException(Exception):
+    pass
+
+
+class FakeTextCursor(FakeUnoObject):
+    def __init__(self, text, start, end):
+        object.__setattr__(self, "_text", text)
+        object.__setattr__(self, "_start", start)
+        object.__setattr__(self, "_end", end)
+
+    def __getattr__(self, name):
+        if name in CHAR_DEFAULTS:
+            return self._text._get_attr(min(self._start, self._end), name)
+        raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        BRIDGE.tick()
+        if name in CHAR_DEFAULTS:
+            lo, hi = sorted((self._start, self._end))
+            self._text._set_attr(lo, hi, name, value)
+        else:
+            raise AttributeError(name)
+
+    def getPropertyValue(self, name):
+        return getattr(self, name)
+
+    def setPropertyValue(self, name, value):
+        if name not in CHAR_DEFAULTS:
+            raise UnknownPropertyException(name)
+        setattr(self, name, value)
+
+    def setPropertyValues(self, names, values):
+        """XMultiPropertySet:一次桥接往返设置多个属性"""
+        BRIDGE.tick()
+        for name in names:
+            if name not in CHAR_DEFAULTS:
+                raise UnknownPropertyException(name)
+        lo, hi = sorted((self._start, self._end))
+        for name, value in zip(names, values):
+            self._text._set_attr(lo, hi, name, value)
+
+    def getString(self):
+        lo, hi = sorted((self._start, self._end))
+        return self._text._string[lo:hi]
+
+    def gotoStart(self, expand):
+        object.__setattr__(self, "_end", 0)
+        if not expand:
+            object.__setattr__(self, "_start", 0)
+
+    def gotoEnd(self, expand):
+        object.__setattr__(self, "_end", len(self._text._string))
+        if not expand:
+            object.__setattr__(self, "_start", self._end)
+
+    def goRight(self, count, expand):
+        end = min(self._end + count, len(self._text._string))
+        object.__setattr__(self, "_end", end)
+        if not expand:
+            object.__setattr__(self, "_start", end)
+        return True
+
+    def collapseToStart(self):
+        lo = min(self._start, self._end)
+        object.__setattr__(self, "_start", lo)
+        object.__setattr__(self, "_end", lo)
+
+
+# ---------------------------------------------------------------- 形状
+
+
+class FakePropertySetInfo(FakeUnoObject):
+    def __init__(self, owner):
+        self._owner = owner
+
+    def hasPropertyByName(self, name):
+        return name in self._owner._properties
+
+
+class FakeShape(FakeUnoObject):
+    _properties = ("Position", "Size", "Name")
+
+    def __init__(self, shape_type, x=0, y=0, width=1000, height=1000, text=""):
+        self._type = shape_type
+        self.Position = Point(x, y)
+        self.Size = Size(width, height)
+        self.Name = ""
+        self._text = FakeText(text)
+        self._text._parent = self
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if not name.startswith("_"):
+            BRIDGE.tick()
+            self._notify_modified()
+
+    def getShapeType(self):
+        return self._type
+
+    @property
+    def BoundRect(self):
+        return Rectangle(self.Position.X, self.Position.Y, self.Size.Width, self.Size.Height)
+
+    @property
+    def ShapeType(self):
+        return self._type
+
+    @property
+    def Text(self):
+        return self._text
+
+    def getString(self):
+        return self._text._string
+
+    def setString(self, string):
+        self._text.setString(string)
+
+    def createTextCursor(self):
+        return self._text.createTextCursor()
+
+    def getPropertySetInfo(self):
+        return FakePropertySetInfo(self)
+
+
+class FakeCell(FakeUnoObject):
+    def __init__(self, string=""):
+        self._text = FakeText(string)
+        self._text._parent = self
+
+    def getString(self):
+        return self._text._string
+
+    def setString(self, string):
+        self._text.setString(string)
+
+
+class FakeTableRows(FakeUnoObject):
+    def __init__(self, model, axis):
+        self._model = model
+        self._axis = axis
+
+    def getCount(self):
+        return self._model._size[self._axis]
+
+    def insertByIndex(self, index, count):
+        self._model._resize(self._axis, self.getCount() + count)
+        self._model._notify_modified()
+
+
+class FakeTableModel(FakeUnoObject):
+    def __init__(self, rows=1, cols=1):
+        self._size = [0, 0]
+        self._cells = []
+        self._resize(0, rows)
+        self._resize(1, cols)
+
+    def _resize(self, axis, count):
+        self._size[axis] = count
+        rows, cols = self._size
+        self._cells = [
+            [
+                self._cells[r][c]
+                if r < len(self._cells) and c < len(self._cells[r])
+                else self._new_cell()
+                for c in range(cols)
+            ]
+            for r in range(rows)
+        ]
+
+    def _new_cell(self):
+        cell = FakeCell()
+        cell._parent = self
+        return cell
+
+    @property
+    def Rows(self):
+        return FakeTableRows(self, 0)
+
+    @property
+    def Columns(self):
+        return FakeTableRows(self, 1)
+
+    def getCellByPosition(self, col, row):
+        return self._cells[row][col]
+
+    def lockBroadcasts(self):
+        pass
+
+    def unlockBroadcasts(self):
+        pass
+
+
+class FakeTableShape(FakeShape):
+    def __init__(self, rows=1, cols=1, x=0, y=0, width=10000, height=5000):
+        super().__init__("com.sun.star.drawing.TableShape", x, y, width, height)
+        self._model = FakeTableModel(rows, cols)
+        self._model._parent = self
+
+    @property
+    def Model(self):
+        return self._model
+
+    def fill(self, value=lambda r, c: f"R{r}C{c}"):
+        for r, row in enumerate(self._model._cells):
+            for c, cell in enumerate(row):
+                cell.setString(value(r, c))
+        return self
+
+
+class FakeDrawPage(FakeUnoObject):
+    _properties = ("FillStyle", "Number", "MasterPage")
+
+    def __init__(self, number=1, notes=True):
+        self._shapes = []
+        self._notes = FakeDrawPage(notes=False) if notes else None
+        if self._notes is not None:
+            self._notes._parent = self
+        self.Number = number
+        self.FillStyle = Enum("com.sun.star.drawing.FillStyle", "NONE")
+        self.MasterPage = None
+
+    def getCount(self):
+        return len(self._shapes)
+
+    def getByIndex(self, index):
+        if not 0 <= index < len(self._shapes):
+            raise IndexError(index)
+        return self._shapes[index]
+
+    def add(self, shape):
+        shape._parent = self
+        self._shapes.append(shape)
+        self._notify_modified()
+
+    def remove(self, shape):
+        self._shapes.remove(shape)
+        self._notify_modified()
+
+    def getNotesPage(self):
+        return self._notes
+
+    def getPropertySetInfo(self):
+        return FakePropertySetInfo(self)
+
+
+class FakeDrawPages(FakeUnoObject):
+    def __init__(self, doc):
+        self._doc = doc
+        self._parent = doc
+        self._pages = []
+
+    def getCount(self):
+        return len(self._pages)
+
+    def getByIndex(self, index):
+        if not 0 <= index < len(self._pages):
+            raise IndexError(index)
+        return self._pages[index]
+
+    def insertNewByIndex(self, index):
+        page = FakeDrawPage()
+        page._parent = self
+        self._pages.insert(min(index, len(self._pages)), page)
+        self._renumber()
+        self._notify_modified()
+        return page
+
+    def remove(self, page):
+        self._pages.remove(page)
+        self._renumber()
+        controller = self._doc._controller
+        if controller is not None and controller._page is page:
+            controller._page = self._pages[0] if self._pages else None
+        self._notify_modified()
+
+    def _renumber(self):
+        for i, page in enumerate(self._pages):
+            page.Number = i + 1
+
+
+# ---------------------------------------------------------------- 控制器与文档
+
+
+class FakeSelection(FakeUnoObject):
+    def __init__(self, shapes):
+        self._shapes = list(shapes)
+
+    def getCount(self):
+        return len(self._shapes)
+
+    def getByIndex(self, index):
+        return self._shapes[index]
+
+
+class FakeAccessible(FakeUnoObject):
+    """无障碍树节点（兼作 XAccessibleContext 与 XAccessibleComponent）"""
+
+    def __init__(self, role, children=(), x=0, y=0, width=0, height=0):
+        self._role = role
+        self._children = list(children)
+        self._rect = Rectangle(x, y, width, height)
+
+    def getAccessibleContext(self):
+        return self
+
+    def getAccessibleRole(self):
+        return self._role
+
+    def getAccessibleChildCount(self):
+        return len(self._children)
+
+    def getAccessibleChild(self, index):
+        return self._children[index]
+
+    def getLocationOnScreen(self):
+        return Point(self._rect.X, self._rect.Y)
+
+    def getSize(self):
+        return Size(self._rect.Width, self._rect.Height)
+
+
+DOCUMENT_PRESENTATION = 84
+
+
+class FakeWindow(FakeUnoObject):
+    def __init__(self, x, y, width, height, accessible=None):
+        self._rect = Rectangle(x, y, width, height)
+        self._accessible = accessible
+
+    def getPosSize(self):
+        return self._rect
+
+    def getAccessibleContext(self):
+        return self._accessible
+
+
+class FakeFrame(FakeUnoObject):
+    """1920x1080 的窗口:左侧幻灯片窗格 260px，编辑视图在 (300, 150) 处 1120x630"""
+
+    def __init__(self, controller):
+        self._controller = controller
+        view = FakeAccessible(DOCUMENT_PRESENTATION, x=300, y=150, width=1120, height=630)
+        panes = FakeAccessible(0, [FakeAccessible(0), view])
+        self._container = FakeWindow(0, 0, 1920, 1080, FakeAccessible(0, [panes]))
+        self._component = FakeWindow(0, 60, 1920, 1000)
+
+    def getContainerWindow(self):
+        return self._container
+
+    def getComponentWindow(self):
+        return self._component
+
+
+class FakeController(FakeUnoObject):
+    def __init__(self, doc):
+        self._doc = doc
+        self._page = None
+        self._selection = None
+        self._frame = FakeFrame(self)
+        self._selection_listeners = []
+        # 1120x630 像素显示 28000x15750（1/100 mm）的区域
+        self.VisibleArea = Rectangle(0, 0, 28000, 15750)
+        self.ZoomValue = 40
+
+    def addSelectionChangeListener(self, listener):
+        self._selection_listeners.append(listener)
+
+    def removeSelectionChangeListener(self, listener):
+        self._selection_listeners.remove(listener)
+
+    def getCurrentPage(self):
+        return self._page
+
+    def setCurrentPage(self, page):
+        self._page = page
+
+    def getSelection(self):
+        return self._selection
+
+    def select(self, selection):
+        if selection is None:
+            self._selection = None
+        elif isinstance(selection, (list, tuple)):
+            self._selection = FakeSelection(selection)
+        else:
+            self._selection = FakeSelection([selection])
+        event = EventObject(self)
+        for listener in list(self._selection_listeners):
+            listener.selectionChanged(event)
+        return True
+
+    def getFrame(self):
+        return self._frame
+
+
+class DisposedException(Exception):
+    """对应 com.sun.star.lang.DisposedException:桥接另一端或对象已经不在了"""
+
+
+class FakePresentation(FakeUnoObject):
+    _services = (
+        "com.sun.star.presentation.PresentationDocument",
+        "com.sun.star.document.OfficeDocument",
+    )
+
+    _next_uid = 1
+
+    def __init__(self, title="Untitled 1", url="", hidden=False):
+        self._title = title
+        self._url = url
+        self._pages = FakeDrawPages(self)
+        self._controller = None if hidden else FakeController(self)
+        self._modify_listeners = []
+        self._event_listeners = []
+        self._closed = False
+        self._locks = 0
+        self.RuntimeUID = str(FakePresentation._next_uid)
+        FakePresentation._next_uid += 1
+
+    def addModifyListener(self, listener):
+        self._modify_listeners.append(listener)
+
+    def removeModifyListener(self, listener):
+        self._modify_listeners.remove(listener)
+
+    def _fire_modified(self):
+        event = EventObject(self)
+        for listener in list(self._modify_listeners):
+            listener.modified(event)
+
+    def lockControllers(self):
+        self._locks += 1
+
+    def unlockControllers(self):
+        self._locks -= 1
+
+    def addEventListener(self, listener):
+        self._event_listeners.append(listener)
+
+    def removeEventListener(self, listener):
+        self._event_listeners.remove(listener)
+
+    def close(self, deliver_ownership):
+        if self._closed:
+            raise DisposedException("document already closed")
+        self._closed = True
+        event = EventObject(self)
+        for listener in list(self._event_listeners) + list(self._modify_listeners):
+            listener.disposing(event)
+
+    def getURL(self):
+        return self._url
+
+    def getDrawPages(self):
+        return self._pages
+
+    def getCurrentController(self):
+        return self._controller
+
+    def getTitle(self):
+        return self._title
+
+    def createInstance(self, service):
+        if service == "com.sun.star.drawing.TableShape":
+            return FakeTableShape()
+        return FakeShape(service)
+
+
+class FakeTransferable(FakeUnoObject):
+    def __init__(self, text):
+        self._text = text
+
+    def getTransferDataFlavors(self):
+        return (DataFlavor("text/plain;charset=utf-16", "Unicode-Text"),)
+
+    def getTransferData(self, flavor):
+        return self._text
+
+
+class FakeClipboard(FakeUnoObject):
+    def __init__(self):
+        self._contents = FakeTransferable("")
+
+    def getContents(self):
+        return self._contents
+
+
+class FakeDispatchHelper(FakeUnoObject):
+    def __init__(self, office):
+        self._office = office
+
+    def executeDispatch(self, frame, url, target, flags, args):
+        if url == ".uno:Copy":
+            selection = frame._controller._selection
+            shapes = selection._shapes if selection else []
+            text = "\n".join(shape._text._string for shape in shapes)
+            self._office.clipboard._contents = FakeTransferable(text)
+        return None
+
+
+class FakeDesktop(FakeUnoObject):
+    def __init__(self, office):
+        self._office = office
+        self._disposed = False
+
+    def getCurrentComponent(self):
+        if self._disposed:
+            raise DisposedException("Binary URP bridge disposed during call")
+        return self._office.document
+
+    def loadComponentFromURL(self, url, target, flags, props):
+        if self._disposed:
+            raise DisposedException("Binary URP bridge disposed during call")
+        return self._office.load(url, {p.Name: p.Value for p in props})
+
+    def getComponents(self):
+        if self._disposed:
+            raise DisposedException("Binary URP bridge disposed during call")
+        return FakeEnumerationAccess(self._office.open_documents())
+
+
+class FakeEnumerationAccess(FakeUnoObject):
+    def __init__(self, items):
+        self._items = list(items)
+
+    def createEnumeration(self):
+        return FakeEnumeration(self._items)
+
+
+class FakeUrlResolver(FakeUnoObject):
+    def __init__(self, office):
+        self._office = office
+
+    def resolve(self, url):
+        return self._office.context
+
+
+class ByteSequence:
+    def __init__(self, value):
+        self.value = bytes(value)
+
+
+class FakeInputStream(FakeUnoObject):
+    """com.sun.star.io.SequenceInputStream"""
+
+    def __init__(self):
+        self._data = b""
+
+    def initialize(self, args):
+        self._data = args[0].value
+
+
+class FakeGraphic(FakeUnoObject):
+    def __init__(self, data):
+        self._data = data
+        self.SizePixel = Size(640, 480)
+        self.Size100thMM = Size(0, 0)
+
+
+class FakeGraphicProvider(FakeUnoObject):
+    def __init__(self, office):
+        self._office = office
+
+    def queryGraphic(self, props):
+        values = {p.Name: p.Value for p in props}
+        if any(not isinstance(v, FakeUnoObject) for v in values.values()):
+            # 与 pyuno 一致:结构体字段里的 Python 代理对象无法转换为 UNO 接口
+            raise RuntimeError("pyuno: cannot convert PropertyValue.Value to a UNO object")
+        self._office.decoded_graphics += 1
+        return FakeGraphic(values["InputStream"]._data)
+
+
+class FakeServiceManager(FakeUnoObject):
+    def __init__(self, office):
+        self._office = office
+
+    def createInstanceWithContext(self, name, ctx):
+        office = self._office
+        if name == "com.sun.star.frame.Desktop":
+            return office.desktop
+        if name == "com.sun.star.bridge.UnoUrlResolver":
+            return FakeUrlResolver(office)
+        if name == "com.sun.star.frame.DispatchHelper":
+            return FakeDispatchHelper(office)
+        if name == "com.sun.star.datatransfer.clipboard.SystemClipboard":
+            return office.clipboard
+        if name == "com.sun.star.graphic.GraphicProvider":
+            return FakeGraphicProvider(office)
+        if name == "com.sun.star.io.SequenceInputStream":
+            return FakeInputStream()
+        raise RuntimeError(f"fake_uno: unsupported service {name}")
+
+
+class FakeContext(FakeUnoObject):
+    def __init__(self, office):
+        self._office = office
+
+    @property
+    def ServiceManager(self):
+        return FakeServiceManager(self._office)
+
+
+class FakeOffice:
+    """一个假的 soffice 进程:上下文、Desktop、当前文档与剪贴板"""
+
+    def __init__(self):
+        self.context = FakeContext(self)
+        self.desktop = FakeDesktop(self)
+        self.clipboard = FakeClipboard()
+        self.document = None
+        self.documents = []
+        self.decoded_graphics = 0
+        self.reset()
+
+    @property
+    def bridge(self):
+        return BRIDGE
+
+    def reset(self, slides=1, shapes=0, table=None, notes="", latency=None):
+        """
+        重建当前演示文稿:slides 张幻灯片，每张 shapes 个文本框；
+        table=(rows, cols) 时每张再加一个已填充的表格
+        """
+        if latency is not None:
+            BRIDGE.latency = latency
+        doc = FakePresentation()
+        for s in range(slides):
+            page = doc._pages.insertNewByIndex(s)
+            for i in range(shapes):
+                page.add(
+                    FakeShape(
+                        "com.sun.star.drawing.TextShape",
+                        x=1000 + (i % 20) * 1200,
+                        y=1000 + (i // 20) * 600,
+                        width=1000,
+                        height=500,
+                        text=f"Slide {s} shape {i}",
+                    )
+                )
+            if table:
+                page.add(FakeTableShape(*table).fill())
+            if notes:
+                page._notes.add(
+                    FakeShape("com.sun.star.presentation.NotesShape", text=notes)
+                )
+        doc._controller._page = doc._pages._pages[0] if slides else None
+        if self.document in self.documents:
+            self.documents.remove(self.document)
+        self.document = doc
+        self.documents.append(doc)
+        return doc
+
+    def load(self, url, props):
+        """loadComponentFromURL:新建一份单页演示文稿；非 Hidden 时获得焦点"""
+        hidden = bool(props.get("Hidden"))
+        title = url.rsplit("/", 1)[-1] if url.startswith("file:") else "Untitled 2"
+        doc = FakePresentation(title, url="" if url.startswith("private:") else url, hidden=hidden)
+        page = doc._pages.insertNewByIndex(0)
+        if doc._controller is not None:
+            doc._controller._page = page
+        doc._load_props = props
+        self.documents.append(doc)
+        if not hidden:
+            self.document = doc
+        return doc
+
+    def restart(self, **reset_kwargs):
+        """模拟 soffice 重启:旧 Desktop 失效（调用抛 DisposedException），换一套新的"""
+        self.desktop._disposed = True
+        self.desktop = FakeDesktop(self)
+        self.documents = []
+        return self.reset(**reset_kwargs)
+
+    def open_documents(self):
+        """Desktop.getComponents():当前进程里尚未关闭的文档"""
+        return [doc for doc in self.documents if not doc._closed]
+
+    def select_all(self):
+        page = self.document._controller._page
+        self.document._controller.select(list(page._shapes))
+
+
+OFFICE = None
+
+
+def _module(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    return module
+
+
+def install():
+    """
+    用假模块替换 uno / com.sun.star.*，返回 FakeOffice。
+    会覆盖已存在的真实 uno 模块，只应在基准测试/压测进程里调用。
+    """
+    global OFFICE
+    if OFFICE is not None:
+        return OFFICE
+    OFFICE = FakeOffice()
+    local_context = FakeContext(OFFICE)
+
+    _module(
+        "uno",
+        getComponentContext=lambda: local_context,
+        Enum=Enum,
+        systemPathToFileUrl=lambda path: "file://" + path,
+        ByteSequence=ByteSequence,
+        createUnoStruct=lambda name, *args: {
+            "com.sun.star.awt.Point": Point,
+            "com.sun.star.awt.Size": Size,
+            "com.sun.star.awt.Rectangle": Rectangle,
+            "com.sun.star.beans.PropertyValue": PropertyValue,
+        }[name](*args),
+    )
+    _module("unohelper", Base=type("Base", (), {}))
+    _module("com")
+    _module("com.sun")
+    _module("com.sun.star")
+    _module("com.sun.star.awt", Point=Point, Size=Size, Rectangle=Rectangle)
+    _module("com.sun.star.accessibility")
+    _module(
+        "com.sun.star.accessibility.AccessibleRole",
+        DOCUMENT_PRESENTATION=DOCUMENT_PRESENTATION,
+    )
+    _module("com.sun.star.beans", PropertyValue=PropertyValue)
+    _module("com.sun.star.lang", XEventListener=type("XEventListener", (), {}))
+    _module("com.sun.star.style")
+    _module(
+        "com.sun.star.style.ParagraphAdjust", LEFT=0, RIGHT=1, BLOCK=2, CENTER=3
+    )
+    _module("com.sun.star.util", XModifyListener=type("XModifyListener", (), {}))
+    _module(
+        "com.sun.star.view",
+        XSelectionSupplier=type("XSelectionSupplier", (), {}),
+        XSelectionChangeListener=type("XSelectionChangeListener", (), {}),
+    )
+    return OFFICE
@@ -1,17 +1,71 @@
+import base64
+import binascii
+import functools
 import os
 
 
 import uno
 from com.sun.star.awt import Point, Size
-from com.sun.star.beans import PropertyValue
-from flask import Flask, jsonify, request
+from flask import (
+    Flask,
+    Response,
+    g,
+    has_app_context,
+    has_request_context,
+    jsonify,
+    request,
+    stream_with_context,
+)
 import logging
 import sys
 import json
+import queue
+import threading
+import time
+import zlib
+
+from impress_metrics import (
+    CONTENT_TYPE as METRICS_CONTENT_TYPE,
+    ERRORS,
+    IN_FLIGHT,
+    REGISTRY,
+    REQUEST_LATENCY,
+    REQUESTS,
+)
+from impress_codec import dumps_json, negotiated_response
+from impress_connection import connection
+from impress_deadline import (
+    DeadlineExceeded,
+    abandon_hung_calls,
+    call_with_deadline,
+    hung_calls,
+)
+from impress_documents import UnknownDocument, documents
+from impress_events import ALL_SLIDES, hub, tracker
+from impress_geometry import geometry, spatial, view_transforms
+from impress_graphics import graphics
+from impress_rpc import RpcSession
+from impress_search import search_index
+from impress_snapshots import UnknownSnapshot, diff_states, snapshots
+from impress_supervisor import supervisor
+from impress_templates import input_stream, templates
+from impress_trajectory import (
+    KEYFRAME_INTERVAL,
+    TrajectoryReader,
+    UnknownTrajectory,
+    trajectories,
+    trajectory_path,
+)
+from impress_uno_trace import UnoCallRecorder, wrap as uno_trace_wrap
 
 
 from com.sun.star.style.ParagraphAdjust import LEFT, RIGHT, CENTER, BLOCK
 
+try:
+    from flask_sock import Sock
+except ImportError:
+    Sock = None
+
 # 设置日志
 logging.basicConfig(
     level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
@@ -19,8 +73,43 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
-desktop = None
-ctx = None
+
+# UNO 调用计量:IMPRESS_UNO_TRACE=1|chrome 对所有请求开启，
+# 也可按请求用 X-Uno-Trace 头或 uno_trace 参数开启。
+# 按请求开启的 chrome 模式会写文件，需服务端 IMPRESS_UNO_TRACE_ALLOW_CHROME=1 才生效
+# （否则降级为 summary）；目录里最多保留 IMPRESS_UNO_TRACE_MAX_FILES 个文件
+UNO_TRACE_DEFAULT = os.environ.get("IMPRESS_UNO_TRACE", "")
+UNO_TRACE_DIR = os.environ.get("IMPRESS_UNO_TRACE_DIR", "uno_traces")
+UNO_TRACE_ALLOW_CHROME = (
+    os.environ.get("IMPRESS_UNO_TRACE_ALLOW_CHROME", "0") == "1"
+    or UNO_TRACE_DEFAULT.lower() == "chrome"
+)
+UNO_TRACE_MAX_FILES = int(os.environ.get("IMPRESS_UNO_TRACE_MAX_FILES", "200"))
+
+# 启动时后台连接 LibreOffice 并预热（IMPRESS_EAGER_CONNECT=0 关闭）
+EAGER_CONNECT = os.environ.get("IMPRESS_EAGER_CONNECT", "1") != "0"
+
+# 由本进程启动并监管 soffice（见 impress_supervisor）
+SUPERVISE = os.environ.get("IMPRESS_SUPERVISE", "").lower() in ("1", "true", "yes")
+
+# 直接运行时是否启用 debug reloader（IMPRESS_RELOADER=0 关闭）
+USE_RELOADER = os.environ.get("IMPRESS_RELOADER", "1") != "0"
+
+# 每个请求的硬超时（秒，0 关闭）；可用 X-Deadline 头按请求覆盖
+CALL_DEADLINE = float(os.environ.get("IMPRESS_CALL_DEADLINE", "30"))
+# 仍卡着的超时调用达到这个数时直接拒绝新请求，不再往卡死的 soffice 上堆线程
+MAX_HUNG_CALLS = int(os.environ.get("IMPRESS_MAX_HUNG_CALLS", "4"))
+# 长连接/不触碰 UNO 的端点不套超时
+DEADLINE_EXEMPT = {"static", "api_events", "api_rpc", "api_metrics", "api_supervisor_status"}
+# 超时后用这么长的 probe 判断桥接是否还可用；只有 probe 也卡住才丢弃桥接
+DEADLINE_PROBE_TIMEOUT = float(os.environ.get("IMPRESS_DEADLINE_PROBE_TIMEOUT", "2"))
+
+# SSE 无事件时的心跳间隔（秒）
+SSE_KEEPALIVE = float(os.environ.get("IMPRESS_SSE_KEEPALIVE", "15"))
+
+# 选区结果缓存:doc_key -> (selection_generation, generation, result)
+_selection_cache = {}
+_selection_cache_lock = threading.Lock()
 
 
 def extract_table_info(table_shape):
@@ -69,6 +158,7 @@ def extract_table_info(table_shape):
         return {"rows": rows, "columns": cols, "data": data}
 
     except Exception as e:
+        note_read_error(e)
         import traceback
 
         return {
@@ -108,61 +198,261 @@ def extract_formatting(shape):
                 else False
             ),
             "alignment": (
-                {0: "left", 1: "right", 2: "center", 3: "justify"}.get(
-                    text_cursor.ParaAdjust, "unknown"
-                )
+                ALIGNMENT_NAMES.get(text_cursor.ParaAdjust, "unknown")
                 if hasattr(text_cursor, "ParaAdjust")
                 else "unknown"
             ),
         }
     except Exception as e:
+        note_read_error(e)
         formatting = {"error": f"formatting extraction failed: {str(e)}"}
     return formatting
 
 
+# 文本片段（portion）上按顺序读取的字符属性
+RUN_PROPERTIES = (
+    "CharFontName",
+    "CharHeight",
+    "CharWeight",
+    "CharPosture",
+    "CharStrikeout",
+    "CharColor",
+)
+# com.sun.star.style.ParagraphAdjust 的取值:LEFT=0, RIGHT=1, BLOCK=2, CENTER=3
+ALIGNMENT_NAMES = {0: "left", 1: "right", 2: "justify", 3: "center"}
+
+
+def _portion_values(portion):
+    """一次 getPropertyValues 读出 RUN_PROPERTIES；不支持时逐个读"""
+    try:
+        return portion.getPropertyValues(RUN_PROPERTIES)
+    except Exception:
+        return tuple(portion.getPropertyValue(name) for name in RUN_PROPERTIES)
+
+
+def extract_formatting_runs(shape, max_runs=None):
+    """
+    单遍枚举段落与文本片段，返回游程编码的格式区间:
+    {"runs": [{"start", "end", "text", "font", "font_size", "bold", "italic",
+               "strikeout", "color", "alignment"}, ...], "truncated": bool}
+    start/end 是在 shape.getString() 中的字符偏移（段落之间隔一个换行符）；
+    相邻且属性相同的片段（含跨段落）合并为一个区间。max_runs 限制返回的区间数，
+    达到上限后不再继续读取。
+    """
+    runs = []
+    offset = 0
+    truncated = False
+    try:
+        paragraphs = shape.Text.createEnumeration()
+        first = True
+        while paragraphs.hasMoreElements():
+            paragraph = paragraphs.nextElement()
+            if not first:
+                offset += 1  # 段落分隔符
+            first = False
+            alignment = ALIGNMENT_NAMES.get(paragraph.ParaAdjust, "unknown")
+
+            portions = paragraph.createEnumeration()
+            while portions.hasMoreElements():
+                portion = portions.nextElement()
+                text = portion.getString()
+                if not text:
+                    continue
+                font, height, weight, posture, strikeout, color = _portion_values(portion)
+                attrs = {
+                    "font": font,
+                    "font_size": float(height),
+                    "bold": weight == 150.0,
+                    "italic": posture != 0,
+                    "strikeout": strikeout != 0,
+                    "color": color,
+                    "alignment": alignment,
+                }
+                start, end = offset, offset + len(text)
+                offset = end
+
+                last = runs[-1] if runs else None
+                if last is not None and last["attrs"] == attrs:
+                    gap = start - last["end"]
+                    last["text"] += "\n" * gap + text
+                    last["end"] = end
+                    continue
+                if max_runs is not None and len(runs) >= max_runs:
+                    truncated = True
+                    break
+                runs.append({"start": start, "end": end, "text": text, "attrs": attrs})
+            if truncated:
+                break
+    except Exception as e:
+        note_read_error(e)
+        return {"error": f"run extraction failed: {str(e)}"}
+
+    return {
+        "runs": [
+            {"start": r["start"], "end": r["end"], "text": r["text"], **r["attrs"]}
+            for r in runs
+        ],
+        "truncated": truncated,
+    }
+
+
+def _route_label():
+    rule = request.url_rule
+    return rule.rule if rule is not None else "unmatched"
+
+
+def count_error(kind, route=None):
+    """记一次错误；已按具体原因记过的请求，after_request 不再按状态码重复计数"""
+    ERRORS.inc(route or _route_label(), kind)
+    g.error_counted = True
+
+
+# 请求指标
+@app.before_request
+def _metrics_before_request():
+    g.metrics_start = time.perf_counter()
+    IN_FLIGHT.inc()
+
+
+@app.after_request
+def _metrics_after_request(response):
+    start = g.pop("metrics_start", None)
+    if start is not None:
+        route = _route_label()
+        REQUEST_LATENCY.observe(time.perf_counter() - start, route, request.method)
+        REQUESTS.inc(route, request.method, response.status_code)
+        if response.status_code >= 400 and not g.pop("error_counted", False):
+            ERRORS.inc(route, f"http_{response.status_code // 100}xx")
+    return response
+
+
+@app.teardown_request
+def _metrics_teardown_request(exc):
+    IN_FLIGHT.dec()
+
+
+def _uno_trace_mode():
+    mode = (
+        request.headers.get("X-Uno-Trace")
+        or request.args.get("uno_trace")
+        or UNO_TRACE_DEFAULT
+    ).lower()
+    if mode in ("1", "true", "summary"):
+        return "summary"
+    if mode == "chrome":
+        return "chrome" if UNO_TRACE_ALLOW_CHROME else "summary"
+    return None
+
+
+@app.before_request
+def _uno_trace_before_request():
+    mode = _uno_trace_mode()
+    if mode:
+        g.uno_trace = UnoCallRecorder(chrome_trace=(mode == "chrome"))
+
+
+@app.after_request
+def _uno_trace_after_request(response):
+    recorder = g.pop("uno_trace", None)
+    if recorder is not None:
+        response.headers["X-Uno-Trace-Summary"] = recorder.summary_header()
+        if recorder.events is not None:
+            try:
+                path = recorder.write_chrome_trace(
+                    UNO_TRACE_DIR,
+                    f"{request.method} {request.path}",
+                    max_files=UNO_TRACE_MAX_FILES,
+                )
+                response.headers["X-Uno-Trace-File"] = path
+            except OSError as e:
+                logger.error(f"写入 UNO trace 失败: {e}")
+    return response
+
+
+def traced(obj):
+    """若当前请求开启了 UNO 计量，返回包装后的对象"""
+    if not has_app_context():
+        return obj
+    return uno_trace_wrap(obj, g.get("uno_trace"))
+
+
+def note_read_error(e):
+    """读辅助函数把异常吞成 error 字段或 None 时调用:记下像桥接断开的异常，供读接口决定是否探测"""
+    if has_app_context() and connection.is_disconnect_error(e):
+        g.bridge_error = True
+
+
+def api_response(result, status=200):
+    """把处理函数返回的 dict 按内容协商序列化为响应，并统计带 error 字段的结果"""
+    if isinstance(result, dict) and "error" in result and status < 400:
+        count_error("error_payload")
+        g.error_payload = True
+    return negotiated_response(result, request, status)
+
+
 # 添加错误处理
 @app.errorhandler(Exception)
 def handle_exception(e):
     logger.error(f"Unhandled exception: {e}", exc_info=True)
+    count_error("exception")
     return jsonify({"error": str(e)}), 500
 
 
-def connect_to_libreoffice():
-    """连接到正在运行的LibreOffice实例或启动新实例"""
-    global ctx
-    try:
-        logger.info("尝试连接到 LibreOffice...")
-        local_context = uno.getComponentContext()
-        logger.debug("获取本地上下文成功")
+@app.errorhandler(UnknownDocument)
+def handle_unknown_document(e):
+    return jsonify({"error": str(e), "doc_id": e.doc_id}), 404
 
-        resolver = local_context.ServiceManager.createInstanceWithContext(
-            "com.sun.star.bridge.UnoUrlResolver", local_context
-        )
-        logger.debug("创建解析器成功")
 
-        ctx = resolver.resolve(
-            "uno:socket,host=127.0.0.1,port=2002;urp;StarOffice.ComponentContext"
-        )
-        logger.info("成功连接到 LibreOffice!")
+@app.errorhandler(UnknownSnapshot)
+def handle_unknown_snapshot(e):
+    return jsonify({"error": str(e), "snapshot_id": e.snapshot_id}), 404
 
-        smgr = ctx.ServiceManager
-        desktop = smgr.createInstanceWithContext("com.sun.star.frame.Desktop", ctx)
-        return desktop
-    except Exception as e:
-        logger.error(f"连接 LibreOffice 失败: {e}", exc_info=True)
-        return None
+
+@app.errorhandler(UnknownTrajectory)
+def handle_unknown_trajectory(e):
+    return jsonify({"error": str(e), "episode": e.episode}), 404
+
+
+def connect_to_libreoffice(kind="connect"):
+    """连接到正在运行的LibreOffice实例，返回 Desktop"""
+    return connection.connect(kind)
+
+
+def request_doc_id():
+    """请求里指定的 doc_id:查询参数优先，其次 JSON body"""
+    doc_id = request.args.get("doc_id")
+    if doc_id is None and request.method not in ("GET", "HEAD"):
+        body = request.get_json(silent=True)
+        if isinstance(body, dict):
+            doc_id = body.get("doc_id")
+    return doc_id
 
 
 def get_current_presentation():
-    """获取当前活动演示文稿"""
-    global desktop
+    """获取请求指定的（doc_id）或当前活动的演示文稿"""
+    if has_request_context():
+        doc_id = request_doc_id()
+        if doc_id:
+            # 桥接断开过:先重连，重连回调会在新桥上找回注册的文档
+            if documents.stale and connection.get_desktop() is None:
+                return None
+            return traced(documents.get(doc_id))
+
+    desktop = connection.get_desktop()
     if not desktop:
-        desktop = connect_to_libreoffice()
+        return None
 
+    try:
+        doc = traced(desktop).getCurrentComponent()
+    except Exception as e:
+        if not connection.is_disconnect_error(e):
+            raise
+        # soffice 重启或崩溃:丢弃旧桥接，重连后再试一次
+        connection.mark_dead(str(e))
+        desktop = connection.get_desktop()
         if not desktop:
             return None
-
-    doc = desktop.getCurrentComponent()
+        doc = traced(desktop).getCurrentComponent()
     # 检查是否是演示文稿
     if doc and doc.supportsService("com.sun.star.presentation.PresentationDocument"):
         return doc
@@ -182,7 +472,8 @@ def get_current_slide(doc):
         logger.debug(f"Current page: {current_page}")
         return current_page
     except Exception as e:
-        print(f"Error getting current slide: {e}")
+        note_read_error(e)
+        logger.error(f"Error getting current slide: {e}")
         return None
 
 
@@ -204,7 +495,83 @@ def get_current_slide(doc):
 
 #     return False
 
-def get_current_selection(doc):
+SHAPE_FIELDS = frozenset(
+    ("type", "position", "size", "text", "formatting", "runs", "table", "notes")
+)
+
+
+class Projection:
+    """
+    ?fields= / ?types= 描述的字段投影:只读取请求的字段，未请求的 UNO 读取全部跳过。
+    fields 为 None 表示调用方的默认字段集；types 按形状类型全名或短名（TableShape）过滤。
+    """
+
+    def __init__(self, fields, types=None, max_runs=None):
+        self.fields = frozenset(fields)
+        self.types = tuple(types or ())
+        self.max_runs = max_runs
+
+    def wants(self, field):
+        return field in self.fields
+
+    def matches(self, shape_type):
+        if not self.types:
+            return True
+        short = shape_type.rsplit(".", 1)[-1]
+        return shape_type in self.types or short in self.types
+
+    @property
+    def needs_type(self):
+        return bool(self.types) or bool(self.fields & {"type", "table"})
+
+    @property
+    def key(self):
+        return (self.fields, self.types, self.max_runs)
+
+
+def slide_fields(include_formatting=True, include_runs=False):
+    """幻灯片接口的默认字段集"""
+    fields = {"type", "position", "size", "text", "table", "notes"}
+    if include_formatting:
+        fields.add("formatting")
+    if include_runs:
+        fields.add("runs")
+    return fields
+
+
+SELECTION_FIELDS = ("type", "text", "position", "size", "formatting", "table")
+
+
+def describe_shape(shape, projection, index=None, shape_type=None):
+    """按投影读取一个形状；已知类型时通过 shape_type 传入，避免重复读取"""
+    info = {} if index is None else {"index": index}
+    if shape_type is None and projection.needs_type:
+        shape_type = shape.getShapeType()
+    if projection.wants("type"):
+        info["type"] = shape_type
+    if projection.wants("position"):
+        position = shape.Position
+        info["position"] = {"x": position.X, "y": position.Y}
+    if projection.wants("size"):
+        size = shape.Size
+        info["size"] = {"width": size.Width, "height": size.Height}
+
+    text_fields = projection.fields & {"text", "formatting", "runs"}
+    if text_fields and hasattr(shape, "getString"):
+        text = shape.getString()
+        if projection.wants("text"):
+            info["text"] = text
+        if text and projection.wants("formatting"):
+            info["formatting"] = extract_formatting(shape)
+        if text and projection.wants("runs"):
+            info["runs"] = extract_formatting_runs(shape, projection.max_runs)
+
+    if projection.wants("table") and shape_type == "com.sun.star.drawing.TableShape":
+        info["table"] = extract_table_info(shape)
+    return info
+
+
+def get_current_selection(doc, projection=None):
     """获取当前选中的对象（shape），并提取文本及格式属性（若有）"""
     try:
         from com.sun.star.view import XSelectionSupplier
@@ -221,29 +588,28 @@ def get_current_selection(doc):
         if not selection:
             return {"status": "empty", "message": "No selection"}
 
+        if projection is None:
+            projection = Projection(SELECTION_FIELDS)
+
         def shape_info_from_shape(shape, index=None):
-            text = shape.getString() if hasattr(shape, "getString") else ""
-            info = {
-                "type": shape.getShapeType(),
-                "text": text,
-                "position": {"x": shape.Position.X, "y": shape.Position.Y},
-                "size": {"width": shape.Size.Width, "height": shape.Size.Height},
-            }
-            if index is not None:
-                info["index"] = index
-            if text:
-                info["formatting"] = extract_formatting(shape)
-            if shape.getShapeType() == "com.sun.star.drawing.TableShape":
-                info["table"] = extract_table_info(shape)
+            shape_type = shape.getShapeType() if projection.needs_type else None
+            if shape_type is not None and not projection.matches(shape_type):
+                return None
+            info = describe_shape(shape, projection, index, shape_type)
+            if projection.wants("text"):
+                info.setdefault("text", "")
             return info
 
-
         # 多个选中对象
         if hasattr(selection, "getCount"):
             count = selection.getCount()
             shapes = [
-                shape_info_from_shape(selection.getByIndex(i), index=i)
-                for i in range(count)
+                info
+                for info in (
+                    shape_info_from_shape(selection.getByIndex(i), index=i)
+                    for i in range(count)
+                )
+                if info is not None
             ]
             return {"status": "success", "selection_count": count, "shapes": shapes}
 
@@ -268,6 +634,7 @@ def get_current_selection(doc):
             return {"status": "unknown selection type"}
 
     except Exception as e:
+        note_read_error(e)
         import traceback
 
         return {
@@ -276,28 +643,85 @@ def get_current_selection(doc):
         }
 
 
-def get_selected_text(doc):
+def selection_summary(doc, max_text=200):
+    """选区的精简摘要:只读类型、文本（截断）与几何，不提取格式与表格"""
+    try:
+        selection = doc.getCurrentController().getSelection()
+        if not selection:
+            return {"status": "empty", "selection_count": 0, "shapes": []}
+
+        if hasattr(selection, "getCount"):
+            shapes = []
+            for i in range(selection.getCount()):
+                shape = selection.getByIndex(i)
+                text = shape.getString() if hasattr(shape, "getString") else ""
+                position, size = shape.Position, shape.Size
+                shapes.append(
+                    {
+                        "index": i,
+                        "type": shape.getShapeType(),
+                        "text": text[:max_text],
+                        "position": {"x": position.X, "y": position.Y},
+                        "size": {"width": size.Width, "height": size.Height},
+                    }
+                )
+            return {"status": "success", "selection_count": len(shapes), "shapes": shapes}
+
+        if hasattr(selection, "getString"):
+            return {"status": "editing", "text": selection.getString()[:max_text]}
+        return {"status": "unknown selection type"}
+    except Exception as e:
+        note_read_error(e)
+        return {"error": f"selection summary failed: {e}"}
+
+
+def cached_selection(doc, doc_key, compute, projection=None):
     """
-    doc  : 选填，XModel；若为 None，则用 ctx 去拿 current component
+    选区与文档都没变时复用上次结果（按 compute 与投影分别缓存）。
+    文本编辑态（editing）下光标移动不一定触发选区事件，这类结果不缓存。
     """
-    smgr = ctx.ServiceManager
-    desktop = smgr.createInstanceWithContext("com.sun.star.frame.Desktop", ctx)
+    if projection is not None:
+        compute = functools.partial(compute, projection=projection)
+        name = compute.func.__name__
+    else:
+        name = compute.__name__
+    sel_gen = tracker.selection_generation(doc_key)
+    gen = tracker.generation(doc_key)
+    if sel_gen is None or gen is None:
+        return compute(doc), None
+
+    cache_key = (doc_key, name, projection.key if projection is not None else None)
+    with _selection_cache_lock:
+        cached = _selection_cache.get(cache_key)
+    if cached is not None and cached[:2] == (sel_gen, gen):
+        return cached[2], (sel_gen, gen)
+
+    result = compute(doc)
+    if result.get("status") in ("success", "empty"):
+        with _selection_cache_lock:
+            _selection_cache[cache_key] = (sel_gen, gen, result)
+        return result, (sel_gen, gen)
+    return result, None
 
+
+def get_selected_text(doc):
+    """
+    doc  : 选填，XModel；若为 None，则取 current component
+    """
     if doc is None:
-        doc = desktop.getCurrentComponent()
+        doc = get_current_presentation()
     if not doc:
         return {"error": "no-document"}
 
     ctrl = doc.getCurrentController()
 
     try:
-        helper = smgr.createInstanceWithContext(
-            "com.sun.star.frame.DispatchHelper", ctx
-        )
+        # DispatchHelper / SystemClipboard 由连接管理器缓存复用
+        helper = traced(connection.service("com.sun.star.frame.DispatchHelper"))
         helper.executeDispatch(ctrl.getFrame(), ".uno:Copy", "", 0, ())
 
-        clip = smgr.createInstanceWithContext(
-            "com.sun.star.datatransfer.clipboard.SystemClipboard", ctx
+        clip = traced(
+            connection.service("com.sun.star.datatransfer.clipboard.SystemClipboard")
         )
         xfer = clip.getContents()
 
@@ -309,7 +733,8 @@ def get_selected_text(doc):
                 }
 
     except Exception as e:
-        print("clipboard fallback failed:", e)
+        note_read_error(e)
+        logger.warning(f"clipboard fallback failed: {e}")
 
     return {"error": "no-text-selection"}
 
@@ -325,7 +750,8 @@ def get_slide_by_index(doc, index):
             return None
         return draw_pages.getByIndex(index)
     except Exception as e:
-        print(f"Error getting slide by index: {e}")
+        note_read_error(e)
+        logger.error(f"Error getting slide by index: {e}")
         return None
 
 
@@ -408,12 +834,13 @@ def get_slide_background(doc, page_index=None):
         return info
 
     except Exception as e:
+        note_read_error(e)
         import traceback
 
         return {"error": str(e), "traceback": traceback.format_exc()}
 
 
-def get_presentation_info(doc):
+def get_presentation_info(doc, generation=None):
     """获取演示文稿基本信息"""
     if not doc:
         return {"error": "No presentation available"}
@@ -421,7 +848,8 @@ def get_presentation_info(doc):
     try:
         draw_pages = doc.getDrawPages()
         controller = doc.getCurrentController()
-        current_page = controller.getCurrentPage()
+        # Hidden 打开的文档没有 controller
+        current_page = controller.getCurrentPage() if controller is not None else None
 
         # 查找当前页面的索引
         current_index = -1
@@ -436,15 +864,22 @@ def get_presentation_info(doc):
             "presentation_name": (
                 doc.getTitle() if hasattr(doc, "getTitle") else "Untitled"
             ),
+            "generation": generation,
         }
 
         return info
     except Exception as e:
+        note_read_error(e)
         return {"error": str(e)}
 
 
-def get_slide_content(slide, include_formatting=True):
-    """获取幻灯片内容，包括形状、背景色、备注"""
+def get_slide_content(
+    slide, include_formatting=True, include_runs=False, max_runs=None, projection=None
+):
+    """
+    获取幻灯片内容，包括形状、背景色、备注；include_runs 时附带逐区间格式。
+    给出 projection 时只读取其中的字段（忽略 include_formatting / include_runs）
+    """
 
     def int_to_rgb(color_int):
         return {
@@ -456,32 +891,23 @@ def get_slide_content(slide, include_formatting=True):
     if slide is None:
         return {"error": "No slide provided"}
 
+    if projection is None:
+        projection = Projection(slide_fields(include_formatting, include_runs), max_runs=max_runs)
+
     try:
         shapes = []
         shape_count = slide.getCount()
 
         for i in range(shape_count):
             shape = slide.getByIndex(i)
-            shape_info = {
-                "index": i,
-                "type": shape.getShapeType(),
-                "position": {"x": shape.Position.X, "y": shape.Position.Y},
-                "size": {"width": shape.Size.Width, "height": shape.Size.Height},
-            }
-
-            # 提取文本
-            if hasattr(shape, "getString"):
-                text = shape.getString()
-                shape_info["text"] = text
-
-                if include_formatting and text:
-                    shape_info["formatting"] = extract_formatting(shape)
-
-            # 如果是表格
-            if shape.getShapeType() == "com.sun.star.drawing.TableShape":
-                shape_info["table"] = extract_table_info(shape)
+            shape_type = shape.getShapeType() if projection.needs_type else None
+            if shape_type is not None and not projection.matches(shape_type):
+                continue
+            shapes.append(describe_shape(shape, projection, i, shape_type))
 
-            shapes.append(shape_info)
+        result = {"status": "success", "shape_count": shape_count, "shapes": shapes}
+        if not projection.wants("notes"):
+            return result
 
         # 提取备注内容
         notes_text = ""
@@ -494,14 +920,11 @@ def get_slide_content(slide, include_formatting=True):
                     if text.strip():
                         notes_text += text + "\n"
 
-        return {
-            "status": "success",
-            "shape_count": shape_count,
-            "notes": notes_text.strip(),
-            "shapes": shapes,
-        }
+        result["notes"] = notes_text.strip()
+        return result
 
     except Exception as e:
+        note_read_error(e)
         import traceback
 
         return {"error": str(e), "traceback": traceback.format_exc()}
@@ -530,15 +953,133 @@ def add_text_shape(
         text_box = shape.Text
         text_box.setString(text)
 
+        result = {
+            "status": "success",
+            "message": "Text shape added",
+            "shape_index": slide.getCount() - 1,
+        }
         # 应用格式化
         if formatting:
-            text_cursor = shape.createTextCursor()
-            apply_text_formatting(text_cursor, formatting)
+            errors = apply_text_formatting(shape.createTextCursor(), formatting)
+            if errors:
+                result["formatting_errors"] = errors
+        return result
+    except Exception as e:
+        return {"error": str(e)}
+
+
+def graphic_size(graphic):
+    """图片原始大小（1/100 mm）；只有像素尺寸时按 96 DPI 换算"""
+    size = graphic.Size100thMM
+    if size.Width > 0 and size.Height > 0:
+        return size.Width, size.Height
+    pixels = graphic.SizePixel
+    return pixels.Width * 2540 // 96, pixels.Height * 2540 // 96
+
+
+def add_image_shape(doc, slide, graphic, x=1000, y=1000, width=None, height=None):
+    """在幻灯片上添加图片；width/height 只给一个时按原图比例推算另一个"""
+    if slide is None:
+        return {"error": "No slide provided"}
+
+    try:
+        if width is None or height is None:
+            natural_width, natural_height = graphic_size(graphic)
+            if width is None and height is None:
+                width, height = natural_width, natural_height
+            elif width is None:
+                width = round(height * natural_width / max(natural_height, 1))
+            else:
+                height = round(width * natural_height / max(natural_width, 1))
+
+        shape = doc.createInstance("com.sun.star.drawing.GraphicObjectShape")
+        shape.Graphic = graphic
+        shape.Position = Point(x, y)
+        shape.Size = Size(width, height)
+        slide.add(shape)
 
         return {
             "status": "success",
-            "message": "Text shape added",
+            "message": "Image shape added",
+            "shape_index": slide.getCount() - 1,
+            "width": width,
+            "height": height,
+        }
+    except Exception as e:
+        return {"error": str(e)}
+
+
+def fill_table(model, data):
+    """
+    把二维数组写入表格模型，返回写入方式:
+    优先一次 setDataArray 整块写入；Impress 的 svx 表格没有 XCellRangeData，
+    退回逐格 setString（期间 lockBroadcasts，避免每格触发一次重排与修改通知）
+    """
+    rows = len(data)
+    cols = max((len(row) for row in data), default=0)
+    if not rows or not cols:
+        return "none"
+    padded = tuple(
+        tuple("" if v is None else v for v in row) + ("",) * (cols - len(row)) for row in data
+    )
+
+    if hasattr(model, "getCellRangeByPosition"):
+        try:
+            cell_range = model.getCellRangeByPosition(0, 0, cols - 1, rows - 1)
+            if hasattr(cell_range, "setDataArray"):
+                cell_range.setDataArray(padded)
+                return "bulk"
+        except Exception as e:
+            logger.debug(f"setDataArray 不可用，逐格写入: {e}")
+
+    locked = hasattr(model, "lockBroadcasts")
+    if locked:
+        model.lockBroadcasts()
+    try:
+        get_cell = model.getCellByPosition
+        for r, row in enumerate(padded):
+            for c, value in enumerate(row):
+                if value != "":
+                    get_cell(c, r).setString(str(value))
+    finally:
+        if locked:
+            model.unlockBroadcasts()
+    return "cells"
+
+
+def add_table_shape(
+    doc, slide, rows, cols, x=1000, y=1000, width=20000, height=None, data=None
+):
+    """在幻灯片上添加 rows x cols 的表格，可选用 data 填充"""
+    if slide is None:
+        return {"error": "No slide provided"}
+
+    try:
+        # 整个创建过程锁住 controller，只在结束时重绘一次
+        doc.lockControllers()
+        try:
+            shape = doc.createInstance("com.sun.star.drawing.TableShape")
+            slide.add(shape)
+            model = shape.Model
+            # 新表格默认 1x1
+            if rows > 1:
+                model.Rows.insertByIndex(0, rows - 1)
+            if cols > 1:
+                model.Columns.insertByIndex(0, cols - 1)
+            fill = fill_table(model, data) if data else "none"
+            # 插入行列会改变大小，最后再设几何
+            shape.Position = Point(x, y)
+            shape.Size = Size(width, height if height is not None else rows * 1000)
+        finally:
+            doc.unlockControllers()
+
+        return {
+            "status": "success",
+            "message": "Table shape added",
             "shape_index": slide.getCount() - 1,
+            "rows": rows,
+            "columns": cols,
+            "fill": fill,
         }
     except Exception as e:
         return {"error": str(e)}
@@ -564,41 +1105,212 @@ def update_shape_text(slide, shape_index, new_text, formatting=None):
         shape.setString(new_text)
 
 
+        result = {"status": "success", "message": "Shape text updated"}
         # 应用格式化
         if formatting:
-            text_cursor = shape.createTextCursor()
-            apply_text_formatting(text_cursor, formatting)
-
-        return {"status": "success", "message": "Shape text updated"}
+            errors = apply_text_formatting(shape.createTextCursor(), formatting)
+            if errors:
+                result["formatting_errors"] = errors
+        return result
     except Exception as e:
         return {"error": str(e)}
 
 
 def apply_text_formatting(text_cursor, formatting):
-    """应用文本格式化"""
-    try:
-        if "font" in formatting and hasattr(text_cursor, "CharFontName"):
-            text_cursor.CharFontName = formatting["font"]
-        if "font_size" in formatting and hasattr(text_cursor, "CharHeight"):
-            text_cursor.CharHeight = float(formatting["font_size"])
-        if "color" in formatting and hasattr(text_cursor, "CharColor"):
-            text_cursor.CharColor = int(formatting["color"])
-        if "bold" in formatting and hasattr(text_cursor, "CharWeight"):
-            text_cursor.CharWeight = 150.0 if formatting["bold"] else 100.0
-        if "italic" in formatting and hasattr(text_cursor, "CharPosture"):
-            text_cursor.CharPosture = 1 if formatting["italic"] else 0
-
-        if "alignment" in formatting and hasattr(text_cursor, "ParaAdjust"):
-            alignment_map = {
-                "left": LEFT,
-                "right": RIGHT,
-                "center": CENTER,
-                "justify": BLOCK,
-            }
-            align_value = alignment_map.get(formatting["alignment"].lower(), LEFT)
-            text_cursor.ParaAdjust = align_value
+    """
+    逐项应用文本格式化（键同 FORMAT_PROPERTIES，不认识的键与对象不支持的属性跳过）；
+    单项失败不影响其他项，返回失败项 [{"key", "error"}]
+    """
+    errors = []
+    for key, value in formatting.items():
+        if key not in FORMAT_PROPERTIES:
+            continue
+        name, convert = FORMAT_PROPERTIES[key]
+        if not hasattr(text_cursor, name):
+            continue
+        try:
+            setattr(text_cursor, name, convert(value))
+        except Exception as e:
+            logger.warning(f"设置格式 {key}={value!r} 失败: {e}")
+            errors.append({"key": key, "error": str(e)})
+    return errors
+
+
+# 批量格式化:formatting 键 -> (属性名, 取值转换)
+FORMAT_PROPERTIES = {
+    "font": ("CharFontName", str),
+    "font_size": ("CharHeight", float),
+    "color": ("CharColor", int),
+    "bold": ("CharWeight", lambda v: 150.0 if v else 100.0),
+    "italic": ("CharPosture", lambda v: 1 if v else 0),
+    "underline": ("CharUnderline", lambda v: 1 if v else 0),
+    "strikeout": ("CharStrikeout", lambda v: 1 if v else 0),
+    "alignment": (
+        "ParaAdjust",
+        lambda v: {"left": LEFT, "right": RIGHT, "center": CENTER, "justify": BLOCK}[
+            v.lower()
+        ],
+    ),
+}
+
+
+def formatting_properties(formatting):
+    """
+    把 formatting dict 转成按名字排序的 (names, values)，供 setPropertyValues 一次写入
+    （XMultiPropertySet 要求属性名有序）；未知键或非法取值抛 ValueError
+    """
+    props = {}
+    for key, value in formatting.items():
+        if key not in FORMAT_PROPERTIES:
+            raise ValueError(f"Unknown formatting key: {key}")
+        name, convert = FORMAT_PROPERTIES[key]
+        try:
+            props[name] = convert(value)
+        except (KeyError, TypeError, ValueError, AttributeError):
+            raise ValueError(f"Invalid value for {key}: {value!r}")
+    names = tuple(sorted(props))
+    return names, tuple(props[name] for name in names)
+
+
+def set_properties(target, names, values):
+    """一次 setPropertyValues；失败时逐个设置，找出具体是哪个属性出错"""
+    try:
+        target.setPropertyValues(names, values)
+        return
     except Exception as e:
-        print(f"Error applying formatting: {e}")
+        batch_error = e
+    for name, value in zip(names, values):
+        try:
+            target.setPropertyValue(name, value)
+        except Exception as e:
+            raise ValueError(f"Cannot set {name}: {e}") from e
+    # 逐个设置都成功，说明批量接口本身不可用
+    logger.debug(f"setPropertyValues 失败，已逐个设置: {batch_error}")
+
+
+def text_range(shape, start, end):
+    """
+    校验并规整区间:返回 (start, end, 是否全文)。None 表示从头/到尾；
+    越界时抛 ValueError
+    """
+    length = len(shape.getString())
+    start = 0 if start is None else start
+    end = length if end is None else end
+    if not isinstance(start, int) or not isinstance(end, int) or not 0 <= start <= end <= length:
+        raise ValueError(f"Invalid range [{start}, {end}) for text of length {length}")
+    return start, end, (start, end) == (0, length)
+
+
+def format_text_range(shape, start, end, names, values, whole=False):
+    """对形状文本的 [start, end) 区间（whole 时为全部）设置属性"""
+    cursor = shape.createTextCursor()
+    cursor.gotoStart(False)
+    if whole:
+        cursor.gotoEnd(True)
+    else:
+        if start:
+            cursor.goRight(start, False)
+        cursor.goRight(end - start, True)
+    set_properties(cursor, names, values)
+
+
+class _FormatGroup:
+    """同一形状同一区间上连续的若干项编辑，合并为一次 setPropertyValues"""
+
+    def __init__(self, seq, shape, start, end, whole):
+        self.seq = seq
+        self.shape = shape
+        self.start, self.end, self.whole = start, end, whole
+        self.props = {}
+        # [(结果序号, names, values)]，合并写入失败时逐项重试以定位出错的项
+        self.edits = []
+
+    def add(self, index, names, values):
+        self.props.update(zip(names, values))
+        self.edits.append((index, names, values))
+
+    def overlaps(self, start, end):
+        return self.start < end and start < self.end
+
+    def apply(self, results):
+        names = tuple(sorted(self.props))
+        if not names:
+            return
+        try:
+            format_text_range(
+                self.shape, self.start, self.end, names,
+                tuple(self.props[name] for name in names), self.whole,
+            )
+            return
+        except Exception as e:
+            logger.debug(f"合并格式写入失败，逐项重试: {e}")
+        for index, names, values in self.edits:
+            try:
+                format_text_range(self.shape, self.start, self.end, names, values, self.whole)
+            except Exception as e:
+                results[index] = {"index": index, "error": str(e)}
+
+
+def apply_format_batch(doc, default_slide, edits):
+    """
+    批量应用格式:每项 {"shape_index", "slide_index"?, "start"?, "end"?, "formatting"}。
+    先校验全部编辑并按 (形状, 区间) 分组:同一形状同一区间的编辑合并为一个光标、一次
+    setPropertyValues（后面的项覆盖前面的同名属性）；与之重叠的其他区间若在两者之间
+    被修改过则另起一组，保证结果与逐项顺序执行一致。整批在 lockControllers 下执行，
+    逐项返回结果
+    """
+    results = []
+    slides = {}
+    shapes = {}
+    groups = []
+    # (slide_index, shape_index) -> {(start, end): 该区间最近的一组}
+    open_groups = {}
+    for i, edit in enumerate(edits):
+        try:
+            if not isinstance(edit, dict) or not isinstance(edit.get("formatting"), dict):
+                raise ValueError("Each edit needs a 'formatting' object")
+            names, values = formatting_properties(edit["formatting"])
+            slide_index = edit.get("slide_index")
+            if slide_index not in slides:
+                slides[slide_index] = (
+                    default_slide if slide_index is None else get_slide_by_index(doc, slide_index)
+                )
+            slide = slides[slide_index]
+            if slide is None:
+                raise ValueError("Slide not found")
+
+            shape_index = edit.get("shape_index")
+            key = (slide_index, shape_index)
+            if key not in shapes:
+                if not isinstance(shape_index, int) or not 0 <= shape_index < slide.getCount():
+                    raise ValueError("Invalid shape index")
+                shapes[key] = slide.getByIndex(shape_index)
+            shape = shapes[key]
+            if not hasattr(shape, "createTextCursor"):
+                raise ValueError("Shape does not support text")
+
+            start, end, whole = text_range(shape, edit.get("start"), edit.get("end"))
+            shape_groups = open_groups.setdefault(key, {})
+            group = shape_groups.get((start, end))
+            if group is None or any(
+                g.seq > group.seq and g.overlaps(start, end) for g in shape_groups.values()
+            ):
+                group = _FormatGroup(len(groups), shape, start, end, whole)
+                groups.append(group)
+                shape_groups[(start, end)] = group
+            group.add(i, names, values)
+            results.append({"index": i, "status": "success"})
+        except Exception as e:
+            results.append({"index": i, "error": str(e)})
+
+    if groups:
+        doc.lockControllers()
+        try:
+            for group in groups:
+                group.apply(results)
+        finally:
+            doc.unlockControllers()
+    return results
 
 
 def add_new_slide(doc, position=-1):
@@ -650,16 +1362,174 @@ def delete_slide(doc, slide_index):
         return {"error": str(e)}
 
 
+@connection.on_disconnect
+def _on_bridge_lost():
+    """旧桥上的监听器随桥接一起失效，依赖它们的状态全部作废"""
+    tracker.reset()
+    abandon_hung_calls()
+    documents.invalidate()
+    graphics.clear()
+    geometry.clear()
+    spatial.clear()
+    view_transforms.clear()
+    search_index.clear()
+    snapshots.clear()
+    trajectories.clear()
+    with _selection_cache_lock:
+        _selection_cache.clear()
+
+
+@tracker.on_forget
+def _on_document_disposed(doc_key):
+    """文档关闭后，按文档缓存的数据随之丢弃"""
+    geometry.forget(doc_key)
+    spatial.forget(doc_key)
+    view_transforms.forget(doc_key)
+    search_index.forget(doc_key)
+    snapshots.forget(doc_key)
+    with _selection_cache_lock:
+        for cache_key in [k for k in _selection_cache if k[0] == doc_key]:
+            del _selection_cache[cache_key]
+
+
+def evict_slides(doc_key, slide_count):
+    """幻灯片被删除后，丢弃超出页数的按页缓存"""
+    geometry.prune(doc_key, slide_count)
+    spatial.prune(doc_key, slide_count)
+    search_index.prune(doc_key, slide_count)
+    snapshots.prune(doc_key, slide_count)
+
+
+@connection.on_connect
+def _on_bridge_connected():
+    """soffice 没有重启时，注册过的文档在新桥上仍然存在，doc_id 保持有效"""
+    found, dropped = documents.reattach(connection.desktop, tracker.key)
+    if found or dropped:
+        logger.info(f"重连后找回 {found} 份文档，注销 {dropped} 份")
+
+
+def retry_read_on_disconnect(view):
+    """幂等读接口:若请求中途桥接失效，重连后重试一次"""
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        g.error_payload = g.bridge_error = False
+        try:
+            rv = view(*args, **kwargs)
+        except Exception as e:
+            if not connection.is_disconnect_error(e):
+                raise
+            connection.mark_dead(str(e))
+        else:
+            response = app.make_response(rv)
+            if response.status_code < 400 and not g.get("error_payload"):
+                return response
+            # 普通的 4xx/error 字段不代表桥接有问题；只有吞掉过像断开的异常
+            # （或桥接已被丢弃）时才探测一次，确认失效才重试
+            if connection.desktop is not None and not g.get("bridge_error"):
+                return response
+            if connection.probe():
+                return response
+
+        g.error_payload = g.bridge_error = False
+        if connection.get_desktop() is None:
+            return (
+                jsonify(
+                    {
+                        "error": "LibreOffice connection unavailable",
+                        "connection": connection.status(),
+                    }
+                ),
+                503,
+            )
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+# ETag / 条件 GET
+
+
+def run_options():
+    """?runs=true 开启逐区间格式，?max_runs=N 限制每个形状的区间数"""
+    include_runs = request.args.get("runs", "false").lower() == "true"
+    max_runs = request.args.get("max_runs", type=int)
+    return include_runs, max_runs
+
+
+def request_projection(default_fields):
+    """
+    解析 ?fields=text,position 与 ?types=TextShape,TableShape。
+    两者都没给时返回 (None, None)，调用方走原有的完整输出；字段名非法时返回 400 响应
+    """
+    fields_arg = request.args.get("fields")
+    types_arg = request.args.get("types")
+    if not fields_arg and not types_arg:
+        return None, None
+    fields = set(default_fields)
+    if fields_arg:
+        fields = {f.strip() for f in fields_arg.split(",") if f.strip()}
+        unknown = fields - SHAPE_FIELDS
+        if unknown:
+            return None, (
+                jsonify(
+                    {
+                        "error": f"Unknown fields: {', '.join(sorted(unknown))}",
+                        "available": sorted(SHAPE_FIELDS),
+                    }
+                ),
+                400,
+            )
+    types = [t.strip() for t in (types_arg or "").split(",") if t.strip()]
+    _, max_runs = run_options()
+    return Projection(fields, types, max_runs), None
+
+
+def read_etag(doc_key, *parts):
+    """由文档 generation、页标识与请求参数/Accept 派生 ETag；文档未跟踪时返回 None"""
+    generation = tracker.generation(doc_key)
+    if generation is None:
+        return None
+    variant = zlib.crc32(
+        f"{sorted(request.args.items(multi=True))}|{request.accept_mimetypes}".encode()
+    )
+    doc_hash = zlib.crc32(doc_key.encode())
+    token = "-".join(str(p) for p in parts)
+    return f"{doc_hash:08x}-{generation}-{token}-{variant:08x}"
+
+
+def not_modified(etag):
+    """If-None-Match 命中时返回 304 响应，否则 None"""
+    if etag and request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag, weak=True)
+        return response
+    return None
+
+
+def with_etag(response, etag):
+    if etag:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def slide_index_of(slide):
+    """DrawPage.Number 从 1 开始"""
+    try:
+        return slide.Number - 1
+    except Exception:
+        return ALL_SLIDES
+
+
 # API 端点
 
 
 @app.route("/api/connect", methods=["POST"])
 def api_connect():
     """API端点:连接到LibreOffice"""
-    global desktop
-    global ctx
     try:
-        desktop = connect_to_libreoffice()
+        kind = "reconnect" if connection.desktop is not None else "connect"
+        desktop = connect_to_libreoffice(kind)
         if desktop:
             return jsonify({"status": "success", "message": "Connected to LibreOffice"})
         else:
@@ -673,15 +1543,266 @@ def api_connect():
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
+@app.route("/api/supervisor", methods=["GET"])
+def api_supervisor_status():
+    """API端点:soffice 监管状态"""
+    return jsonify(supervisor.status())
+
+
+@app.route("/api/supervisor/episode", methods=["POST"])
+def api_supervisor_episode():
+    """API端点:runner 在 episode 结束时上报，达到阈值时后台回收 soffice"""
+    recycling = supervisor.episode_finished()
+    return jsonify({**supervisor.status(), "recycle_started": recycling})
+
+
+@app.route("/api/supervisor/recycle", methods=["POST"])
+def api_supervisor_recycle():
+    """API端点:立即回收 soffice（后台进行）"""
+    if not supervisor.enabled:
+        return jsonify({"error": "soffice supervisor is not enabled"}), 409
+    supervisor.recycle_async("manual")
+    return jsonify({"status": "recycling"}), 202
+
+
+@app.route("/api/documents", methods=["GET"])
+def api_list_documents():
+    """API端点:列出已注册的文档"""
+    return api_response({"documents": documents.list()})
+
+
+@app.route("/api/documents/open", methods=["POST"])
+def api_open_document():
+    """
+    API端点:打开演示文稿并返回 doc_id
+    body: {"url": "file:///..."} 或 {"path": "/abs/path.pptx"}，都不给则新建；
+    "hidden": true 时不创建窗口（当前页/选区相关接口不可用）
+    """
+    data = request.get_json(silent=True) or {}
+    desktop = connection.get_desktop()
+    if not desktop:
+        return jsonify({"error": "LibreOffice connection unavailable"}), 503
+
+    url = data.get("url")
+    if not url and data.get("path"):
+        url = uno.systemPathToFileUrl(os.path.abspath(data["path"]))
+    hidden = bool(data.get("hidden", False))
+    try:
+        doc_id, doc = documents.open(traced(desktop), tracker.key, url, hidden)
+    except (RuntimeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    doc_key = tracker.watch(doc)
+    result = get_presentation_info(doc, tracker.generation(doc_key))
+    return api_response({"doc_id": doc_id, "url": url, "hidden": hidden, **result})
+
+
+def _resolve_template(data):
+    """按 sha256 / url / path 取模板；返回 (template, error_response)"""
+    if data.get("sha256"):
+        template = templates.get(data["sha256"])
+        if template is None:
+            return None, (jsonify({"error": "Template not cached", "sha256": data["sha256"]}), 404)
+        return template, None
+    try:
+        if data.get("url"):
+            return templates.from_url(data["url"]), None
+        if data.get("path"):
+            return templates.from_path(data["path"]), None
+    except OSError as e:
+        return None, (jsonify({"error": f"Cannot read template: {e}"}), 400)
+    return None, (jsonify({"error": "sha256, url or path is required"}), 400)
+
+
+@app.route("/api/templates", methods=["GET"])
+def api_list_templates():
+    """API端点:列出内存中的模板（最近使用的在前）"""
+    return api_response({"templates": templates.list(), **templates.stats()})
+
+
+@app.route("/api/templates", methods=["POST"])
+def api_add_template():
+    """
+    API端点:缓存模板。请求体为文件字节（?name= 可选），
+    或 JSON {"url": ...} / {"path": ...} 预取
+    """
+    if request.is_json:
+        template, error = _resolve_template(request.get_json(silent=True) or {})
+        if error is not None:
+            return error
+        return api_response(template.describe())
+    data = request.get_data()
+    if not data:
+        return jsonify({"error": "Empty template body"}), 400
+    sha256 = templates.put(data, request.args.get("name"))
+    return api_response({"sha256": sha256, "name": request.args.get("name"), "size": len(data)})
+
+
+@app.route("/api/templates/load", methods=["POST"])
+def api_load_template():
+    """
+    API端点:从内存模板打开演示文稿，返回 doc_id
+    body: {"sha256"|"url"|"path": ..., "hidden": false, "replace": "<doc_id>"}
+    replace 给出时，新文档打开后关闭旧文档（episode 重置到已知 deck）
+    """
+    data = request.get_json(silent=True) or {}
+    template, error = _resolve_template(data)
+    if error is not None:
+        return error
+    desktop = connection.get_desktop()
+    if not desktop or connection.ctx is None:
+        return jsonify({"error": "LibreOffice connection unavailable"}), 503
+
+    hidden = bool(data.get("hidden", False))
+    stream = input_stream(connection.ctx, template.data)
+    try:
+        doc_id, doc = documents.open(
+            traced(desktop),
+            tracker.key,
+            "private:stream",
+            hidden,
+            extra_props={"InputStream": stream},
+        )
+    except (RuntimeError, ValueError) as e:
+        return jsonify({"error": str(e), "sha256": template.sha256}), 400
+    template.loads += 1
+
+    replaced = data.get("replace")
+    if replaced:
+        try:
+            documents.close(replaced)
+        except UnknownDocument:
+            replaced = None
+
+    doc_key = tracker.watch(doc)
+    result = get_presentation_info(doc, tracker.generation(doc_key))
+    return api_response(
+        {
+            "doc_id": doc_id,
+            "template": template.describe(),
+            "hidden": hidden,
+            "replaced": replaced,
+            **result,
+        }
+    )
+
+
+@app.route("/api/documents/adopt", methods=["POST"])
+def api_adopt_document():
+    """API端点:为当前焦点所在的演示文稿分配 doc_id"""
+    doc = get_current_presentation()
+    if not doc:
+        return jsonify({"error": "No presentation available"}), 404
+    return api_response({"doc_id": documents.adopt(doc, tracker.key(doc))})
+
+
+@app.route("/api/documents/<doc_id>", methods=["DELETE"])
+def api_close_document(doc_id):
+    """API端点:关闭文档"""
+    documents.close(doc_id)
+    return api_response({"status": "closed", "doc_id": doc_id})
+
+
 @app.route("/api/presentation/info", methods=["GET"])
+@retry_read_on_disconnect
 def api_get_presentation_info():
     """API端点:获取演示文稿信息"""
     doc = get_current_presentation()
-    result = get_presentation_info(doc)
-    return jsonify(result)
+    if not doc:
+        return api_response(get_presentation_info(doc))
+
+    doc_key = tracker.watch(doc)
+    page = get_current_slide(doc)
+    etag = read_etag(doc_key, "info", page.Number if page is not None else -1)
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+
+    result = get_presentation_info(doc, tracker.generation(doc_key))
+    return with_etag(api_response(result), etag)
+
+
+@app.route("/api/presentation/content", methods=["GET"])
+def api_presentation_content():
+    """
+    API端点:以 NDJSON 流式输出整份演示文稿，每行一张幻灯片。
+    参数 start / count 选择范围，include_formatting、runs、fields、types 与单页接口相同。
+    第一行是 {"type": "presentation", ...} 头，之后每行 {"type": "slide", "slide_index", ...}，
+    最后一行 {"type": "end", ...}；每张幻灯片读完即写出，服务端内存与页数无关。
+    """
+    start = request.args.get("start", 0, type=int)
+    count = request.args.get("count", type=int)
+    include_formatting = request.args.get("include_formatting", "false").lower() == "true"
+    include_runs, max_runs = run_options()
+    projection, error = request_projection(slide_fields(include_formatting, include_runs))
+    if error is not None:
+        return error
+    if start < 0 or (count is not None and count < 0):
+        return jsonify({"error": "'start' and 'count' must be non-negative"}), 400
+
+    doc = get_current_presentation()
+    if not doc:
+        return jsonify({"error": "No presentation available"}), 404
+
+    doc_key = tracker.watch(doc)
+    draw_pages = doc.getDrawPages()
+    total = draw_pages.getCount()
+    stop = total if count is None else min(total, start + count)
+    deadline = _request_deadline()
+
+    def read_slide(index):
+        return get_slide_content(
+            draw_pages.getByIndex(index), include_formatting, include_runs, max_runs, projection
+        )
+
+    def line(obj):
+        return dumps_json(obj) + b"\n"
+
+    def stream():
+        yield line(
+            {
+                "type": "presentation",
+                "total_slides": total,
+                "start": start,
+                "count": max(0, stop - start),
+                "generation": tracker.generation(doc_key),
+            }
+        )
+        written = 0
+        for index in range(start, stop):
+            try:
+                # 整个流不套请求级超时，改为逐页超时
+                if deadline:
+                    content = call_with_deadline(deadline, read_slide, index)
+                else:
+                    content = read_slide(index)
+            except DeadlineExceeded as e:
+                # 返回已写出的部分结果；桥接仍能响应时不丢弃它
+                bridge_reset = isolate_hung_call(
+                    f"presentation content exceeded {deadline:g}s on slide {index}"
+                )
+                yield line(
+                    {
+                        "type": "error",
+                        "slide_index": index,
+                        "error": str(e),
+                        "slides": written,
+                        "bridge_reset": bridge_reset,
+                        **e.to_dict(),
+                    }
+                )
+                return
+            except Exception as e:
+                yield line({"type": "error", "slide_index": index, "error": str(e)})
+                return
+            yield line({"type": "slide", "slide_index": index, **content})
+            written += 1
+        yield line({"type": "end", "slides": written, "generation": tracker.generation(doc_key)})
+
+    return Response(stream_with_context(stream()), mimetype="application/x-ndjson")
 
 
 @app.route("/api/slide/current", methods=["GET"])
+@retry_read_on_disconnect
 def api_get_current_slide():
     """API端点:获取当前幻灯片内容"""
     include_formatting = (
@@ -692,17 +1813,28 @@ def api_get_current_slide():
     if not doc:
         return jsonify({"error": "No presentation available"}), 404
 
+    doc_key = tracker.watch(doc)
     slide = get_current_slide(doc)
     logger.debug(f"Current slide: {slide}")
     if slide is None:
         logger.error("No current slide found")
         return jsonify({"error": "No current slide"}), 404
 
-    result = get_slide_content(slide, include_formatting)
-    return jsonify(result)
+    etag = read_etag(doc_key, "current", slide.Number)
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+
+    include_runs, max_runs = run_options()
+    projection, error = request_projection(slide_fields(include_formatting, include_runs))
+    if error is not None:
+        return error
+    result = get_slide_content(slide, include_formatting, include_runs, max_runs, projection)
+    return with_etag(api_response(result), etag)
 
 
 @app.route("/api/slide/<int:index>", methods=["GET"])
+@retry_read_on_disconnect
 def api_get_slide_by_index(index):
     """API端点:通过索引获取幻灯片内容"""
     include_formatting = (
@@ -713,12 +1845,22 @@ def api_get_slide_by_index(index):
     if not doc:
         return jsonify({"error": "No presentation available"}), 404
 
+    doc_key = tracker.watch(doc)
+    etag = read_etag(doc_key, "slide", index)
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+
     slide = get_slide_by_index(doc, index)
     if slide is None:
         return jsonify({"error": f"Slide {index} not found"}), 404
 
-    result = get_slide_content(slide, include_formatting)
-    return jsonify(result)
+    include_runs, max_runs = run_options()
+    projection, error = request_projection(slide_fields(include_formatting, include_runs))
+    if error is not None:
+        return error
+    result = get_slide_content(slide, include_formatting, include_runs, max_runs, projection)
+    return with_etag(api_response(result), etag)
 
 
 @app.route("/api/slide/add-text", methods=["POST"])
@@ -748,8 +1890,171 @@ def api_add_text_to_slide():
     if  slide is None:
         return jsonify({"error": "Slide not found"}), 404
 
-    result = add_text_shape(doc, slide, text, x, y, width, height, formatting)
-    return jsonify(result)
+    doc_key = tracker.watch(doc)
+    with tracker.writing(doc_key, slide_index_of(slide)):
+        result = add_text_shape(doc, slide, text, x, y, width, height, formatting)
+    return api_response(result)
+
+
+def _int_or_none(value):
+    return None if value in (None, "") else int(value)
+
+
+@app.route("/api/slide/add-image", methods=["POST"])
+def api_add_image_to_slide():
+    """
+    API端点:向幻灯片添加图片
+    JSON: {"path": "/abs/img.jpg"} 或 {"data": "<base64>"}，
+    或 multipart/form-data 上传 image 文件；其余参数 slide_index, x, y, width, height
+    """
+    if request.files:
+        data = request.form
+        upload = request.files.get("image")
+        if upload is None:
+            return jsonify({"error": "Missing 'image' file"}), 400
+        image = upload.read()
+    else:
+        data = request.get_json(silent=True) or {}
+        if data.get("path"):
+            try:
+                with open(data["path"], "rb") as f:
+                    image = f.read()
+            except OSError as e:
+                return jsonify({"error": f"Cannot read image: {e}"}), 400
+        elif data.get("data"):
+            try:
+                image = base64.b64decode(data["data"], validate=True)
+            except (binascii.Error, ValueError):
+                return jsonify({"error": "'data' is not valid base64"}), 400
+        else:
+            return jsonify({"error": "Missing 'path', 'data' or uploaded 'image'"}), 400
+
+    try:
+        slide_index = _int_or_none(data.get("slide_index"))
+        x = int(data.get("x", 1000))
+        y = int(data.get("y", 1000))
+        width = _int_or_none(data.get("width"))
+        height = _int_or_none(data.get("height"))
+    except (TypeError, ValueError):
+        return jsonify({"error": "slide_index, x, y, width and height must be integers"}), 400
+
+    doc = get_current_presentation()
+    if not doc:
+        return jsonify({"error": "No presentation available"}), 404
+    if connection.ctx is None:
+        return jsonify({"error": "LibreOffice connection unavailable"}), 503
+
+    if slide_index is None:
+        slide = get_current_slide(doc)
+    else:
+        slide = get_slide_by_index(doc, slide_index)
+    if slide is None:
+        return jsonify({"error": "Slide not found"}), 404
+
+    try:
+        sha256, graphic, cached = graphics.get_or_decode(traced(connection.ctx), image)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    doc_key = tracker.watch(doc)
+    with tracker.writing(doc_key, slide_index_of(slide)):
+        result = add_image_shape(doc, slide, graphic, x, y, width, height)
+    if "error" not in result:
+        result.update({"sha256": sha256, "graphic_cached": cached})
+    return api_response(result)
+
+
+@app.route("/api/slide/add-table", methods=["POST"])
+def api_add_table_to_slide():
+    """
+    API端点:向幻灯片添加表格
+    body: {"rows", "columns", "data": [[...], ...], "slide_index", "x", "y", "width", "height"}
+    rows/columns 缺省时取 data 的大小
+    """
+    data = request.get_json(silent=True) or {}
+    cells = data.get("data")
+    if cells is not None and not (
+        isinstance(cells, list) and all(isinstance(row, list) for row in cells)
+    ):
+        return jsonify({"error": "'data' must be a 2D array"}), 400
+    cells = cells or []
+
+    rows = data.get("rows", len(cells))
+    cols = data.get("columns", max((len(row) for row in cells), default=0))
+    if not isinstance(rows, int) or not isinstance(cols, int) or rows < 1 or cols < 1:
+        return jsonify({"error": "'rows' and 'columns' must be positive integers"}), 400
+    if len(cells) > rows or any(len(row) > cols for row in cells):
+        return jsonify({"error": "'data' is larger than rows x columns"}), 400
+
+    doc = get_current_presentation()
+    if not doc:
+        return jsonify({"error": "No presentation available"}), 404
+
+    slide_index = data.get("slide_index")
+    if slide_index is None:
+        slide = get_current_slide(doc)
+    else:
+        slide = get_slide_by_index(doc, slide_index)
+    if slide is None:
+        return jsonify({"error": "Slide not found"}), 404
+
+    doc_key = tracker.watch(doc)
+    with tracker.writing(doc_key, slide_index_of(slide)):
+        result = add_table_shape(
+            doc,
+            slide,
+            rows,
+            cols,
+            data.get("x", 1000),
+            data.get("y", 1000),
+            data.get("width", 20000),
+            data.get("height"),
+            cells,
+        )
+    return api_response(result)
+
+
+@app.route("/api/slide/format", methods=["POST"])
+def api_format_batch():
+    """
+    API端点:一次请求批量设置多个形状/文本区间的格式
+    body: {"slide_index"?: 默认页, "edits": [{"shape_index", "slide_index"?,
+           "start"?, "end"?, "formatting": {...}}, ...]}
+    """
+    data = request.get_json(silent=True) or {}
+    edits = data.get("edits")
+    if not isinstance(edits, list) or not edits:
+        return jsonify({"error": "'edits' must be a non-empty list"}), 400
+
+    doc = get_current_presentation()
+    if not doc:
+        return jsonify({"error": "No presentation available"}), 404
+
+    slide_index = data.get("slide_index")
+    if slide_index is None:
+        slide = get_current_slide(doc)
+    else:
+        slide = get_slide_by_index(doc, slide_index)
+
+    doc_key = tracker.watch(doc)
+    # 先按各项的页号估计写入范围:只涉及一页时按页失效，否则整体失效
+    pages = {e.get("slide_index", slide_index) for e in edits if isinstance(e, dict)}
+    target = ALL_SLIDES
+    if len(pages) == 1:
+        only = pages.pop()
+        target = slide_index_of(slide) if only is None else only
+    with tracker.writing(doc_key, target):
+        results = apply_format_batch(doc, slide, edits)
+
+    failed = sum(1 for r in results if "error" in r)
+    return api_response(
+        {
+            "status": "success" if not failed else "partial" if failed < len(results) else "failed",
+            "applied": len(results) - failed,
+            "failed": failed,
+            "results": results,
+        }
+    )
 
 
 @app.route("/api/slide/update-shape", methods=["PUT"])
@@ -776,37 +2081,449 @@ def api_update_shape_text():
     if not slide:
         return jsonify({"error": "Slide not found"}), 404
 
-    result = update_shape_text(slide, shape_index, new_text, formatting)
-    return jsonify(result)
+    doc_key = tracker.watch(doc)
+    with tracker.writing(doc_key, slide_index_of(slide)):
+        result = update_shape_text(slide, shape_index, new_text, formatting)
+    return api_response(result)
+
+
+@app.route("/api/slide/screen-boxes", methods=["GET"])
+@retry_read_on_disconnect
+def api_slide_screen_boxes():
+    """
+    API端点:当前幻灯片所有形状在屏幕上的像素外接框
+    （按编辑视图的可见区域、缩放与窗口位置换算；on_screen 为 false 的形状不在可见区域内）
+    """
+    doc = get_current_presentation()
+    if not doc:
+        return jsonify({"error": "No presentation available"}), 404
+    controller = doc.getCurrentController()
+    if controller is None:
+        return jsonify({"error": "Document has no view"}), 409
+    slide = controller.getCurrentPage()
+    if slide is None:
+        return jsonify({"error": "No current slide"}), 404
+
+    doc_key = tracker.watch(doc)
+    slide_index = slide_index_of(slide)
+    boxes = geometry.get(doc_key, slide_index, slide)
+    transform = view_transforms.get(doc_key, controller)
+    return api_response(
+        {
+            "status": "success",
+            "slide_index": slide_index,
+            "transform": transform.describe(),
+            "shapes": [
+                {
+                    "index": b.index,
+                    "type": b.type,
+                    "name": b.name,
+                    "box": transform.box(b),
+                    "on_screen": transform.on_screen(b),
+                }
+                for b in boxes
+            ],
+        }
+    )
+
+
+def spatial_query(index, params, query):
+    """
+    hit-test / region 的公共部分。coords=screen 时参数与返回的外接框都是屏幕像素
+    （按当前视图换算），否则为幻灯片坐标（1/100 mm）。
+    """
+    coords = request.args.get("coords", "slide")
+    if coords not in ("slide", "screen"):
+        return jsonify({"error": "coords must be 'slide' or 'screen'"}), 400
+    try:
+        values = {name: float(request.args.get(name, default)) for name, default in params}
+    except (TypeError, ValueError):
+        names = ", ".join(name for name, _ in params)
+        return jsonify({"error": f"{names} must be numbers"}), 400
+
+    doc = get_current_presentation()
+    if not doc:
+        return jsonify({"error": "No presentation available"}), 404
+    doc_key = tracker.watch(doc)
+
+    transform = None
+    if coords == "screen":
+        controller = doc.getCurrentController()
+        if controller is None:
+            return jsonify({"error": "Document has no view"}), 409
+        transform = view_transforms.get(doc_key, controller)
+        if not transform.scale_x or not transform.scale_y:
+            return jsonify({"error": "View has no visible area"}), 409
+        x, y = transform.to_slide(values["x"], values["y"])
+        values = {
+            name: value / (transform.scale_x if name in ("width", "tolerance") else transform.scale_y)
+            for name, value in values.items()
+        }
+        values["x"], values["y"] = x, y
+
+    grid = spatial.get(doc_key, index, lambda: get_slide_by_index(doc, index))
+    if grid is None:
+        # 可能是页被别处（GUI）删掉了，顺带丢弃超出页数的缓存
+        evict_slides(doc_key, doc.getDrawPages().getCount())
+        return jsonify({"error": f"Slide {index} not found"}), 404
+    values = {name: round(value) for name, value in values.items()}
+    return api_response(
+        {
+            "status": "success",
+            "slide_index": index,
+            "coords": coords,
+            # z 序从上到下，第一个即最上层
+            "shapes": [
+                {
+                    "index": b.index,
+                    "type": b.type,
+                    "name": b.name,
+                    "box": transform.box(b)
+                    if transform
+                    else {"x": b.x, "y": b.y, "width": b.width, "height": b.height},
+                }
+                for b in query(grid, values)
+            ],
+        }
+    )
+
+
+@app.route("/api/slide/<int:index>/hit-test", methods=["GET"])
+@retry_read_on_disconnect
+def api_slide_hit_test(index):
+    """
+    API端点:点 (x, y) 下的形状，按 z 序从上到下
+    查询参数 x, y, tolerance（默认 0，线条等零宽形状需要）, coords=slide|screen
+    """
+    return spatial_query(
+        index,
+        [("x", None), ("y", None), ("tolerance", 0)],
+        lambda grid, v: grid.hit_test(v["x"], v["y"], v["tolerance"]),
+    )
+
+
+@app.route("/api/slide/<int:index>/region", methods=["GET"])
+@retry_read_on_disconnect
+def api_slide_region(index):
+    """
+    API端点:与矩形相交的形状，按 z 序从上到下
+    查询参数 x, y, width, height, mode=intersects|contains（完全落在矩形内）, coords=slide|screen
+    """
+    mode = request.args.get("mode", "intersects")
+    if mode not in ("intersects", "contains"):
+        return jsonify({"error": "mode must be 'intersects' or 'contains'"}), 400
+    return spatial_query(
+        index,
+        [("x", None), ("y", None), ("width", None), ("height", None)],
+        lambda grid, v: grid.query(
+            v["x"], v["y"], v["width"], v["height"], contains=mode == "contains"
+        ),
+    )
+
+
+@app.route("/api/search", methods=["GET"])
+@retry_read_on_disconnect
+def api_search():
+    """
+    API端点:在形状正文、表格单元格与备注中查找文字（不区分大小写）
+    查询参数 q, limit；结果给出页号、形状序号（表格另有 row/column）与字符偏移
+    """
+    query = request.args.get("q", "")
+    if not query.strip():
+        return jsonify({"error": "q is required"}), 400
+    try:
+        limit = _int_or_none(request.args.get("limit"))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+
+    doc = get_current_presentation()
+    if not doc:
+        return jsonify({"error": "No presentation available"}), 404
+
+    results, reindexed = search_index.search(tracker.watch(doc), doc, query, limit)
+    return api_response(
+        {
+            "status": "success",
+            "query": query,
+            "count": len(results),
+            "results": results,
+            "reindexed_slides": reindexed,
+        }
+    )
+
+
+# 快照记录的字段:不含逐区间格式（runs），格式变化按整段比较
+SNAPSHOT_PROJECTION = Projection(
+    ("type", "position", "size", "text", "formatting", "table", "notes")
+)
+
+
+def snapshot_slide(slide):
+    return get_slide_content(slide, projection=SNAPSHOT_PROJECTION)
+
+
+@app.route("/api/snapshots", methods=["GET"])
+def api_list_snapshots():
+    """API端点:当前文档的快照列表（all=true 时列出全部文档的）"""
+    if request.args.get("all", "false").lower() == "true":
+        return api_response({"status": "success", "snapshots": snapshots.list()})
+    doc = get_current_presentation()
+    if not doc:
+        return jsonify({"error": "No presentation available"}), 404
+    return api_response(
+        {"status": "success", "snapshots": snapshots.list(tracker.watch(doc))}
+    )
+
+
+@app.route("/api/snapshots", methods=["POST"])
+def api_take_snapshot():
+    """API端点:给当前文档拍快照，返回 snapshot_id；只重新读取上次以来变过的页"""
+    doc = get_current_presentation()
+    if not doc:
+        return jsonify({"error": "No presentation available"}), 404
+    snapshot, reread = snapshots.take(tracker.watch(doc), doc, snapshot_slide)
+    return api_response({"status": "success", **snapshot.describe(), "reread_slides": reread})
+
+
+@app.route("/api/snapshots/<snapshot_id>/diff", methods=["GET"])
+@retry_read_on_disconnect
+def api_snapshot_diff(snapshot_id):
+    """
+    API端点:快照之间的结构化 diff
+    ?to=<snapshot_id> 与另一个快照比较；省略时与文档当前状态比较
+    """
+    base = snapshots.get(snapshot_id)
+    target_id = request.args.get("to")
+    if target_id:
+        target = snapshots.get(target_id)
+        if target.doc_key != base.doc_key:
+            return jsonify({"error": "Snapshots belong to different documents"}), 400
+        slides, reread = target.slides, 0
+    else:
+        doc = get_current_presentation()
+        if not doc:
+            return jsonify({"error": "No presentation available"}), 404
+        doc_key = tracker.watch(doc)
+        if doc_key != base.doc_key:
+            return jsonify({"error": "Snapshot belongs to a different document"}), 400
+        slides, _, reread = snapshots.capture(doc_key, doc, snapshot_slide)
+    return api_response(
+        {
+            "status": "success",
+            "from": snapshot_id,
+            "to": target_id or "current",
+            "reread_slides": reread,
+            **diff_states(base.slides, slides),
+        }
+    )
+
+
+@app.route("/api/snapshots/<snapshot_id>", methods=["DELETE"])
+def api_delete_snapshot(snapshot_id):
+    """API端点:删除快照"""
+    snapshots.delete(snapshot_id)
+    return api_response({"status": "success", "snapshot_id": snapshot_id})
+
+
+@app.route("/api/trajectories", methods=["GET"])
+def api_list_trajectories():
+    """API端点:正在记录的轨迹"""
+    return api_response({"status": "success", "recording": trajectories.list()})
+
+
+@app.route("/api/trajectories", methods=["POST"])
+def api_start_trajectory():
+    """
+    API端点:开始记录当前文档的轨迹，之后每次修改记录一步
+    JSON: {"episode": "<id，省略时自动生成>", "keyframe_interval": 20}
+    """
+    data = request.get_json(silent=True) or {}
+    episode = data.get("episode")
+    try:
+        keyframe_interval = int(data.get("keyframe_interval") or KEYFRAME_INTERVAL)
+        if episode is not None:
+            trajectory_path(str(episode))
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    if keyframe_interval < 1:
+        return jsonify({"error": "keyframe_interval must be positive"}), 400
+
+    doc = get_current_presentation()
+    if not doc:
+        return jsonify({"error": "No presentation available"}), 404
+    doc_key = tracker.watch(doc)
+    try:
+        recorder = trajectories.start(
+            doc_key,
+            lambda: snapshots.capture(doc_key, doc, snapshot_slide),
+            episode=episode and str(episode),
+            keyframe_interval=keyframe_interval,
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 409
+    return api_response({"status": "success", **recorder.describe()})
+
+
+@app.route("/api/trajectories/<episode>/step", methods=["POST"])
+def api_trajectory_step(episode):
+    """API端点:立即记录一步（可带 label，如 agent 的动作名）"""
+    data = request.get_json(silent=True) or {}
+    recorder = trajectories.get(episode)
+    step = recorder.step(label=data.get("label"))
+    return api_response({"status": "success", "step": step, **recorder.describe()})
+
+
+@app.route("/api/trajectories/<episode>/stop", methods=["POST"])
+def api_stop_trajectory(episode):
+    """API端点:停止记录并关闭轨迹文件"""
+    recorder = trajectories.stop(episode)
+    return api_response({"status": "success", **recorder.describe()})
+
+
+@app.route("/api/trajectories/<episode>/state", methods=["GET"])
+def api_trajectory_state(episode):
+    """
+    API端点:从轨迹文件还原某一步的文档状态（?step=，默认最后一步）
+    只读文件，不访问 LibreOffice；已停止记录的 episode 同样可用
+    """
+    try:
+        path = trajectory_path(episode)
+        step = _int_or_none(request.args.get("step"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not os.path.exists(path):
+        raise UnknownTrajectory(episode)
+    reader = TrajectoryReader(path)
+    try:
+        state = reader.state_at(step)
+    except IndexError as e:
+        return jsonify({"error": str(e)}), 404
+    return api_response({"status": "success", "episode": episode, "steps": len(reader), **state})
 
 
 @app.route("/api/slide/selection", methods=["GET"])
+@retry_read_on_disconnect
 def api_get_selection():
     """API端点:获取当前选中的对象"""
     doc = get_current_presentation()
     if not doc:
         return jsonify({"error": "No presentation available"}), 404
 
-    result = get_current_selection(doc)
-    return jsonify(result)
+    doc_key = tracker.watch(doc)
+    tracker.watch_selection(doc, doc_key)
+    projection, error = request_projection(SELECTION_FIELDS)
+    if error is not None:
+        return error
+    result, version = cached_selection(doc, doc_key, get_current_selection, projection)
+    etag = read_etag(doc_key, "selection", version[0]) if version else None
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+    return with_etag(api_response(result), etag)
+
+
+@app.route("/api/slide/selection/summary", methods=["GET"])
+@retry_read_on_disconnect
+def api_get_selection_summary():
+    """API端点:获取选区精简摘要"""
+    doc = get_current_presentation()
+    if not doc:
+        return jsonify({"error": "No presentation available"}), 404
+
+    doc_key = tracker.watch(doc)
+    tracker.watch_selection(doc, doc_key)
+    result, version = cached_selection(doc, doc_key, selection_summary)
+    etag = read_etag(doc_key, "selection-summary", version[0]) if version else None
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+    return with_etag(api_response(result), etag)
+
+
+def _sse(event, data, event_id=None):
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append("data: " + json.dumps(data, ensure_ascii=False))
+    return "\n".join(lines) + "\n\n"
+
+
+@app.route("/api/events", methods=["GET"])
+def api_events():
+    """
+    API端点:以 server-sent events 推送选区变化（附精简摘要）与文档修改。
+    types=selection,modified 选择事件类型；连接建立时先推送一次当前选区。
+    """
+    doc = get_current_presentation()
+    if not doc:
+        return jsonify({"error": "No presentation available"}), 404
+
+    doc_key = tracker.watch(doc)
+    if not tracker.watch_selection(doc, doc_key):
+        return jsonify({"error": "Selection change listener unavailable"}), 503
+    wanted = set(request.args.get("types", "selection,modified").split(","))
+    subscription = hub.subscribe()
+
+    def stream():
+        try:
+            if "selection" in wanted:
+                summary, _ = cached_selection(doc, doc_key, selection_summary)
+                yield _sse("selection", summary, tracker.selection_generation(doc_key))
+            while True:
+                try:
+                    event, data = subscription.get(timeout=SSE_KEEPALIVE)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if data.get("doc") != doc_key:
+                    continue
+                if event == "selection.changed" and "selection" in wanted:
+                    # 队列里还有更新的选区事件时跳过，只为最新选区生成摘要
+                    latest = tracker.selection_generation(doc_key)
+                    if latest is not None and data["selection_generation"] < latest:
+                        continue
+                    summary, _ = cached_selection(doc, doc_key, selection_summary)
+                    yield _sse("selection", summary, data["selection_generation"])
+                elif event == "document.modified" and "modified" in wanted:
+                    yield _sse("modified", data, data["generation"])
+        finally:
+            hub.unsubscribe(subscription)
+
+    return Response(
+        stream_with_context(stream()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.route("/api/slide/text-selection", methods=["GET"])
+@retry_read_on_disconnect
 def api_get_text_selection():
     doc = get_current_presentation()
     if not doc:
         return jsonify({"error": "No presentation available"}), 404
 
     result = get_selected_text(doc)
-    return jsonify(result)
+    return api_response(result)
 
 
 @app.route("/api/slide/background")
+@retry_read_on_disconnect
 def api_slide_bg():
 
     doc = get_current_presentation()
+    if not doc:
+        return api_response(get_slide_background(doc))
+
+    doc_key = tracker.watch(doc)
+    page = get_current_slide(doc)
+    etag = read_etag(doc_key, "background", page.Number if page is not None else -1)
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+
     bg_info = get_slide_background(doc)  # 当前页
-    return jsonify(bg_info)
+    return with_etag(api_response(bg_info), etag)
 
 
 @app.route("/api/slide/new", methods=["POST"])
@@ -816,16 +2533,27 @@ def api_add_slide():
     position = data.get("position", -1)
 
     doc = get_current_presentation()
-    result = add_new_slide(doc, position)
-    return jsonify(result)
+    if not doc:
+        return api_response(add_new_slide(doc, position))
+
+    with tracker.writing(tracker.watch(doc)):
+        result = add_new_slide(doc, position)
+    return api_response(result)
 
 
 @app.route("/api/slide/<int:index>", methods=["DELETE"])
 def api_delete_slide(index):
     """API端点:删除幻灯片"""
     doc = get_current_presentation()
-    result = delete_slide(doc, index)
-    return jsonify(result)
+    if not doc:
+        return api_response(delete_slide(doc, index))
+
+    doc_key = tracker.watch(doc)
+    with tracker.writing(doc_key):
+        result = delete_slide(doc, index)
+    if "total_slides" in result:
+        evict_slides(doc_key, result["total_slides"])
+    return api_response(result)
 
 
 @app.route("/api/health", methods=["GET"])
@@ -840,15 +2568,167 @@ def api_health():
             status = "no_presentation"
             message = "LibreOffice is running but no Impress presentation is open"
 
-        return jsonify({"status": status, "message": message, "service": "impress-api"})
+        return jsonify(
+            {
+                "status": status,
+                "message": message,
+                "service": "impress-api",
+                "connection": connection.status(),
+            }
+        )
     except Exception as e:
         logger.error(f"Health check error: {e}")
         return (
-            jsonify({"status": "error", "message": str(e), "service": "impress-api"}),
+            jsonify(
+                {
+                    "status": "error",
+                    "message": str(e),
+                    "service": "impress-api",
+                    "connection": connection.status(),
+                }
+            ),
             503,
         )
 
 
+def event_document_key(doc_id=None):
+    """RPC events.subscribe 订阅的文档:doc_id 指定的文档，缺省为当前文档；返回其 tracker key"""
+    with app.test_request_context(query_string={"doc_id": doc_id} if doc_id else None):
+        doc = get_current_presentation()
+    if not doc:
+        return None
+    return tracker.watch(doc)
+
+
+if Sock is not None:
+    sock = Sock(app)
+
+    @sock.route("/api/rpc")
+    def api_rpc(ws):
+        """WebSocket JSON-RPC:一个连接承载整个 episode 的调用与事件推送"""
+        RpcSession(app, ws, hub, event_document_key).serve()
+
+else:
+    logger.warning("未安装 flask-sock，/api/rpc WebSocket 通道不可用")
+
+
+@app.route("/metrics", methods=["GET"])
+def api_metrics():
+    """Prometheus 指标"""
+    return Response(REGISTRY.render(), content_type=METRICS_CONTENT_TYPE)
+
+
+def _request_deadline():
+    value = request.headers.get("X-Deadline")
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+    return CALL_DEADLINE
+
+
+def isolate_hung_call(reason):
+    """
+    某个调用超时后:先 probe 桥接，仍可用就只放弃卡住的工作线程（由 hung_calls 计数），
+    不动桥接与依赖它的状态；probe 也卡住时才 mark_dead（旧桥上的卡住调用随之移出
+    hung_calls 计数）。返回桥接是否已不可用。
+    """
+    alive = connection.probe_within(DEADLINE_PROBE_TIMEOUT)
+    if alive is None:
+        connection.mark_dead(reason)
+        return True
+    return not alive
+
+
+def with_deadline(view):
+    """在硬超时下执行视图；超时返回 504，桥接也无响应时才隔离桥接"""
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        deadline = _request_deadline()
+        if not deadline:
+            return view(*args, **kwargs)
+        hung = hung_calls()
+        # 卡住的调用过多时先 probe:桥接仍能响应就照常执行，不可用时才拒绝
+        if hung >= MAX_HUNG_CALLS and isolate_hung_call(
+            f"{hung} calls hung past their deadline"
+        ):
+            count_error("hung")
+            return (
+                jsonify(
+                    {
+                        "error": "LibreOffice is not responding",
+                        "hung_calls": hung,
+                        "connection": connection.status(),
+                        "supervisor": supervisor.status(),
+                    }
+                ),
+                503,
+            )
+        try:
+            return call_with_deadline(deadline, view, *args, **kwargs)
+        except DeadlineExceeded as e:
+            route = _route_label()
+            count_error("deadline", route)
+            logger.error(
+                f"{request.method} {request.path} 超过 {deadline:g}s 未返回，当前调用栈:\n"
+                + "\n".join(e.stack)
+            )
+            # 单个慢调用不影响其他会话:桥接仍能响应时保留桥接、文档注册表与各类缓存；
+            # soffice 本身卡死时由监管的 probe 超时判定并回收
+            bridge_reset = isolate_hung_call(
+                f"{request.method} {route} exceeded {deadline:g}s deadline"
+            )
+            recorder = g.get("uno_trace")
+            return (
+                jsonify(
+                    {
+                        "error": "UNO call exceeded deadline",
+                        "route": route,
+                        **e.to_dict(),
+                        "uno_calls": recorder.summary_header() if recorder else None,
+                        "bridge_reset": bridge_reset,
+                        "connection": connection.status(),
+                    }
+                ),
+                504,
+            )
+
+    return wrapper
+
+
+for _endpoint, _view in list(app.view_functions.items()):
+    if _endpoint not in DEADLINE_EXEMPT:
+        app.view_functions[_endpoint] = with_deadline(_view)
+
+
+_services_started = False
+_services_lock = threading.Lock()
+
+
+def start_services():
+    """启动 soffice 监管（SUPERVISE）或后台预连接（EAGER_CONNECT）；多次调用只生效一次"""
+    global _services_started
+    with _services_lock:
+        if _services_started:
+            return
+        _services_started = True
+    if SUPERVISE:
+        import atexit
+
+        atexit.register(supervisor.stop)
+        supervisor.start()
+    elif EAGER_CONNECT:
+        connection.start_background()
+
+
+def create_app():
+    """WSGI 入口（如 gunicorn "impress_api:create_app()"）:启动后台服务并返回 app"""
+    start_services()
+    return app
+
+
 if __name__ == "__main__":
     logger.info("启动 LibreOffice Impress API 服务...")
     logger.info(f"Python 路径: {sys.path}")
@@ -863,4 +2743,9 @@ if __name__ == "__main__":
         logger.error(f"无法导入 UNO 模块: {e}")
         logger.error("请确保使用 LibreOffice 的 Python 或正确设置 PYTHONPATH")
 
-    app.run(host="0.0.0.0", port=5011, debug=True)
+    # reloader 的父进程只负责监视文件，不连接；实际服务的进程（reloader 子进程，
+    # 或未启用 reloader 时的本进程）才预连接
+    if not USE_RELOADER or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_services()
+
+    app.run(host="0.0.0.0", port=5011, debug=True, use_reloader=USE_RELOADER)
@@ -0,0 +1,110 @@
+"""
+响应序列化与压缩协商
+
+- 格式:Accept 为 application/msgpack（或 ?format=msgpack）时返回 MessagePack，
+  否则返回 JSON（装了 orjson 就用 orjson，否则标准库 json）
+- 压缩:响应体超过 IMPRESS_COMPRESS_MIN_BYTES 且客户端 Accept-Encoding 允许时，
+  优先 zstd（需要 zstandard），其次 gzip
+
+orjson / msgpack / zstandard 都是可选依赖，缺失时自动退回。
+"""
+
+import gzip
+import json
+import os
+
+from flask import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESS_MIN_BYTES = int(os.environ.get("IMPRESS_COMPRESS_MIN_BYTES", "4096"))
+GZIP_LEVEL = 5
+ZSTD_LEVEL = 3
+
+JSON_MIMETYPE = "application/json"
+MSGPACK_MIMETYPES = ("application/msgpack", "application/x-msgpack")
+
+_zstd_compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL) if zstandard else None
+
+
+def dumps_json(result):
+    if orjson is not None:
+        try:
+            return orjson.dumps(result, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass
+    return json.dumps(result, ensure_ascii=False, separators=(",", ":"), default=str).encode(
+        "utf-8"
+    )
+
+
+def dumps_msgpack(result):
+    return msgpack.packb(result, use_bin_type=True, default=str)
+
+
+def available_mimetypes():
+    mimetypes = [JSON_MIMETYPE]
+    if msgpack is not None:
+        mimetypes.extend(MSGPACK_MIMETYPES)
+    return mimetypes
+
+
+def negotiate_mimetype(request):
+    """?format= 优先，其次 Accept 头；都没有或不认识时为 JSON"""
+    fmt = request.args.get("format", "").lower()
+    if fmt == "msgpack" and msgpack is not None:
+        return MSGPACK_MIMETYPES[0]
+    if fmt == "json":
+        return JSON_MIMETYPE
+    return request.accept_mimetypes.best_match(available_mimetypes(), JSON_MIMETYPE)
+
+
+def negotiate_encoding(request, size):
+    if size < COMPRESS_MIN_BYTES:
+        return None
+    accepted = request.accept_encodings
+    if _zstd_compressor is not None and accepted["zstd"]:
+        return "zstd"
+    if accepted["gzip"]:
+        return "gzip"
+    return None
+
+
+def encode(result, mimetype):
+    if mimetype in MSGPACK_MIMETYPES:
+        return dumps_msgpack(result)
+    return dumps_json(result)
+
+
+def compress(body, encoding):
+    if encoding == "zstd":
+        return _zstd_compressor.compress(body)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=GZIP_LEVEL)
+    return body
+
+
+def negotiated_response(result, request, status=200):
+    """按 Accept / Accept-Encoding 生成响应"""
+    mimetype = negotiate_mimetype(request)
+    body = encode(result, mimetype)
+    encoding = negotiate_encoding(request, len(body))
+    response = Response(compress(body, encoding), status=status, mimetype=mimetype)
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept")
+    response.vary.add("Accept-Encoding")
+    return response
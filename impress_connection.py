@@ -0,0 +1,277 @@
+"""
+LibreOffice UNO 连接管理
+
+集中保存 ctx / Desktop 以及长期可复用的服务实例（DispatchHelper、SystemClipboard），
+避免每个请求重新通过 ServiceManager 创建。start_background() 在启动时后台连接
+并做一次预热，使重启后的第一个请求与稳态延迟一致。
+
+soffice 崩溃或重启后旧桥接变成已销毁的代理:调用方用 is_disconnect_error() 识别
+这类异常并 mark_dead()，之后 get_desktop() 以有上限的指数退避重新连接。
+on_disconnect() 注册的回调会在桥接失效时被调用，用来丢弃依赖旧桥的状态（监听器等）；
+on_connect() 注册的回调在每次连接成功后调用，用来在新桥上恢复状态。
+"""
+
+import logging
+import os
+import threading
+import time
+
+import uno
+
+from impress_metrics import UNO_CONNECTS
+
+logger = logging.getLogger(__name__)
+
+UNO_URL = os.environ.get(
+    "IMPRESS_UNO_URL",
+    "uno:socket,host=127.0.0.1,port=2002;urp;StarOffice.ComponentContext",
+)
+
+# 连接后预先创建并缓存的服务
+CACHED_SERVICES = (
+    "com.sun.star.frame.DispatchHelper",
+    "com.sun.star.datatransfer.clipboard.SystemClipboard",
+)
+
+# 重连退避:第 n 次连续失败后等待 min(MAX, BASE * 2**(n-1)) 秒
+RECONNECT_BACKOFF_BASE = float(os.environ.get("IMPRESS_RECONNECT_BACKOFF", "0.5"))
+RECONNECT_BACKOFF_MAX = float(os.environ.get("IMPRESS_RECONNECT_BACKOFF_MAX", "10"))
+
+# 桥接失效时 pyuno 抛出的异常类型名/消息特征
+_DISCONNECT_TYPES = ("DisposedException", "NoConnectException", "BrokenPipeException")
+_DISCONNECT_MESSAGES = ("disposed", "bridge", "connection", "broken pipe")
+
+# 请求路径里延迟 import 的 UNO 类型，启动时先导入一遍
+WARM_IMPORTS = (
+    ("com.sun.star.view", "XSelectionSupplier"),
+    ("com.sun.star.awt", "Point"),
+    ("com.sun.star.awt", "Size"),
+    ("com.sun.star.beans", "PropertyValue"),
+)
+
+
+class ConnectionManager:
+    def __init__(self, url=UNO_URL):
+        self.url = url
+        self.ctx = None
+        self.desktop = None
+        self._services = {}
+        self._lock = threading.RLock()
+        self.state = "disconnected"
+        self.connected_at = None
+        self.last_error = None
+        self.failures = 0
+        self.next_attempt = 0.0
+        self.reconnects = 0
+        self.ever_connected = False
+        self._disconnect_callbacks = []
+        self._connect_callbacks = []
+
+    def connect(self, kind="connect"):
+        """(重新)建立桥接并缓存 Desktop 与服务实例；失败返回 None"""
+        desktop = self._connect(kind)
+        if desktop is not None:
+            self._run_callbacks(self._connect_callbacks)
+        return desktop
+
+    def _run_callbacks(self, callbacks):
+        for callback in list(callbacks):
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"连接状态回调失败: {e}", exc_info=True)
+
+    def _connect(self, kind):
+        with self._lock:
+            try:
+                logger.info("尝试连接到 LibreOffice...")
+                self.state = "connecting"
+                local_context = uno.getComponentContext()
+                resolver = local_context.ServiceManager.createInstanceWithContext(
+                    "com.sun.star.bridge.UnoUrlResolver", local_context
+                )
+                ctx = resolver.resolve(self.url)
+                smgr = ctx.ServiceManager
+                desktop = smgr.createInstanceWithContext("com.sun.star.frame.Desktop", ctx)
+
+                services = {}
+                for name in CACHED_SERVICES:
+                    try:
+                        services[name] = smgr.createInstanceWithContext(name, ctx)
+                    except Exception as e:
+                        logger.warning(f"无法预创建服务 {name}: {e}")
+
+                self.ctx, self.desktop, self._services = ctx, desktop, services
+                self.state = "connected"
+                self.connected_at = time.time()
+                self.last_error = None
+                self.failures = 0
+                self.next_attempt = 0.0
+                if self.ever_connected:
+                    self.reconnects += 1
+                self.ever_connected = True
+                UNO_CONNECTS.inc(kind, "success")
+                logger.info("成功连接到 LibreOffice!")
+                return desktop
+            except Exception as e:
+                self.state = "disconnected"
+                self.last_error = str(e)
+                self.failures += 1
+                self.next_attempt = time.monotonic() + min(
+                    RECONNECT_BACKOFF_MAX,
+                    RECONNECT_BACKOFF_BASE * 2 ** (self.failures - 1),
+                )
+                UNO_CONNECTS.inc(kind, "failure")
+                logger.error(f"连接 LibreOffice 失败: {e}", exc_info=True)
+                return None
+
+    def get_desktop(self):
+        """已连接则直接返回 Desktop，否则（退避窗口外）同步连接一次"""
+        desktop = self.desktop
+        if desktop is not None:
+            return desktop
+        with self._lock:
+            if self.desktop is not None:
+                return self.desktop
+            if time.monotonic() < self.next_attempt:
+                return None
+            return self.connect("reconnect" if self.ever_connected else "connect")
+
+    @staticmethod
+    def is_disconnect_error(exc):
+        """判断异常是否意味着桥接已失效"""
+        if type(exc).__name__ in _DISCONNECT_TYPES:
+            return True
+        type_name = getattr(exc, "typeName", "") or ""
+        if type_name.rsplit(".", 1)[-1] in _DISCONNECT_TYPES:
+            return True
+        if type(exc).__name__ == "RuntimeException" or type_name.endswith(
+            "RuntimeException"
+        ):
+            message = str(getattr(exc, "Message", "") or exc).lower()
+            return any(m in message for m in _DISCONNECT_MESSAGES)
+        return False
+
+    def mark_dead(self, reason):
+        """丢弃失效的桥接；下次 get_desktop() 会重连"""
+        with self._lock:
+            if self.desktop is None:
+                return
+            logger.warning(f"UNO 桥接失效: {reason}")
+            self.ctx, self.desktop, self._services = None, None, {}
+            self.state = "disconnected"
+            self.last_error = reason
+        self._run_callbacks(self._disconnect_callbacks)
+
+    def on_disconnect(self, callback):
+        self._disconnect_callbacks.append(callback)
+        return callback
+
+    def on_connect(self, callback):
+        self._connect_callbacks.append(callback)
+        return callback
+
+    def probe(self):
+        """一次最轻的远程调用检查桥接是否可用；失效时 mark_dead 并返回 False"""
+        desktop = self.desktop
+        if desktop is None:
+            return False
+        try:
+            desktop.getCurrentComponent()
+            return True
+        except Exception as e:
+            if self.is_disconnect_error(e):
+                self.mark_dead(str(e))
+                return False
+            return True
+
+    def probe_within(self, timeout):
+        """
+        带超时的 probe:True 桥接可用，False 已失效（probe 已 mark_dead），
+        None 表示 probe 本身在 timeout 内没有返回（soffice 卡住）
+        """
+        result = []
+        thread = threading.Thread(
+            target=lambda: result.append(self.probe()), name="uno-probe", daemon=True
+        )
+        thread.start()
+        thread.join(timeout)
+        return result[0] if result else None
+
+    def status(self):
+        info = {
+            "state": self.state,
+            "url": self.url,
+            "connected_at": self.connected_at,
+            "reconnects": self.reconnects,
+            "consecutive_failures": self.failures,
+            "last_error": self.last_error,
+        }
+        if self.desktop is None and self.next_attempt:
+            info["next_attempt_in"] = max(0.0, self.next_attempt - time.monotonic())
+        return info
+
+    def service(self, name):
+        """返回缓存的服务实例，没有则创建并缓存"""
+        instance = self._services.get(name)
+        if instance is not None:
+            return instance
+        with self._lock:
+            if self.ctx is None and self.get_desktop() is None:
+                return None
+            instance = self.ctx.ServiceManager.createInstanceWithContext(name, self.ctx)
+            self._services[name] = instance
+            return instance
+
+    def warm_up(self):
+        """导入延迟加载的 UNO 类型，并走一遍常用对象，预热 pyuno 的内省缓存"""
+        for module, name in WARM_IMPORTS:
+            try:
+                getattr(__import__(module, fromlist=[name]), name)
+            except Exception as e:
+                logger.debug(f"预热导入 {module}.{name} 失败: {e}")
+
+        desktop = self.desktop
+        if desktop is None:
+            return
+        try:
+            doc = desktop.getCurrentComponent()
+            if not doc or not doc.supportsService(
+                "com.sun.star.presentation.PresentationDocument"
+            ):
+                return
+            controller = doc.getCurrentController()
+            controller.getSelection()
+            page = controller.getCurrentPage()
+            doc.getDrawPages().getCount()
+            if page is not None and page.getCount() > 0:
+                shape = page.getByIndex(0)
+                shape.getShapeType()
+                shape.Position, shape.Size
+                if hasattr(shape, "getString"):
+                    shape.getString()
+                    shape.createTextCursor().CharHeight
+        except Exception as e:
+            logger.debug(f"预热失败（不影响服务）: {e}")
+
+    def start_background(self, attempts=30, interval=2.0):
+        """后台线程:反复尝试连接直到成功，然后预热"""
+
+        def run():
+            for _ in range(attempts):
+                if self.get_desktop() is not None:
+                    started = time.perf_counter()
+                    self.warm_up()
+                    logger.info(
+                        f"预热完成，用时 {(time.perf_counter() - started) * 1000:.1f} ms"
+                    )
+                    return
+                time.sleep(interval)
+            logger.error("后台连接 LibreOffice 失败，将在首个请求时重试")
+
+        thread = threading.Thread(target=run, name="uno-connect", daemon=True)
+        thread.start()
+        return thread
+
+
+connection = ConnectionManager()
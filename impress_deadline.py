@@ -0,0 +1,98 @@
+"""
+UNO 调用的硬超时
+
+LibreOffice 弹出模态对话框或排版卡住时，UNO 调用会一直阻塞。call_with_deadline()
+把调用放到工作线程里执行，调用线程最多等 deadline 秒:
+- 按时完成:原样返回结果或抛出原异常
+- 超时:抛 DeadlineExceeded，附带工作线程当前的调用栈，便于定位卡在哪个 UNO 调用上
+
+卡住的工作线程无法被强行终止，只能等桥接被重置/soffice 被回收后自行结束；
+hung_calls() 返回当前桥接上仍未结束的超时调用数，调用方据此决定是否直接拒绝新请求。
+桥接被重置后 abandon_hung_calls() 把旧桥上的卡住调用移出计数，它们即使永不返回
+也不会让新桥上的请求一直被拒绝。
+"""
+
+import contextvars
+import os
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+# 工作线程上限:卡住的调用会一直占着线程，上限要明显大于允许的卡住调用数
+MAX_WORKERS = int(os.environ.get("IMPRESS_DEADLINE_WORKERS", "32"))
+STACK_LIMIT = 12
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="uno-call")
+_hung = set()
+_hung_lock = threading.Lock()
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self, deadline, elapsed, stack):
+        super().__init__(f"call exceeded {deadline:g}s deadline")
+        self.deadline = deadline
+        self.elapsed = elapsed
+        self.stack = stack
+
+    def to_dict(self):
+        return {
+            "deadline_s": self.deadline,
+            "elapsed_s": round(self.elapsed, 3),
+            "stack": self.stack,
+            "hung_calls": hung_calls(),
+        }
+
+
+def hung_calls():
+    with _hung_lock:
+        return len(_hung)
+
+
+def abandon_hung_calls():
+    """桥接被重置后调用:旧桥上卡住的调用不再计入 hung_calls()，返回放弃的调用数"""
+    with _hung_lock:
+        count = len(_hung)
+        _hung.clear()
+        return count
+
+
+def _thread_stack(ident):
+    frame = sys._current_frames().get(ident) if ident is not None else None
+    if frame is None:
+        return []
+    return [line.rstrip() for line in traceback.format_stack(frame, limit=STACK_LIMIT)]
+
+
+def call_with_deadline(deadline, func, *args, **kwargs):
+    """
+    在工作线程里执行 func，最多等待 deadline 秒。
+    工作线程在调用方的 contextvars 副本里运行，Flask 的 request / g 照常可用。
+    """
+    context = contextvars.copy_context()
+    worker = {}
+
+    def run():
+        worker["ident"] = threading.get_ident()
+        return context.run(func, *args, **kwargs)
+
+    start = time.perf_counter()
+    future = _executor.submit(run)
+    try:
+        return future.result(timeout=deadline)
+    except FutureTimeout:
+        elapsed = time.perf_counter() - start
+        if future.cancel():
+            # 还在排队没开始执行（所有工作线程都卡住了），不会再产生副作用
+            raise DeadlineExceeded(deadline, elapsed, []) from None
+        stack = _thread_stack(worker.get("ident"))
+        with _hung_lock:
+            _hung.add(future)
+        future.add_done_callback(_release)
+        raise DeadlineExceeded(deadline, elapsed, stack) from None
+
+
+def _release(future):
+    with _hung_lock:
+        _hung.discard(future)
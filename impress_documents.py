@@ -0,0 +1,203 @@
+"""
+按 id 访问的文档注册表
+
+getCurrentComponent() 跟随窗口焦点，同一个 soffice 里只能可靠地操作一份演示文稿。
+注册表给每份通过 API 打开（或被显式纳入）的文档分配 doc_id 并缓存其句柄，请求带上
+doc_id 就直接使用对应文档，不受焦点变化影响，多个 episode 可以并发操作同一 soffice
+里的不同文档。
+
+- 文档被关闭时通过 XEventListener.disposing 自动注销
+- 桥接断开后句柄失效，invalidate() 只把注册表标为 stale；重连后 reattach() 按
+  RuntimeUID（其次 URL）在新桥的 Desktop.getComponents() 里找回各文档，doc_id 不变。
+  soffice 重启过、文档已不存在时才注销对应 doc_id
+- Hidden=True 打开的文档没有 controller，依赖当前页/选区的接口不可用
+"""
+
+import logging
+import threading
+import time
+import uuid
+
+import unohelper
+from com.sun.star.beans import PropertyValue
+from com.sun.star.lang import XEventListener
+
+from impress_uno_trace import unwrap
+
+logger = logging.getLogger(__name__)
+
+NEW_PRESENTATION_URL = "private:factory/simpress"
+
+
+class UnknownDocument(LookupError):
+    def __init__(self, doc_id):
+        super().__init__(f"Unknown doc_id: {doc_id}")
+        self.doc_id = doc_id
+
+
+class _DisposeListener(unohelper.Base, XEventListener):
+    def __init__(self, registry, doc_id):
+        self.registry = registry
+        self.doc_id = doc_id
+
+    def disposing(self, event):
+        self.registry._on_disposed(self.doc_id)
+
+
+class _Entry:
+    def __init__(self, doc_id, doc, key, url, hidden):
+        self.doc_id = doc_id
+        self.doc = doc
+        self.key = key
+        self.url = url
+        self.hidden = hidden
+        self.opened_at = time.time()
+        self.listener = None
+
+    def describe(self):
+        return {
+            "doc_id": self.doc_id,
+            "url": self.url,
+            "hidden": self.hidden,
+            "opened_at": self.opened_at,
+        }
+
+
+def _props(**values):
+    props = []
+    for name, value in values.items():
+        prop = PropertyValue()
+        prop.Name = name
+        prop.Value = value
+        props.append(prop)
+    return tuple(props)
+
+
+class DocumentRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        # tracker key（RuntimeUID）-> doc_id，同一文档重复纳入时复用 id
+        self._by_key = {}
+        # 桥接断开后为 True:句柄失效，等重连后 reattach()
+        self.stale = False
+
+    def _register(self, doc, key, url, hidden):
+        with self._lock:
+            doc_id = self._by_key.get(key)
+            if doc_id is not None:
+                return doc_id
+            doc_id = uuid.uuid4().hex[:12]
+            # 注册表跨请求持有句柄，去掉调用方请求的 UNO 计量包装
+            entry = _Entry(doc_id, unwrap(doc), key, url, hidden)
+            self._entries[doc_id] = entry
+            self._by_key[key] = doc_id
+        self._listen(entry)
+        return doc_id
+
+    def _listen(self, entry):
+        try:
+            entry.listener = _DisposeListener(self, entry.doc_id)
+            entry.doc.addEventListener(entry.listener)
+        except Exception as e:
+            logger.warning(f"无法注册文档关闭监听器 {entry.doc_id}: {e}")
+
+    def open(self, desktop, key_of, url=None, hidden=False, extra_props=None):
+        """
+        用 loadComponentFromURL 打开（url 为空时新建）演示文稿并注册，返回 (doc_id, doc)。
+        key_of 把文档映射为稳定 key（即 tracker.key）。
+        """
+        props = dict(Hidden=hidden)
+        props.update(extra_props or {})
+        doc = desktop.loadComponentFromURL(
+            url or NEW_PRESENTATION_URL, "_blank", 0, _props(**props)
+        )
+        if doc is None:
+            raise RuntimeError(f"LibreOffice could not load {url or 'a new presentation'}")
+        if not doc.supportsService("com.sun.star.presentation.PresentationDocument"):
+            doc.close(True)
+            raise ValueError(f"{url} is not a presentation")
+        return self._register(doc, key_of(doc), url, hidden), doc
+
+    def adopt(self, doc, key):
+        """把已打开的文档（如当前焦点文档）纳入注册表，返回 doc_id"""
+        return self._register(doc, key, None, False)
+
+    def get(self, doc_id):
+        entry = self._entries.get(doc_id)
+        if entry is None:
+            raise UnknownDocument(doc_id)
+        return entry.doc
+
+    def close(self, doc_id):
+        doc = self.get(doc_id)
+        self._on_disposed(doc_id)
+        doc.close(True)
+
+    def list(self):
+        with self._lock:
+            return [entry.describe() for entry in self._entries.values()]
+
+    def _on_disposed(self, doc_id):
+        with self._lock:
+            entry = self._entries.pop(doc_id, None)
+            if entry is not None:
+                self._by_key = {k: v for k, v in self._by_key.items() if v != doc_id}
+
+    def invalidate(self):
+        """桥接断开后调用:句柄与关闭监听器都失效，等重连后 reattach()"""
+        with self._lock:
+            if self._entries:
+                self.stale = True
+
+    def reattach(self, desktop, key_of):
+        """
+        重连后在新桥上找回已注册的文档，返回 (找回数, 注销数)。
+        枚举失败时保持 stale，下次重连再试。
+        """
+        with self._lock:
+            if not self.stale:
+                return 0, 0
+            entries = list(self._entries.values())
+        try:
+            by_key, by_url = {}, {}
+            components = desktop.getComponents().createEnumeration()
+            while components.hasMoreElements():
+                doc = components.nextElement()
+                if not doc.supportsService("com.sun.star.presentation.PresentationDocument"):
+                    continue
+                by_key[key_of(doc)] = doc
+                url = doc.getURL()
+                if url:
+                    by_url.setdefault(url, doc)
+        except Exception as e:
+            logger.warning(f"重连后枚举文档失败，稍后重试: {e}")
+            return 0, 0
+
+        found, dropped = [], []
+        for entry in entries:
+            doc = by_key.get(entry.key) or (by_url.get(entry.url) if entry.url else None)
+            if doc is None:
+                dropped.append(entry.doc_id)
+                continue
+            entry.doc, entry.key = doc, key_of(doc)
+            found.append(entry)
+        with self._lock:
+            for doc_id in dropped:
+                self._entries.pop(doc_id, None)
+            self._by_key = {entry.key: entry.doc_id for entry in self._entries.values()}
+            self.stale = False
+        for entry in found:
+            self._listen(entry)
+        if dropped:
+            logger.info(f"soffice 中已不存在的文档被注销: {', '.join(dropped)}")
+        return len(found), len(dropped)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_key.clear()
+            self.stale = False
+
+
+documents = DocumentRegistry()
@@ -0,0 +1,283 @@
+"""
+文档修改跟踪
+
+每个文档维护一个单调递增的 generation 计数器:
+- 通过 XModifyListener 捕获 GUI/agent 对文档的任何修改（无法得知是哪一页，记为全部页）
+- API 自己的写操作用 tracker.writing(key, slide_index) 包起来，期间由写操作线程自己
+  触发的修改会合并成一次只针对该页的 bump，这样按页缓存的数据不会被无谓地整体失效。
+  UNO 桥接保持逻辑线程:同步调用引起的回调在发起调用的线程上执行，所以其他来源
+  （GUI、别的请求）在写操作期间的修改落在别的线程上，照常记为全部页
+
+所有 generation（含选区 generation）取自同一个进程级单调时钟，文档状态被重置
+（如桥接断开后 reset()）再重建时也不会与之前发出的值重复。
+
+changed_since() 供 ETag、按页缓存等判断自某个 generation 以来（某页）是否变过。
+每次 bump 还会通过 hub 广播 "document.modified" 事件，供推送通道订阅。
+
+文档关闭时 forget() 注销其状态，并调用 on_forget() 注册的回调，让按文档缓存的
+数据（几何、检索索引、快照等）一并清理。
+
+watch_selection() 另在 controller 上注册 XSelectionChangeListener，维护独立的
+selection generation，并广播 "selection.changed" 事件。
+"""
+
+import logging
+import queue
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+import unohelper
+from com.sun.star.util import XModifyListener
+from com.sun.star.view import XSelectionChangeListener
+
+logger = logging.getLogger(__name__)
+
+ALL_SLIDES = None
+
+
+class EventHub:
+    """进程内事件广播:每个订阅者一个有界队列，慢订阅者丢事件而不阻塞发布方"""
+
+    def __init__(self, maxsize=1000):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._maxsize = maxsize
+
+    def subscribe(self):
+        q = queue.Queue(maxsize=self._maxsize)
+        with self._lock:
+            self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def publish(self, event, data):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait((event, data))
+            except queue.Full:
+                logger.debug(f"事件队列已满，丢弃 {event}")
+
+
+hub = EventHub()
+
+
+class _ModifyListener(unohelper.Base, XModifyListener):
+    def __init__(self, tracker, key):
+        self.tracker = tracker
+        self.key = key
+
+    def modified(self, event):
+        self.tracker._on_modified(self.key)
+
+    def disposing(self, event):
+        self.tracker.forget(self.key)
+
+
+class _SelectionListener(unohelper.Base, XSelectionChangeListener):
+    def __init__(self, tracker, key):
+        self.tracker = tracker
+        self.key = key
+
+    def selectionChanged(self, event):
+        self.tracker._on_selection_changed(self.key)
+
+    def disposing(self, event):
+        # controller 被销毁（窗口关闭/重建），下次 watch_selection 时重新注册
+        self.tracker._on_selection_disposed(self.key, self)
+
+
+class _DocState:
+    def __init__(self, start):
+        self.generation = start
+        # (generation, slide_index 或 ALL_SLIDES)，只保留最近 log_size 条；
+        # floor 之前的修改记录已丢弃
+        self.log = deque()
+        self.floor = start
+        # 正在执行 API 写操作的线程 -> 嵌套深度
+        self.writers = {}
+        self.listener = None
+        self.selection_generation = start
+        self.selection_listener = None
+
+
+class DocumentTracker:
+    def __init__(self, log_size=1024, events=None):
+        self._lock = threading.Lock()
+        self._docs = {}
+        self._log_size = log_size
+        self._events = events
+        self._clock = 0
+        self._forget_callbacks = []
+
+    def _tick(self):
+        # 调用方需持有 self._lock
+        self._clock += 1
+        return self._clock
+
+    @staticmethod
+    def key(doc):
+        """文档的稳定标识:RuntimeUID，拿不到时退回对象 id"""
+        try:
+            uid = doc.RuntimeUID
+            if uid:
+                return str(uid)
+        except Exception:
+            pass
+        return f"py-{id(doc)}"
+
+    def watch(self, doc):
+        """确保文档已注册修改监听器，返回文档 key；注册失败的文档不参与跟踪"""
+        key = self.key(doc)
+        with self._lock:
+            if key in self._docs:
+                return key
+            state = self._docs[key] = _DocState(self._tick())
+        try:
+            state.listener = _ModifyListener(self, key)
+            doc.addModifyListener(state.listener)
+        except Exception as e:
+            logger.warning(f"无法注册修改监听器，文档 {key} 不做缓存: {e}")
+            with self._lock:
+                self._docs.pop(key, None)
+        return key
+
+    def watch_selection(self, doc, key):
+        """在当前 controller 上注册选区监听器；成功（或已注册）返回 True"""
+        state = self._docs.get(key)
+        if state is None:
+            return False
+        if state.selection_listener is not None:
+            return True
+        listener = _SelectionListener(self, key)
+        try:
+            doc.getCurrentController().addSelectionChangeListener(listener)
+        except Exception as e:
+            logger.warning(f"无法注册选区监听器 {key}: {e}")
+            return False
+        with self._lock:
+            state.selection_listener = listener
+        return True
+
+    def selection_generation(self, key):
+        """选区 generation；未注册选区监听器时返回 None"""
+        state = self._docs.get(key)
+        if state is None or state.selection_listener is None:
+            return None
+        return state.selection_generation
+
+    def _on_selection_changed(self, key):
+        with self._lock:
+            state = self._docs.get(key)
+            if state is None:
+                return
+            state.selection_generation = self._tick()
+            generation = state.selection_generation
+        if self._events is not None:
+            self._events.publish(
+                "selection.changed", {"doc": key, "selection_generation": generation}
+            )
+
+    def _on_selection_disposed(self, key, listener):
+        with self._lock:
+            state = self._docs.get(key)
+            if state is not None and state.selection_listener is listener:
+                state.selection_listener = None
+                # 新 controller 上的选区与旧的无关，让依赖旧 generation 的缓存失效
+                state.selection_generation = self._tick()
+
+    def on_forget(self, callback):
+        """注册文档被关闭（disposing）时的回调 callback(key)，供按文档缓存的数据清理"""
+        self._forget_callbacks.append(callback)
+        return callback
+
+    def forget(self, key):
+        with self._lock:
+            self._docs.pop(key, None)
+        for callback in list(self._forget_callbacks):
+            try:
+                callback(key)
+            except Exception as e:
+                logger.error(f"文档 {key} 注销回调失败: {e}", exc_info=True)
+
+    def reset(self):
+        """桥接断开后调用:旧桥上注册的监听器都已失效，所有文档需要重新 watch"""
+        with self._lock:
+            self._docs.clear()
+
+    def is_tracked(self, key):
+        return key in self._docs
+
+    def generation(self, key):
+        """当前 generation；未跟踪的文档返回 None"""
+        state = self._docs.get(key)
+        return state.generation if state is not None else None
+
+    def bump(self, key, slide_index=ALL_SLIDES):
+        with self._lock:
+            state = self._docs.get(key)
+            if state is None:
+                return None
+            state.generation = self._tick()
+            state.log.append((state.generation, slide_index))
+            if len(state.log) > self._log_size:
+                state.floor = state.log.popleft()[0]
+            generation = state.generation
+        if self._events is not None:
+            self._events.publish(
+                "document.modified",
+                {"doc": key, "generation": generation, "slide_index": slide_index},
+            )
+        return generation
+
+    def _on_modified(self, key):
+        state = self._docs.get(key)
+        if state is not None and threading.get_ident() in state.writers:
+            return
+        self.bump(key)
+
+    @contextmanager
+    def writing(self, key, slide_index=ALL_SLIDES):
+        """API 写操作:期间的修改事件合并为一次针对 slide_index 的 bump"""
+        state = self._docs.get(key)
+        if state is None:
+            yield
+            return
+        thread = threading.get_ident()
+        with self._lock:
+            state.writers[thread] = state.writers.get(thread, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                depth = state.writers.pop(thread) - 1
+                if depth:
+                    state.writers[thread] = depth
+            self.bump(key, slide_index)
+
+    def changed_since(self, key, generation, slide_index=ALL_SLIDES):
+        """自 generation 以来（slide_index 页，或任意页）是否有修改"""
+        state = self._docs.get(key)
+        if state is None or generation is None:
+            return True
+        if state.generation == generation:
+            return False
+        if generation < state.floor:
+            # generation 早于本文档状态的创建，或相关记录已经滚出日志，只能保守地认为变了
+            return True
+        with self._lock:
+            entries = list(state.log)
+        for gen, index in entries:
+            if gen <= generation:
+                continue
+            if index is ALL_SLIDES or slide_index is ALL_SLIDES or index == slide_index:
+                return True
+        return False
+
+
+tracker = DocumentTracker(events=hub)
@@ -0,0 +1,392 @@
+"""
+形状几何缓存与屏幕坐标换算
+
+GeometryCache 按 (文档, 页) 缓存每个形状的外接矩形（1/100 mm），借助 tracker 的
+generation 判断是否失效:该页（或整份文档）被修改后下次访问时重新读取。
+
+SpatialIndex 在缓存的外接矩形上建均匀网格，回答"点下是哪个形状""哪些形状与矩形相交"，
+结果按 z 序从上到下排列。几何缓存刷新时只对位置/大小有变化的形状增删网格项。
+
+ViewTransform 把幻灯片坐标换算为屏幕像素:
+- 视图窗口在屏幕上的位置与大小:优先从无障碍树里找 DOCUMENT_PRESENTATION 节点
+  （即中间的编辑视图，不含左侧幻灯片窗格与侧边栏），找不到时退回组件窗口的 PosSize
+- 可见区域:controller.VisibleArea（1/100 mm）
+查找无障碍节点开销较大，按文档缓存节点句柄；每次请求只读三个值（可见区域、
+节点屏幕位置与大小），三者不变时复用上次的换算参数。
+
+三者都按文档 key 缓存:文档关闭时 forget() 整体丢弃，幻灯片被删除后 prune() 丢弃
+超出页数的页。
+"""
+
+import logging
+import os
+import threading
+from collections import namedtuple
+
+from impress_events import tracker
+from impress_metrics import record_cache
+from impress_uno_trace import unwrap
+
+logger = logging.getLogger(__name__)
+
+ShapeBox = namedtuple("ShapeBox", "index type name x y width height")
+
+# 网格边长（1/100 mm），默认 2 cm；覆盖格子数超过上限的大形状单独存放、每次查询都检查
+GRID_CELL = int(os.environ.get("IMPRESS_GRID_CELL", "2000"))
+_MAX_CELLS_PER_SHAPE = 64
+
+# 无障碍树广度优先搜索的上限
+_A11Y_MAX_NODES = 400
+_A11Y_MAX_DEPTH = 8
+
+
+def shape_box(shape, index):
+    """读一个形状的外接矩形:BoundRect 已考虑旋转且只需一次调用，不支持时退回 Position/Size"""
+    try:
+        rect = shape.BoundRect
+        x, y, width, height = rect.X, rect.Y, rect.Width, rect.Height
+    except Exception:
+        position, size = shape.Position, shape.Size
+        x, y, width, height = position.X, position.Y, size.Width, size.Height
+    try:
+        name = shape.Name
+    except Exception:
+        name = ""
+    return ShapeBox(index, shape.getShapeType(), name, x, y, width, height)
+
+
+class GeometryCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._slides = {}
+
+    def get(self, doc_key, slide_index, slide):
+        """
+        返回该页所有形状的 ShapeBox 列表（按 z 序，即页内索引）。
+        slide 也可以是返回幻灯片的无参函数，缓存命中时不调用；取不到幻灯片时返回 None。
+        """
+        cache_key = (doc_key, slide_index)
+        with self._lock:
+            cached = self._slides.get(cache_key)
+        if cached is not None and not tracker.changed_since(doc_key, cached[0], slide_index):
+            record_cache("geometry", True)
+            return cached[1]
+        record_cache("geometry", False)
+
+        # 先取 generation 再读形状:读取期间发生的修改会让下次访问判定为过期
+        generation = tracker.generation(doc_key)
+        if callable(slide):
+            slide = slide()
+            if slide is None:
+                return None
+        boxes = [shape_box(slide.getByIndex(i), i) for i in range(slide.getCount())]
+        if generation is not None:
+            with self._lock:
+                self._slides[cache_key] = (generation, boxes)
+        return boxes
+
+    def generation_of(self, doc_key, slide_index):
+        cached = self._slides.get((doc_key, slide_index))
+        return cached[0] if cached is not None else None
+
+    def forget(self, doc_key):
+        """文档关闭后丢弃它的全部页"""
+        self.prune(doc_key, 0)
+
+    def prune(self, doc_key, slide_count):
+        """丢弃页号不小于 slide_count 的页（幻灯片被删除后）"""
+        with self._lock:
+            for cache_key in [k for k in self._slides if k[0] == doc_key and k[1] >= slide_count]:
+                del self._slides[cache_key]
+
+    def clear(self):
+        with self._lock:
+            self._slides.clear()
+
+
+geometry = GeometryCache()
+
+
+def _intersects(b, x, y, width, height):
+    return b.x <= x + width and b.x + b.width >= x and b.y <= y + height and b.y + b.height >= y
+
+
+def _contains(b, x, y, width, height):
+    return b.x >= x and b.y >= y and b.x + b.width <= x + width and b.y + b.height <= y + height
+
+
+class SpatialIndex:
+    """单页形状外接矩形的网格索引"""
+
+    def __init__(self, cell=GRID_CELL):
+        self.cell = cell
+        self._lock = threading.Lock()
+        self._boxes = {}
+        self._cells = {}
+        self._large = set()
+
+    def _cell_range(self, x, y, width, height):
+        c = self.cell
+        return range(x // c, (x + width) // c + 1), range(y // c, (y + height) // c + 1)
+
+    def _insert(self, b):
+        self._boxes[b.index] = b
+        xs, ys = self._cell_range(b.x, b.y, b.width, b.height)
+        if len(xs) * len(ys) > _MAX_CELLS_PER_SHAPE:
+            self._large.add(b.index)
+            return
+        for cx in xs:
+            for cy in ys:
+                self._cells.setdefault((cx, cy), set()).add(b.index)
+
+    def _remove(self, index):
+        b = self._boxes.pop(index)
+        if index in self._large:
+            self._large.discard(index)
+            return
+        xs, ys = self._cell_range(b.x, b.y, b.width, b.height)
+        for cx in xs:
+            for cy in ys:
+                members = self._cells.get((cx, cy))
+                if members is not None:
+                    members.discard(index)
+                    if not members:
+                        del self._cells[(cx, cy)]
+
+    def update(self, boxes):
+        """与新的 ShapeBox 列表对齐，返回增删的形状数"""
+        changed = 0
+        current = {b.index: b for b in boxes}
+        with self._lock:
+            for index in [i for i in self._boxes if current.get(i) != self._boxes[i]]:
+                self._remove(index)
+                changed += 1
+            for index, b in current.items():
+                if index not in self._boxes:
+                    self._insert(b)
+                    changed += 1
+        return changed
+
+    def _candidates(self, x, y, width, height):
+        xs, ys = self._cell_range(x, y, width, height)
+        found = set(self._large)
+        for cx in xs:
+            for cy in ys:
+                found.update(self._cells.get((cx, cy), ()))
+        return found
+
+    def query(self, x, y, width=0, height=0, contains=False):
+        """与矩形相交（contains=True 时完全落在矩形内）的形状，z 序从上到下"""
+        test = _contains if contains else _intersects
+        with self._lock:
+            hits = [
+                self._boxes[i]
+                for i in self._candidates(x, y, width, height)
+                if test(self._boxes[i], x, y, width, height)
+            ]
+        hits.sort(key=lambda b: b.index, reverse=True)
+        return hits
+
+    def hit_test(self, x, y, tolerance=0):
+        """点 (x, y) 处的形状，z 序从上到下；线条等零宽形状靠 tolerance 命中"""
+        return self.query(x - tolerance, y - tolerance, 2 * tolerance, 2 * tolerance)
+
+    def __len__(self):
+        return len(self._boxes)
+
+
+class SpatialIndexes:
+    """按 (文档, 页) 维护 SpatialIndex，跟随几何缓存增量更新"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._slides = {}
+
+    def get(self, doc_key, slide_index, slide):
+        """返回该页的 SpatialIndex；slide 的含义同 GeometryCache.get，取不到时返回 None"""
+        boxes = geometry.get(doc_key, slide_index, slide)
+        if boxes is None:
+            return None
+        cache_key = (doc_key, slide_index)
+        with self._lock:
+            entry = self._slides.get(cache_key)
+            if entry is None:
+                entry = self._slides[cache_key] = [None, SpatialIndex()]
+            # 几何缓存未刷新时返回的是同一个列表对象
+            if entry[0] is not boxes:
+                changed = entry[1].update(boxes)
+                entry[0] = boxes
+                logger.debug(f"空间索引 {cache_key} 更新 {changed} 项")
+            return entry[1]
+
+    def forget(self, doc_key):
+        self.prune(doc_key, 0)
+
+    def prune(self, doc_key, slide_count):
+        with self._lock:
+            for cache_key in [k for k in self._slides if k[0] == doc_key and k[1] >= slide_count]:
+                del self._slides[cache_key]
+
+    def clear(self):
+        with self._lock:
+            self._slides.clear()
+
+
+spatial = SpatialIndexes()
+
+
+class Transform:
+    """幻灯片坐标（1/100 mm）-> 屏幕像素"""
+
+    def __init__(self, visible_area, origin, size, source):
+        self.visible_area = visible_area
+        self.origin = origin
+        self.size = size
+        self.source = source
+        va_x, va_y, va_width, va_height = visible_area
+        self.scale_x = size[0] / va_width if va_width else 0.0
+        self.scale_y = size[1] / va_height if va_height else 0.0
+        self.offset_x = origin[0] - va_x * self.scale_x
+        self.offset_y = origin[1] - va_y * self.scale_y
+
+    def box(self, b):
+        x = self.offset_x + b.x * self.scale_x
+        y = self.offset_y + b.y * self.scale_y
+        return {
+            "x": round(x),
+            "y": round(y),
+            "width": round(b.width * self.scale_x),
+            "height": round(b.height * self.scale_y),
+        }
+
+    def to_slide(self, x, y):
+        """屏幕像素 -> 幻灯片坐标"""
+        return (
+            round((x - self.offset_x) / self.scale_x) if self.scale_x else 0,
+            round((y - self.offset_y) / self.scale_y) if self.scale_y else 0,
+        )
+
+    def on_screen(self, b):
+        va_x, va_y, va_width, va_height = self.visible_area
+        return (
+            b.x < va_x + va_width
+            and b.x + b.width > va_x
+            and b.y < va_y + va_height
+            and b.y + b.height > va_y
+        )
+
+    def describe(self):
+        return {
+            "scale_x": self.scale_x,
+            "scale_y": self.scale_y,
+            "offset_x": self.offset_x,
+            "offset_y": self.offset_y,
+            "visible_area": dict(zip(("x", "y", "width", "height"), self.visible_area)),
+            "window": {
+                "x": self.origin[0],
+                "y": self.origin[1],
+                "width": self.size[0],
+                "height": self.size[1],
+            },
+            "source": self.source,
+        }
+
+
+def _find_document_view(window):
+    """在窗口的无障碍树里找编辑视图节点（DOCUMENT_PRESENTATION）"""
+    try:
+        from com.sun.star.accessibility.AccessibleRole import DOCUMENT_PRESENTATION
+    except ImportError:
+        return None
+    try:
+        queue = [(window.getAccessibleContext(), 0)]
+    except Exception:
+        return None
+    visited = 0
+    while queue and visited < _A11Y_MAX_NODES:
+        context, depth = queue.pop(0)
+        visited += 1
+        if context is None:
+            continue
+        try:
+            if context.getAccessibleRole() == DOCUMENT_PRESENTATION:
+                return context
+            if depth >= _A11Y_MAX_DEPTH:
+                continue
+            for i in range(context.getAccessibleChildCount()):
+                child = context.getAccessibleChild(i)
+                queue.append((child.getAccessibleContext() if child else None, depth + 1))
+        except Exception as e:
+            logger.debug(f"遍历无障碍树失败: {e}")
+    return None
+
+
+class ViewTransforms:
+    """按文档缓存视图节点与换算参数"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def _locate(self, controller):
+        """返回一个无参函数，调用时给出视图窗口的 ((x, y), (w, h), source)"""
+        frame = controller.getFrame()
+        view = _find_document_view(frame.getContainerWindow())
+        if view is not None:
+
+            def read():
+                location, size = view.getLocationOnScreen(), view.getSize()
+                return (location.X, location.Y), (size.Width, size.Height), "accessibility"
+
+            return read
+
+        component = frame.getComponentWindow()
+        container = frame.getContainerWindow()
+
+        def read():
+            # 组件窗口相对容器窗口；顶层容器窗口的 PosSize 即屏幕位置
+            rect, outer = component.getPosSize(), container.getPosSize()
+            return (outer.X + rect.X, outer.Y + rect.Y), (rect.Width, rect.Height), "window"
+
+        return read
+
+    def get(self, doc_key, controller):
+        # 缓存的是跨请求复用的句柄，不带当前请求的 UNO 计量包装
+        controller = unwrap(controller)
+        with self._lock:
+            entry = self._views.get(doc_key)
+        if entry is None or entry["controller"] != controller:
+            entry = {"controller": controller, "read": self._locate(controller), "transform": None}
+            with self._lock:
+                self._views[doc_key] = entry
+
+        area = controller.VisibleArea
+        visible_area = (area.X, area.Y, area.Width, area.Height)
+        try:
+            origin, size, source = entry["read"]()
+        except Exception:
+            # 视图节点失效（窗口重建等），重新查找一次
+            entry["read"] = self._locate(controller)
+            origin, size, source = entry["read"]()
+
+        transform = entry["transform"]
+        hit = transform is not None and (
+            transform.visible_area,
+            transform.origin,
+            transform.size,
+        ) == (visible_area, origin, size)
+        record_cache("view_transform", hit)
+        if not hit:
+            transform = entry["transform"] = Transform(visible_area, origin, size, source)
+        return transform
+
+    def forget(self, doc_key):
+        with self._lock:
+            self._views.pop(doc_key, None)
+
+    def clear(self):
+        with self._lock:
+            self._views.clear()
+
+
+view_transforms = ViewTransforms()
@@ -0,0 +1,72 @@
+"""
+解码后图片（XGraphic）的缓存
+
+插入图片时字节要经桥接传给 soffice 再由 GraphicProvider 解码，同一素材在成千上万个
+episode 里反复插入时这部分开销最大。这里按内容 sha256 缓存解码得到的 XGraphic，
+命中时新建 GraphicObjectShape 直接引用同一个 graphic，不再传字节、不再解码。
+
+XGraphic 活在 soffice 进程里，桥接断开后全部失效，需要 clear()。
+ctx 可以是请求的 UNO 计量代理（解码调用照常计量），缓存里只放去掉代理的原始对象。
+"""
+
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from com.sun.star.beans import PropertyValue
+
+from impress_metrics import record_cache
+from impress_templates import input_stream
+from impress_uno_trace import unwrap
+
+logger = logging.getLogger(__name__)
+
+CACHE_SIZE = int(os.environ.get("IMPRESS_GRAPHIC_CACHE_SIZE", "64"))
+
+
+class GraphicCache:
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self._lock = threading.Lock()
+        self._graphics = OrderedDict()
+
+    def get_or_decode(self, ctx, data):
+        """返回 (sha256, XGraphic, 是否命中)；解码失败抛 ValueError"""
+        sha256 = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            graphic = self._graphics.get(sha256)
+            if graphic is not None:
+                self._graphics.move_to_end(sha256)
+        record_cache("graphic", graphic is not None)
+        if graphic is not None:
+            return sha256, graphic, True
+
+        provider = ctx.ServiceManager.createInstanceWithContext(
+            "com.sun.star.graphic.GraphicProvider", ctx
+        )
+        prop = PropertyValue()
+        prop.Name = "InputStream"
+        # 结构体字段不经过计量代理的参数解包，必须放原始对象，否则 pyuno 无法转换
+        prop.Value = unwrap(input_stream(ctx, data))
+        # 缓存跨请求复用，不能带着首个请求的 UNO 计量包装
+        graphic = unwrap(provider.queryGraphic((prop,)))
+        if graphic is None:
+            raise ValueError("LibreOffice could not decode the image")
+
+        with self._lock:
+            self._graphics[sha256] = graphic
+            while len(self._graphics) > self.size:
+                self._graphics.popitem(last=False)
+        return sha256, graphic, False
+
+    def clear(self):
+        with self._lock:
+            self._graphics.clear()
+
+    def __len__(self):
+        return len(self._graphics)
+
+
+graphics = GraphicCache()
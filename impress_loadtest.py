@@ -0,0 +1,357 @@
+"""
+压测工具:按任务 JSON 回放 config 里的 execute 步骤与 evaluator 读取，
+统计每个端点的 p50/p95/p99 延迟与错误率
+
+    python impress_loadtest.py test_tasks/*.json --concurrency 8 --episodes 200
+    python impress_loadtest.py test_tasks/*.json --fake --shapes 50 --duration 30
+"""
+
+import argparse
+import glob
+import itertools
+import json
+import re
+import shlex
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlsplit
+
+import requests
+
+DEFAULT_BASE_URL = "http://localhost:5011"
+
+# evaluator.result.type / verification -> 评测时对 API 的读取
+EVALUATOR_READS = {
+    "current_content": [("GET", "/api/slide/current")],
+    "selected_content": [("GET", "/api/slide/text-selection")],
+}
+VERIFICATION_READS = {
+    "textbox_selection": [("GET", "/api/slide/selection")],
+}
+
+
+@dataclass
+class ApiCall:
+    method: str
+    path: str
+    body: Optional[Any] = None
+    sleep: float = 0.0  # 回放前需要等待的秒数（任务里的 sleep 步骤）
+
+
+@dataclass
+class Episode:
+    task_id: str
+    setup: List[ApiCall]
+    reads: List[ApiCall]
+
+
+def parse_curl(command) -> Optional[ApiCall]:
+    """把任务里的 curl 命令（shell 字符串或 argv 列表）解析成 ApiCall；不是 curl 则返回 None"""
+    if isinstance(command, str):
+        try:
+            argv = shlex.split(command)
+        except ValueError:
+            return None
+    else:
+        argv = list(command)
+    if not argv or argv[0] != "curl":
+        return None
+
+    method, url, data = None, None, None
+    i = 1
+    while i < len(argv):
+        arg = argv[i]
+        if arg in ("-X", "--request"):
+            method = argv[i + 1]
+            i += 2
+        elif arg in ("-d", "--data", "--data-raw", "--data-binary"):
+            data = argv[i + 1]
+            i += 2
+        elif arg in ("-H", "--header", "-o", "--output", "-m", "--max-time"):
+            i += 2
+        elif arg.startswith("-"):
+            i += 1
+        else:
+            url = arg
+            i += 1
+    if url is None:
+        return None
+
+    if "://" not in url:
+        url = "http://" + url
+    parts = urlsplit(url)
+    path = parts.path + (f"?{parts.query}" if parts.query else "")
+    body = None
+    if data is not None:
+        try:
+            body = json.loads(data)
+        except ValueError:
+            body = data
+    return ApiCall(method or ("POST" if data is not None else "GET"), path, body)
+
+
+def load_episode(path: str) -> Episode:
+    with open(path, "r", encoding="utf-8") as f:
+        task = json.load(f)
+
+    setup = []
+    pending_sleep = 0.0
+    for step in task.get("config", []):
+        params = step.get("parameters", {})
+        if step.get("type") == "sleep":
+            pending_sleep += float(params.get("seconds", 0))
+        elif step.get("type") == "execute":
+            command = params.get("command", [])
+            if params.get("shell") and isinstance(command, list):
+                command = " ".join(command)
+            call = parse_curl(command)
+            if call is not None:
+                call.sleep = pending_sleep
+                pending_sleep = 0.0
+                setup.append(call)
+
+    result = task.get("evaluator", {}).get("result", {})
+    reads = [
+        ApiCall(method, path)
+        for method, path in EVALUATOR_READS.get(result.get("type"), [])
+        + VERIFICATION_READS.get(result.get("verification"), [])
+    ]
+    return Episode(task.get("id", path), setup, reads)
+
+
+def endpoint_label(method: str, path: str) -> str:
+    """把 /api/slide/3 归并为 /api/slide/<int>"""
+    path = re.sub(r"/\d+(?=/|$)", "/<int>", path.split("?", 1)[0])
+    return f"{method} {path}"
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+@dataclass
+class Stats:
+    latencies: Dict[str, List[float]] = field(default_factory=lambda: defaultdict(list))
+    errors: Dict[str, int] = field(default_factory=lambda: defaultdict(int))
+    episodes: int = 0
+    failed_episodes: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def record(self, label, seconds, ok):
+        with self.lock:
+            self.latencies[label].append(seconds)
+            if not ok:
+                self.errors[label] += 1
+
+    def summary(self, wall_seconds):
+        endpoints = {}
+        for label, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            endpoints[label] = {
+                "count": len(values),
+                "errors": self.errors.get(label, 0),
+                "error_rate": self.errors.get(label, 0) / len(values),
+                "p50_ms": percentile(values, 50) * 1000,
+                "p95_ms": percentile(values, 95) * 1000,
+                "p99_ms": percentile(values, 99) * 1000,
+                "max_ms": values[-1] * 1000,
+            }
+        return {
+            "episodes": self.episodes,
+            "failed_episodes": self.failed_episodes,
+            "wall_seconds": wall_seconds,
+            "episodes_per_second": self.episodes / wall_seconds if wall_seconds else 0,
+            "endpoints": endpoints,
+        }
+
+
+class RateLimiter:
+    """全局限速:每秒最多开始 rate 个 episode（rate<=0 不限速）"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.next_start = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_start)
+            self.next_start = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def _is_error(response):
+    if response.status_code >= 400:
+        return True
+    try:
+        payload = response.json()
+    except ValueError:
+        return False
+    return isinstance(payload, dict) and "error" in payload
+
+
+def run_episode(
+    session, base_url, episode, stats, honor_sleeps, timeout, report_episodes=False
+):
+    ok = True
+    for call in episode.setup + episode.reads:
+        if honor_sleeps and call.sleep:
+            time.sleep(call.sleep)
+        label = endpoint_label(call.method, call.path)
+        start = time.perf_counter()
+        try:
+            response = session.request(
+                call.method, base_url + call.path, json=call.body, timeout=timeout
+            )
+            call_ok = not _is_error(response)
+        except requests.RequestException:
+            call_ok = False
+        stats.record(label, time.perf_counter() - start, call_ok)
+        ok = ok and call_ok
+    with stats.lock:
+        stats.episodes += 1
+        if not ok:
+            stats.failed_episodes += 1
+    if report_episodes:
+        # 让 soffice 监管按 episode 数回收；上报失败不计入统计
+        try:
+            session.post(base_url + "/api/supervisor/episode", timeout=timeout)
+        except requests.RequestException:
+            pass
+
+
+def run_load(
+    base_url,
+    episodes,
+    concurrency=4,
+    rate=0.0,
+    total=None,
+    duration=None,
+    honor_sleeps=False,
+    timeout=30.0,
+    report_episodes=False,
+):
+    """并发回放 episodes，直到跑满 total 个或超过 duration 秒"""
+    if total is None and duration is None:
+        total = len(episodes)
+    stats = Stats()
+    limiter = RateLimiter(rate)
+    counter = itertools.count()
+    counter_lock = threading.Lock()
+    deadline = time.monotonic() + duration if duration else None
+
+    def worker():
+        session = requests.Session()
+        session.trust_env = False  # 与 quick_test.py 一样绕开代理
+        while True:
+            with counter_lock:
+                n = next(counter)
+            if total is not None and n >= total:
+                return
+            if deadline is not None and time.monotonic() >= deadline:
+                return
+            limiter.wait()
+            episode = episodes[n % len(episodes)]
+            run_episode(
+                session, base_url, episode, stats, honor_sleeps, timeout, report_episodes
+            )
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    return stats.summary(time.monotonic() - start)
+
+
+def start_fake_server(shapes=0, table=None, latency_us=0.0):
+    """在本进程里用 fake_uno 启动 API，返回 (base_url, server)"""
+    import fake_uno
+
+    office = fake_uno.install()
+    office.reset(shapes=shapes, table=table, latency=latency_us / 1e6)
+
+    import logging
+
+    import impress_api
+    from werkzeug.serving import make_server
+
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    impress_api.logger.setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, impress_api.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", server
+
+
+def print_report(summary):
+    print(
+        f"episodes={summary['episodes']} failed={summary['failed_episodes']} "
+        f"wall={summary['wall_seconds']:.2f}s "
+        f"throughput={summary['episodes_per_second']:.2f} episodes/s"
+    )
+    header = f"{'endpoint':<40} {'count':>7} {'err%':>6} {'p50ms':>8} {'p95ms':>8} {'p99ms':>8} {'maxms':>8}"
+    print(header)
+    print("-" * len(header))
+    for label, s in summary["endpoints"].items():
+        print(
+            f"{label:<40} {s['count']:>7} {s['error_rate'] * 100:>6.1f} "
+            f"{s['p50_ms']:>8.2f} {s['p95_ms']:>8.2f} {s['p99_ms']:>8.2f} {s['max_ms']:>8.2f}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Impress API load generator")
+    parser.add_argument("tasks", nargs="+", help="task JSON files or globs")
+    parser.add_argument("--base-url", default=DEFAULT_BASE_URL)
+    parser.add_argument("--concurrency", type=int, default=4, help="concurrent episodes")
+    parser.add_argument("--rate", type=float, default=0.0, help="max episodes started per second (0 = unlimited)")
+    parser.add_argument("--episodes", type=int, default=None, help="total episodes to run")
+    parser.add_argument("--duration", type=float, default=None, help="stop after this many seconds")
+    parser.add_argument("--honor-sleeps", action="store_true", help="replay the tasks' sleep steps")
+    parser.add_argument("--timeout", type=float, default=30.0, help="per-request timeout in seconds")
+    parser.add_argument("--report-episodes", action="store_true", help="POST /api/supervisor/episode after each episode")
+    parser.add_argument("--fake", action="store_true", help="target an in-process API on fake_uno")
+    parser.add_argument("--shapes", type=int, default=0, help="shapes per slide for --fake")
+    parser.add_argument("--latency-us", type=float, default=0.0, help="per-call bridge latency for --fake")
+    parser.add_argument("--json", dest="json_out", help="also write the summary to this file")
+    args = parser.parse_args(argv)
+
+    paths = sorted({p for pattern in args.tasks for p in (glob.glob(pattern) or [pattern])})
+    episodes = [load_episode(p) for p in paths]
+    if not episodes:
+        parser.error("no tasks found")
+
+    base_url = args.base_url
+    if args.fake:
+        base_url, _server = start_fake_server(args.shapes, latency_us=args.latency_us)
+
+    summary = run_load(
+        base_url.rstrip("/"),
+        episodes,
+        concurrency=args.concurrency,
+        rate=args.rate,
+        total=args.episodes,
+        duration=args.duration,
+        honor_sleeps=args.honor_sleeps,
+        timeout=args.timeout,
+        report_episodes=args.report_episodes,
+    )
+    print_report(summary)
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
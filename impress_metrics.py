@@ -0,0 +1,242 @@
+"""
+轻量级 Prometheus 指标（文本暴露格式 0.0.4）
+
+不依赖 prometheus_client，只用一把锁 + dict 计数，开销足够小，可常驻开启。
+"""
+
+import threading
+import time
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 默认延迟桶（秒），覆盖从本地缓存命中到卡住的 UNO 调用
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labelvalues):
+        if len(labelvalues) != len(self.labelnames):
+            raise ValueError(
+                f"{self.name} expects labels {self.labelnames}, got {labelvalues}"
+            )
+        return tuple(str(v) for v in labelvalues)
+
+    def _samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, _format_labels(self.labelnames, key), value
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for name, labels, value in self._samples():
+            lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labelvalues, amount=1):
+        key = self._key(labelvalues)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, *labelvalues):
+        return self._values.get(self._key(labelvalues), 0)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, *labelvalues, amount=1):
+        key = self._key(labelvalues)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, *labelvalues, amount=1):
+        self.inc(*labelvalues, amount=-amount)
+
+    def set(self, value, *labelvalues):
+        key = self._key(labelvalues)
+        with self._lock:
+            self._values[key] = value
+
+    def get(self, *labelvalues):
+        return self._values.get(self._key(labelvalues), 0)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labelvalues):
+        key = self._key(labelvalues)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [每个桶的计数..., sum, count]
+                state = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, upper in enumerate(self.buckets):
+                if value <= upper:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def time(self, *labelvalues):
+        return _Timer(self, labelvalues)
+
+    def _samples(self):
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        for key, state in items:
+            cumulative = 0
+            for upper, count in zip(self.buckets, state):
+                cumulative += count
+                le = f'le="{_format_value(upper)}"'
+                yield (
+                    f"{self.name}_bucket",
+                    _format_labels(self.labelnames, key, le),
+                    cumulative,
+                )
+            yield (
+                f"{self.name}_bucket",
+                _format_labels(self.labelnames, key, 'le="+Inf"'),
+                state[-1],
+            )
+            yield f"{self.name}_sum", _format_labels(self.labelnames, key), state[-2]
+            yield f"{self.name}_count", _format_labels(self.labelnames, key), state[-1]
+
+
+class _Timer:
+    def __init__(self, histogram, labelvalues):
+        self.histogram = histogram
+        self.labelvalues = labelvalues
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labelvalues)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        return "\n".join(m.render() for m in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUEST_LATENCY = REGISTRY.histogram(
+    "impress_api_request_duration_seconds",
+    "HTTP request latency by route",
+    ("route", "method"),
+)
+REQUESTS = REGISTRY.counter(
+    "impress_api_requests_total",
+    "HTTP requests by route and status code",
+    ("route", "method", "status"),
+)
+IN_FLIGHT = REGISTRY.gauge(
+    "impress_api_requests_in_flight",
+    "HTTP requests currently being served",
+)
+ERRORS = REGISTRY.counter(
+    "impress_api_errors_total",
+    "Errors by route (http status >= 400, error payloads, unhandled exceptions)",
+    ("route", "kind"),
+)
+UNO_CONNECTS = REGISTRY.counter(
+    "impress_uno_connects_total",
+    "UNO bridge connection attempts",
+    ("kind", "outcome"),
+)
+SOFFICE_RESTARTS = REGISTRY.counter(
+    "impress_soffice_restarts_total",
+    "soffice processes (re)started by the supervisor",
+    ("reason",),
+)
+SOFFICE_RSS = REGISTRY.gauge(
+    "impress_soffice_rss_bytes",
+    "Resident memory of the supervised soffice process group",
+)
+CACHE_REQUESTS = REGISTRY.counter(
+    "impress_cache_requests_total",
+    "Cache lookups by cache name and result (hit/miss)",
+    ("cache", "result"),
+)
+
+
+def record_cache(cache, hit):
+    """记录一次缓存查询结果，供 /metrics 计算命中率"""
+    CACHE_REQUESTS.inc(cache, "hit" if hit else "miss")
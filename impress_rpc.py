@@ -0,0 +1,287 @@
+"""
+WebSocket 上的 JSON-RPC 2.0 通道
+
+一个连接可以跑完整个 episode:
+- 方法与 REST 路由一一对应（METHODS 别名，或直接写 "GET /api/slide/current"），
+  在进程内经过完整的 Flask 分发，指标、ETag、UNO 计量等行为与 HTTP 调用一致
+- 支持流水线:读线程只负责收包，请求按到达顺序交给工作线程执行，客户端无需等待响应
+- 支持批量请求（JSON 数组）与通知（无 id，不回包）
+- events.subscribe 后，服务端以 JSON-RPC 通知推送 hub 上的事件（如 document.modified）；
+  只推送订阅时指定的文档（params.doc_id，缺省为当前文档）的事件
+"""
+
+import json
+import logging
+import queue
+import threading
+
+from impress_codec import dumps_json
+
+logger = logging.getLogger(__name__)
+
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+SERVER_ERROR = -32000
+
+# JSON-RPC 方法名 -> (HTTP 方法, 路径模板)；路径里的 {name} 从 params 中取
+METHODS = {
+    "connect": ("POST", "/api/connect"),
+    "health": ("GET", "/api/health"),
+    "presentation.info": ("GET", "/api/presentation/info"),
+    "presentation.content": ("GET", "/api/presentation/content"),
+    "slide.current": ("GET", "/api/slide/current"),
+    "slide.get": ("GET", "/api/slide/{index}"),
+    "slide.screenBoxes": ("GET", "/api/slide/screen-boxes"),
+    "slide.hitTest": ("GET", "/api/slide/{index}/hit-test"),
+    "slide.region": ("GET", "/api/slide/{index}/region"),
+    "search": ("GET", "/api/search"),
+    "snapshots.list": ("GET", "/api/snapshots"),
+    "snapshots.take": ("POST", "/api/snapshots"),
+    "snapshots.diff": ("GET", "/api/snapshots/{snapshot_id}/diff"),
+    "snapshots.delete": ("DELETE", "/api/snapshots/{snapshot_id}"),
+    "trajectories.list": ("GET", "/api/trajectories"),
+    "trajectories.start": ("POST", "/api/trajectories"),
+    "trajectories.step": ("POST", "/api/trajectories/{episode}/step"),
+    "trajectories.stop": ("POST", "/api/trajectories/{episode}/stop"),
+    "trajectories.state": ("GET", "/api/trajectories/{episode}/state"),
+    "slide.selection": ("GET", "/api/slide/selection"),
+    "slide.selectionSummary": ("GET", "/api/slide/selection/summary"),
+    "slide.textSelection": ("GET", "/api/slide/text-selection"),
+    "slide.background": ("GET", "/api/slide/background"),
+    "slide.addText": ("POST", "/api/slide/add-text"),
+    "slide.addImage": ("POST", "/api/slide/add-image"),
+    "slide.addTable": ("POST", "/api/slide/add-table"),
+    "slide.format": ("POST", "/api/slide/format"),
+    "slide.updateShape": ("PUT", "/api/slide/update-shape"),
+    "slide.new": ("POST", "/api/slide/new"),
+    "slide.delete": ("DELETE", "/api/slide/{index}"),
+    "documents.list": ("GET", "/api/documents"),
+    "documents.open": ("POST", "/api/documents/open"),
+    "documents.adopt": ("POST", "/api/documents/adopt"),
+    "documents.close": ("DELETE", "/api/documents/{doc_id}"),
+    "templates.list": ("GET", "/api/templates"),
+    "templates.add": ("POST", "/api/templates"),
+    "templates.load": ("POST", "/api/templates/load"),
+    "supervisor.status": ("GET", "/api/supervisor"),
+    "supervisor.episode": ("POST", "/api/supervisor/episode"),
+    "supervisor.recycle": ("POST", "/api/supervisor/recycle"),
+}
+
+_HTTP_METHODS = ("GET", "POST", "PUT", "DELETE", "PATCH")
+
+
+class RpcError(Exception):
+    def __init__(self, code, message, data=None):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.data = data
+
+    def to_dict(self):
+        error = {"code": self.code, "message": self.message}
+        if self.data is not None:
+            error["data"] = self.data
+        return error
+
+
+def _query_value(value):
+    # REST 路由按 "true"/"false" 字符串解析布尔参数
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return value
+
+
+def resolve_route(method, params):
+    """把 JSON-RPC 方法解析为 (HTTP 方法, 路径, 剩余参数)"""
+    if method in METHODS:
+        http_method, template = METHODS[method]
+    else:
+        verb, _, path = method.partition(" ")
+        if verb.upper() not in _HTTP_METHODS or not path.startswith("/"):
+            raise RpcError(METHOD_NOT_FOUND, f"Method not found: {method}")
+        http_method, template = verb.upper(), path
+
+    params = dict(params)
+    try:
+        path = template.format_map(params)
+    except KeyError as e:
+        raise RpcError(INVALID_PARAMS, f"Missing parameter {e.args[0]!r} for {method}")
+    for name in _template_fields(template):
+        params.pop(name, None)
+    return http_method, path, params
+
+
+def _template_fields(template):
+    fields = []
+    rest = template
+    while "{" in rest:
+        _, _, rest = rest.partition("{")
+        name, _, rest = rest.partition("}")
+        fields.append(name)
+    return fields
+
+
+def dispatch(app, method, params):
+    """在进程内经过完整的 Flask 分发执行一次 REST 调用，返回解析后的 JSON"""
+    http_method, path, params = resolve_route(method, params)
+    kwargs = {"method": http_method, "headers": {"Accept": "application/json"}}
+    if http_method in ("GET", "DELETE"):
+        kwargs["query_string"] = {k: _query_value(v) for k, v in params.items()}
+    else:
+        kwargs["json"] = params
+
+    with app.test_request_context(path, **kwargs):
+        response = app.full_dispatch_request()
+        body = response.get_data()
+
+    try:
+        if response.mimetype == "application/x-ndjson":
+            payload = [json.loads(line) for line in body.splitlines() if line]
+        else:
+            payload = json.loads(body) if body else None
+    except ValueError:
+        payload = body.decode("utf-8", "replace")
+    if response.status_code >= 400:
+        message = payload.get("error") if isinstance(payload, dict) else None
+        raise RpcError(
+            SERVER_ERROR,
+            message or f"HTTP {response.status_code}",
+            {"status": response.status_code, "body": payload},
+        )
+    return payload
+
+
+class RpcSession:
+    """一个 WebSocket 连接上的 JSON-RPC 会话"""
+
+    def __init__(self, app, ws, events, document_key):
+        """document_key(doc_id) 返回 doc_id 指定（None 为当前）文档的 key，没有文档时返回 None"""
+        self.app = app
+        self.ws = ws
+        self.events = events
+        self.document_key = document_key
+        self.doc_key = None
+        self.inbox = queue.Queue()
+        self.send_lock = threading.Lock()
+        self.subscription = None
+        self.closed = threading.Event()
+
+    def serve(self):
+        worker = threading.Thread(target=self._work, daemon=True)
+        worker.start()
+        try:
+            while True:
+                message = self.ws.receive()
+                if message is None:
+                    break
+                self.inbox.put(message)
+        finally:
+            self.closed.set()
+            self.inbox.put(None)
+            self._unsubscribe()
+            worker.join(timeout=5)
+
+    def send(self, obj):
+        data = dumps_json(obj).decode("utf-8")
+        with self.send_lock:
+            self.ws.send(data)
+
+    def _work(self):
+        while True:
+            message = self.inbox.get()
+            if message is None:
+                return
+            reply = self.handle(message)
+            if reply is not None and not self.closed.is_set():
+                try:
+                    self.send(reply)
+                except Exception as e:
+                    logger.debug(f"RPC 回包失败: {e}")
+                    return
+
+    def handle(self, message):
+        try:
+            request = json.loads(message)
+        except ValueError:
+            return _error_reply(None, RpcError(PARSE_ERROR, "Parse error"))
+
+        if isinstance(request, list):
+            if not request:
+                return _error_reply(None, RpcError(INVALID_REQUEST, "Empty batch"))
+            replies = [r for r in (self.handle_one(item) for item in request) if r]
+            return replies or None
+        return self.handle_one(request)
+
+    def handle_one(self, request):
+        if not isinstance(request, dict) or not isinstance(request.get("method"), str):
+            return _error_reply(None, RpcError(INVALID_REQUEST, "Invalid Request"))
+        request_id = request.get("id")
+        is_notification = "id" not in request
+        params = request.get("params") or {}
+        if not isinstance(params, dict):
+            return _error_reply(
+                request_id, RpcError(INVALID_PARAMS, "params must be an object")
+            )
+
+        try:
+            result = self.call(request["method"], params)
+        except RpcError as e:
+            return None if is_notification else _error_reply(request_id, e)
+        except Exception as e:
+            logger.error(f"RPC {request['method']} failed: {e}", exc_info=True)
+            return (
+                None
+                if is_notification
+                else _error_reply(request_id, RpcError(SERVER_ERROR, str(e)))
+            )
+        if is_notification:
+            return None
+        return {"jsonrpc": "2.0", "id": request_id, "result": result}
+
+    def call(self, method, params):
+        if method == "events.subscribe":
+            return self._subscribe(params.get("doc_id"))
+        if method == "events.unsubscribe":
+            self._unsubscribe()
+            return {"subscribed": False}
+        return dispatch(self.app, method, params)
+
+    def _subscribe(self, doc_id):
+        doc_key = self.document_key(doc_id)
+        if doc_key is None:
+            raise RpcError(SERVER_ERROR, "No presentation available")
+        self.doc_key = doc_key
+        if self.subscription is None:
+            self.subscription = self.events.subscribe()
+            threading.Thread(
+                target=self._push, args=(self.subscription,), daemon=True
+            ).start()
+        return {"subscribed": True, "doc": doc_key}
+
+    def _unsubscribe(self):
+        subscription, self.subscription = self.subscription, None
+        if subscription is not None:
+            self.events.unsubscribe(subscription)
+            try:
+                subscription.put_nowait((None, None))
+            except queue.Full:
+                pass
+
+    def _push(self, subscription):
+        while not self.closed.is_set():
+            event, data = subscription.get()
+            if event is None:
+                return
+            if data.get("doc") != self.doc_key:
+                continue
+            try:
+                self.send({"jsonrpc": "2.0", "method": event, "params": data})
+            except Exception as e:
+                logger.debug(f"RPC 推送失败: {e}")
+                return
+
+
+def _error_reply(request_id, error):
+    return {"jsonrpc": "2.0", "id": request_id, "error": error.to_dict()}
@@ -0,0 +1,286 @@
+"""
+全文检索的增量倒排索引
+
+索引单元是"字段":形状正文、表格单元格、备注页形状的文字各算一个字段。
+倒排表把词（小写；拉丁字母数字按词切分，中日韩文字按单字切分）映射到字段，查询时
+先用倒排表求出同时包含所有查询词的候选字段，再在字段原文里定位查询串，给出字符偏移。
+查询串首尾的词可能只是某个词的一部分（"hap" 能命中 "shape"），这两个词在词表里按
+后缀/前缀/子串匹配，中间的词必须完全相同。词表另按有序表（前缀）、倒序词有序表
+（后缀）与 n-gram（子串）索引，部分匹配不扫描整个词表。匹配偏移在原文上不区分
+大小写查找得到，不受 lower() 改变字符串长度的影响。
+
+按页增量维护:每页记下建索引时的 tracker generation，查询时只有 changed_since 判定
+变过的页才重新读取并替换其倒排项；整份文档自上次查询以来没有任何修改时不碰 UNO。
+文档关闭时 forget() 丢弃整份索引，幻灯片被删除后 prune() 丢弃超出页数的页。
+"""
+
+import bisect
+import logging
+import re
+import threading
+
+from impress_events import tracker
+from impress_metrics import record_cache
+
+logger = logging.getLogger(__name__)
+
+TABLE_SHAPE = "com.sun.star.drawing.TableShape"
+
+_CJK = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff"
+_TOKEN = re.compile(f"[{_CJK}]|[^\\W{_CJK}]+")
+
+
+def tokenize(text):
+    return _TOKEN.findall(text.lower())
+
+
+def _table_fields(shape, shape_index):
+    model = shape.Model
+    rows, cols = model.Rows.getCount(), model.Columns.getCount()
+    for r in range(rows):
+        for c in range(cols):
+            text = model.getCellByPosition(c, r).getString()
+            if text:
+                yield {"kind": "cell", "shape_index": shape_index, "row": r, "column": c}, text
+
+
+def slide_fields(slide):
+    """读一页的全部可检索字段，返回 [(位置信息, 文字)]"""
+    fields = []
+    for i in range(slide.getCount()):
+        shape = slide.getByIndex(i)
+        try:
+            if shape.getShapeType() == TABLE_SHAPE:
+                fields.extend(_table_fields(shape, i))
+            elif hasattr(shape, "getString"):
+                text = shape.getString()
+                if text:
+                    fields.append(({"kind": "shape", "shape_index": i}, text))
+        except Exception as e:
+            logger.debug(f"读取形状 {i} 文字失败: {e}")
+
+    notes = slide.getNotesPage()
+    if notes is not None:
+        for j in range(notes.getCount()):
+            shape = notes.getByIndex(j)
+            if hasattr(shape, "getString"):
+                text = shape.getString()
+                if text:
+                    fields.append(({"kind": "notes", "shape_index": j}, text))
+    return fields
+
+
+# 词表子串查找用的 n-gram 长度上限:短于它的查询词直接查表，否则取各 n-gram 候选的交集
+_GRAM = 3
+
+
+def _grams(word, n):
+    return {word[i : i + n] for i in range(len(word) - n + 1)}
+
+
+def _word_grams(word):
+    grams = set()
+    for n in range(1, _GRAM + 1):
+        grams |= _grams(word, n)
+    return grams
+
+
+class _Vocabulary:
+    """
+    倒排表的词表，支持首尾查询词的部分匹配而不必扫描全部词:
+    有序词表做前缀、倒序词的有序表做后缀、1..3-gram -> 词 做子串
+    """
+
+    def __init__(self):
+        self.words = []
+        self.reversed = []
+        self.grams = {}
+
+    def add(self, word):
+        bisect.insort(self.words, word)
+        bisect.insort(self.reversed, word[::-1])
+        for gram in _word_grams(word):
+            self.grams.setdefault(gram, set()).add(word)
+
+    def remove(self, word):
+        del self.words[bisect.bisect_left(self.words, word)]
+        del self.reversed[bisect.bisect_left(self.reversed, word[::-1])]
+        for gram in _word_grams(word):
+            members = self.grams.get(gram)
+            if members is not None:
+                members.discard(word)
+                if not members:
+                    del self.grams[gram]
+
+    @staticmethod
+    def _prefixed(ordered, prefix):
+        i = bisect.bisect_left(ordered, prefix)
+        while i < len(ordered) and ordered[i].startswith(prefix):
+            yield ordered[i]
+            i += 1
+
+    def with_prefix(self, prefix):
+        return self._prefixed(self.words, prefix)
+
+    def with_suffix(self, suffix):
+        return (word[::-1] for word in self._prefixed(self.reversed, suffix[::-1]))
+
+    def containing(self, part):
+        if len(part) <= _GRAM:
+            return set(self.grams.get(part, ()))
+        candidates = None
+        for gram in sorted(_grams(part, _GRAM), key=lambda g: len(self.grams.get(g, ()))):
+            members = self.grams.get(gram, set())
+            candidates = set(members) if candidates is None else candidates & members
+            if not candidates:
+                return set()
+        return {word for word in candidates if part in word}
+
+
+class _DocumentIndex:
+    def __init__(self):
+        # slide_index -> (generation, fields)
+        self.slides = {}
+        # token -> {(slide_index, field_no)}
+        self.postings = {}
+        self.vocabulary = _Vocabulary()
+        # 上次完整校验各页时的文档 generation
+        self.checked = None
+
+    def drop_slide(self, slide_index):
+        entry = self.slides.pop(slide_index, None)
+        if entry is None:
+            return
+        for field_no, (_, text) in enumerate(entry[1]):
+            for token in set(tokenize(text)):
+                members = self.postings.get(token)
+                if members is not None:
+                    members.discard((slide_index, field_no))
+                    if not members:
+                        del self.postings[token]
+                        self.vocabulary.remove(token)
+
+    def put_slide(self, slide_index, generation, fields):
+        self.drop_slide(slide_index)
+        self.slides[slide_index] = (generation, fields)
+        for field_no, (_, text) in enumerate(fields):
+            for token in set(tokenize(text)):
+                members = self.postings.get(token)
+                if members is None:
+                    members = self.postings[token] = set()
+                    self.vocabulary.add(token)
+                members.add((slide_index, field_no))
+
+
+class SearchIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._docs = {}
+
+    def _refresh(self, doc_key, doc, index):
+        """重新读取变过的页，返回重建的页数"""
+        generation = tracker.generation(doc_key)
+        if generation is not None and generation == index.checked:
+            return 0
+        pages = doc.getDrawPages()
+        count = pages.getCount()
+        for slide_index in [i for i in index.slides if i >= count]:
+            index.drop_slide(slide_index)
+        rebuilt = 0
+        for slide_index in range(count):
+            entry = index.slides.get(slide_index)
+            if entry is not None and not tracker.changed_since(doc_key, entry[0], slide_index):
+                continue
+            index.put_slide(slide_index, generation, slide_fields(pages.getByIndex(slide_index)))
+            rebuilt += 1
+        index.checked = generation
+        return rebuilt
+
+    def search(self, doc_key, doc, query, limit=None):
+        """
+        返回 (匹配列表, 重建的页数)。匹配按页、字段顺序排列:
+        {"slide_index", "kind", "shape_index", ["row", "column"], "text", "matches": [[start, end], ...]}
+        """
+        tokens = tokenize(query)
+        pattern = re.compile(re.escape(query), re.IGNORECASE)
+        with self._lock:
+            index = self._docs.get(doc_key)
+            if index is None:
+                index = self._docs[doc_key] = _DocumentIndex()
+            rebuilt = self._refresh(doc_key, doc, index)
+            record_cache("search_index", rebuilt == 0)
+
+            candidates = None
+            for members in _token_postings(index, tokens):
+                candidates = members if candidates is None else candidates & members
+                if not candidates:
+                    return [], rebuilt
+            if candidates is None:
+                # 查询串里没有词（全是标点），逐字段查找
+                candidates = {
+                    (slide_index, field_no)
+                    for slide_index, (_, fields) in index.slides.items()
+                    for field_no in range(len(fields))
+                }
+
+            results = []
+            for slide_index, field_no in sorted(candidates):
+                location, text = index.slides[slide_index][1][field_no]
+                matches = _find_all(text, pattern)
+                if not matches:
+                    # 所有词都出现了，但不相邻
+                    continue
+                results.append(
+                    {"slide_index": slide_index, **location, "text": text, "matches": matches}
+                )
+                if limit is not None and len(results) >= limit:
+                    break
+        return results, rebuilt
+
+    def forget(self, doc_key):
+        """文档关闭后丢弃它的索引"""
+        with self._lock:
+            self._docs.pop(doc_key, None)
+
+    def prune(self, doc_key, slide_count):
+        """丢弃页号不小于 slide_count 的页的倒排项（幻灯片被删除后）"""
+        with self._lock:
+            index = self._docs.get(doc_key)
+            if index is None:
+                return
+            for slide_index in [i for i in index.slides if i >= slide_count]:
+                index.drop_slide(slide_index)
+            # 页数变了，下次查询必须重新校验各页
+            index.checked = None
+
+    def clear(self):
+        with self._lock:
+            self._docs.clear()
+
+
+def _token_postings(index, tokens):
+    """每个查询词对应的字段集合；首尾词按部分匹配在词表里展开"""
+    postings, vocabulary = index.postings, index.vocabulary
+    last = len(tokens) - 1
+    for i, token in enumerate(tokens):
+        if 0 < i < last:
+            yield postings.get(token, set())
+            continue
+        if i == 0 and last == 0:
+            words = vocabulary.containing(token)
+        elif i == 0:
+            words = vocabulary.with_suffix(token)
+        else:
+            words = vocabulary.with_prefix(token)
+        members = set()
+        for word in words:
+            members |= postings[word]
+        yield members
+
+
+def _find_all(text, pattern):
+    """在原文里（不区分大小写）查找，偏移按原文计:lower() 可能改变长度（如 "İ"）"""
+    return [[m.start(), m.end()] for m in pattern.finditer(text)]
+
+
+search_index = SearchIndex()
@@ -0,0 +1,254 @@
+"""
+文档快照与结构化 diff
+
+快照记下每页的内容（形状类型、位置、大小、文字、格式、表格、备注）。每页内容按
+tracker generation 缓存:拍快照时只重新读取自上次以来变过的页，没变的页直接引用
+同一个对象，多个快照共享，快照本身只是一份按页的引用列表。
+快照总数不超过 MAX_SNAPSHOTS，每份文档不超过 MAX_SNAPSHOTS_PER_DOC，超出时丢弃最早的；
+文档关闭时它的快照与按页缓存一并丢弃。
+
+diff 按页序号比较，两个快照引用同一对象的页直接跳过；其余页内的形状按 (类型, 文字)
+做序列对齐（difflib），识别新增/删除，配对上的形状再逐项比较位置、大小、文字、格式
+与表格。
+形状没有跨修改稳定的 id，对齐结果是启发式的:同时改了文字又插入了同类形状时可能
+配对错位，表现为"修改"而不是"新增 + 删除"。
+"""
+
+import difflib
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from impress_events import tracker
+from impress_metrics import record_cache
+
+logger = logging.getLogger(__name__)
+
+MAX_SNAPSHOTS = int(os.environ.get("IMPRESS_MAX_SNAPSHOTS", "64"))
+MAX_SNAPSHOTS_PER_DOC = int(os.environ.get("IMPRESS_MAX_SNAPSHOTS_PER_DOC", "16"))
+
+
+class UnknownSnapshot(LookupError):
+    def __init__(self, snapshot_id):
+        super().__init__(f"Unknown snapshot: {snapshot_id}")
+        self.snapshot_id = snapshot_id
+
+
+class Snapshot:
+    def __init__(self, snapshot_id, doc_key, generation, slides):
+        self.snapshot_id = snapshot_id
+        self.doc_key = doc_key
+        self.generation = generation
+        self.slides = slides
+        self.created_at = time.time()
+
+    def describe(self):
+        return {
+            "snapshot_id": self.snapshot_id,
+            "generation": self.generation,
+            "slides": len(self.slides),
+            "created_at": self.created_at,
+        }
+
+
+class SnapshotStore:
+    def __init__(self, max_snapshots=MAX_SNAPSHOTS, max_per_doc=MAX_SNAPSHOTS_PER_DOC):
+        self.max_snapshots = max_snapshots
+        self.max_per_doc = max_per_doc
+        self._lock = threading.Lock()
+        self._snapshots = OrderedDict()
+        # (doc_key, slide_index) -> (generation, 页内容)
+        self._slides = {}
+        self._ids = itertools.count(1)
+
+    def capture(self, doc_key, doc, read_slide):
+        """
+        读取文档当前状态（未变的页取缓存），返回 (页内容列表, generation, 重新读取的页数)。
+        read_slide(slide) 返回一页的内容 dict。
+        """
+        generation = tracker.generation(doc_key)
+        pages = doc.getDrawPages()
+        count = pages.getCount()
+        self.prune(doc_key, count)
+        slides, reread = [], 0
+        for slide_index in range(count):
+            cached = self._slides.get((doc_key, slide_index))
+            hit = cached is not None and not tracker.changed_since(
+                doc_key, cached[0], slide_index
+            )
+            record_cache("snapshot_slide", hit)
+            if hit:
+                slides.append(cached[1])
+                continue
+            state = read_slide(pages.getByIndex(slide_index))
+            reread += 1
+            if generation is not None:
+                with self._lock:
+                    self._slides[(doc_key, slide_index)] = (generation, state)
+            slides.append(state)
+        return slides, generation, reread
+
+    def take(self, doc_key, doc, read_slide):
+        """拍快照，返回 (Snapshot, 重新读取的页数)"""
+        slides, generation, reread = self.capture(doc_key, doc, read_slide)
+        with self._lock:
+            snapshot = Snapshot(f"s{next(self._ids)}", doc_key, generation, slides)
+            self._snapshots[snapshot.snapshot_id] = snapshot
+            own = [s.snapshot_id for s in self._snapshots.values() if s.doc_key == doc_key]
+            for snapshot_id in own[: max(len(own) - self.max_per_doc, 0)]:
+                del self._snapshots[snapshot_id]
+            while len(self._snapshots) > self.max_snapshots:
+                self._snapshots.popitem(last=False)
+        return snapshot, reread
+
+    def get(self, snapshot_id):
+        snapshot = self._snapshots.get(snapshot_id)
+        if snapshot is None:
+            raise UnknownSnapshot(snapshot_id)
+        return snapshot
+
+    def delete(self, snapshot_id):
+        with self._lock:
+            if self._snapshots.pop(snapshot_id, None) is None:
+                raise UnknownSnapshot(snapshot_id)
+
+    def list(self, doc_key=None):
+        with self._lock:
+            return [
+                s.describe()
+                for s in self._snapshots.values()
+                if doc_key is None or s.doc_key == doc_key
+            ]
+
+    def forget(self, doc_key):
+        """文档关闭后丢弃它的快照与按页缓存"""
+        with self._lock:
+            for snapshot_id in [k for k, s in self._snapshots.items() if s.doc_key == doc_key]:
+                del self._snapshots[snapshot_id]
+            self._prune(doc_key, 0)
+
+    def prune(self, doc_key, slide_count):
+        """丢弃页号不小于 slide_count 的按页缓存（幻灯片被删除后）；已拍的快照不受影响"""
+        with self._lock:
+            self._prune(doc_key, slide_count)
+
+    def _prune(self, doc_key, slide_count):
+        for cache_key in [k for k in self._slides if k[0] == doc_key and k[1] >= slide_count]:
+            del self._slides[cache_key]
+
+    def clear(self):
+        """桥接断开后调用:文档 key 与 generation 都会重新分配，旧快照无法再与现状比较"""
+        with self._lock:
+            self._snapshots.clear()
+            self._slides.clear()
+
+
+def _shape_key(shape):
+    return (shape.get("type"), shape.get("text"))
+
+
+def _shape_changes(old, new):
+    changes = {}
+    if old.get("position") != new.get("position"):
+        changes["moved"] = {"from": old.get("position"), "to": new.get("position")}
+    if old.get("size") != new.get("size"):
+        changes["resized"] = {"from": old.get("size"), "to": new.get("size")}
+    if old.get("text") != new.get("text"):
+        changes["text"] = {"from": old.get("text"), "to": new.get("text")}
+    old_format, new_format = old.get("formatting") or {}, new.get("formatting") or {}
+    formatting = {
+        name: {"from": old_format.get(name), "to": new_format.get(name)}
+        for name in sorted(set(old_format) | set(new_format))
+        if old_format.get(name) != new_format.get(name)
+    }
+    if formatting:
+        changes["formatting"] = formatting
+    cells = _table_changes(old.get("table"), new.get("table"))
+    if cells:
+        changes["table"] = cells
+    return changes
+
+
+def _table_changes(old, new):
+    if old == new or old is None or new is None:
+        return None
+    if (old.get("rows"), old.get("columns")) != (new.get("rows"), new.get("columns")):
+        return {
+            "from": {"rows": old.get("rows"), "columns": old.get("columns")},
+            "to": {"rows": new.get("rows"), "columns": new.get("columns")},
+        }
+    return [
+        {"row": r, "column": c, "from": a, "to": b}
+        for r, (old_row, new_row) in enumerate(zip(old.get("data", []), new.get("data", [])))
+        for c, (a, b) in enumerate(zip(old_row, new_row))
+        if a != b
+    ]
+
+
+def diff_slide(old, new):
+    """一页内的变化:[{"change": "added"|"removed"|"modified"|"notes", ...}]"""
+    old_shapes, new_shapes = old.get("shapes", []), new.get("shapes", [])
+    matcher = difflib.SequenceMatcher(
+        None, [_shape_key(s) for s in old_shapes], [_shape_key(s) for s in new_shapes],
+        autojunk=False,
+    )
+    changes = []
+
+    def modified(i, j):
+        shape_changes = _shape_changes(old_shapes[i], new_shapes[j])
+        if shape_changes:
+            changes.append(
+                {
+                    "change": "modified",
+                    "from_index": i,
+                    "index": j,
+                    "type": new_shapes[j].get("type"),
+                    **shape_changes,
+                }
+            )
+
+    for op, i1, i2, j1, j2 in matcher.get_opcodes():
+        if op == "equal":
+            for i, j in zip(range(i1, i2), range(j1, j2)):
+                modified(i, j)
+            continue
+        # replace 块里同类型的按顺序配对为修改，其余为新增/删除
+        unmatched = list(range(j1, j2))
+        for i in range(i1, i2):
+            j = next(
+                (j for j in unmatched if new_shapes[j].get("type") == old_shapes[i].get("type")),
+                None,
+            )
+            if j is None:
+                changes.append({"change": "removed", **old_shapes[i]})
+                continue
+            unmatched.remove(j)
+            modified(i, j)
+        for j in unmatched:
+            changes.append({"change": "added", **new_shapes[j]})
+
+    if old.get("notes") != new.get("notes"):
+        changes.append({"change": "notes", "from": old.get("notes"), "to": new.get("notes")})
+    return changes
+
+
+def diff_states(old_slides, new_slides):
+    """按页比较两份状态，返回 {"slides_added", "slides_removed", "slides": [...]}"""
+    slides = []
+    for slide_index, (old, new) in enumerate(zip(old_slides, new_slides)):
+        if old is new:
+            continue
+        changes = diff_slide(old, new)
+        if changes:
+            slides.append({"slide_index": slide_index, "changes": changes})
+    return {
+        "slides_added": list(range(len(old_slides), len(new_slides))),
+        "slides_removed": list(range(len(new_slides), len(old_slides))),
+        "slides": slides,
+    }
+
+
+snapshots = SnapshotStore()
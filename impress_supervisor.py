@@ -0,0 +1,302 @@
+"""
+soffice 进程监管
+
+长时间跑 gym 时 soffice 的 RSS 会一直涨。启用监管（IMPRESS_SUPERVISE=1）后由本进程
+启动 soffice（独立 profile，可选 headless），后台线程定期检查:
+- 进程是否还活着
+- 整个进程组的 RSS 是否超过 IMPRESS_RECYCLE_RSS_MB
+- 桥接是否还有响应（带超时的 probe，连续 IMPRESS_UNRESPONSIVE_LIMIT 次无响应即视为卡死）
+另外每跑完 IMPRESS_RECYCLE_EPISODES 个 episode（由 runner 调 /api/supervisor/episode 上报）
+在 episode 边界回收一次。
+
+回收时先 mark_dead() 旧桥接，再杀掉整个进程组并重新启动；期间请求走 connection 的
+重连路径（读接口返回 503 或自动重试），soffice 起来后自动恢复，API 进程本身不重启。
+_lock 只保护状态字段，等待旧进程退出、新进程接受连接都在锁外进行，回收期间
+status() / episode_finished() 照常返回（phase 为 "recycling"）；回收之间由
+_restart_lock 串行化。巡检在回收/启动期间跳过；巡检决定回收时带上它看到的进程，
+拿到 _restart_lock 时进程已被换掉就不再重复重启。启动时没连上（phase 为 "failed"）
+但进程还活着时，巡检会重试连接，连续失败 IMPRESS_UNRESPONSIVE_LIMIT 次后回收。
+"""
+
+import logging
+import os
+import shlex
+import signal
+import subprocess
+import threading
+import time
+
+from impress_connection import connection
+from impress_metrics import SOFFICE_RESTARTS, SOFFICE_RSS
+
+logger = logging.getLogger(__name__)
+
+SOFFICE_BIN = os.environ.get("IMPRESS_SOFFICE_BIN", "libreoffice")
+SOFFICE_ACCEPT = os.environ.get(
+    "IMPRESS_SOFFICE_ACCEPT", "socket,host=127.0.0.1,port=2002;urp;StarOffice.ServiceManager"
+)
+SOFFICE_PROFILE = os.environ.get("IMPRESS_SOFFICE_PROFILE", "/tmp/impress-soffice-profile")
+SOFFICE_EXTRA_ARGS = shlex.split(os.environ.get("IMPRESS_SOFFICE_ARGS", ""))
+HEADLESS = os.environ.get("IMPRESS_SOFFICE_HEADLESS", "").lower() in ("1", "true", "yes")
+
+# 0 表示不按该条件回收
+RECYCLE_EPISODES = int(os.environ.get("IMPRESS_RECYCLE_EPISODES", "0"))
+RECYCLE_RSS_MB = float(os.environ.get("IMPRESS_RECYCLE_RSS_MB", "0"))
+CHECK_INTERVAL = float(os.environ.get("IMPRESS_SUPERVISE_INTERVAL", "5"))
+PROBE_TIMEOUT = float(os.environ.get("IMPRESS_PROBE_TIMEOUT", "5"))
+UNRESPONSIVE_LIMIT = int(os.environ.get("IMPRESS_UNRESPONSIVE_LIMIT", "3"))
+START_TIMEOUT = float(os.environ.get("IMPRESS_SOFFICE_START_TIMEOUT", "60"))
+STOP_TIMEOUT = 10.0
+
+# recycle() 的 expected 默认值:不核对进程
+_ANY = object()
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def process_group_rss(pgid):
+    """读 /proc 统计进程组内所有进程的 RSS（字节）；非 Linux 返回 None"""
+    if not os.path.isdir("/proc"):
+        return None
+    total = 0
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+            # comm 字段可能含空格，从最后一个 ')' 之后开始分割:state ppid pgrp ...
+            fields = stat[stat.rindex(")") + 2 :].split()
+            if int(fields[2]) != pgid:
+                continue
+            with open(f"/proc/{entry}/statm") as f:
+                total += int(f.read().split()[1]) * _PAGE_SIZE
+        except (OSError, ValueError, IndexError):
+            continue
+    return total
+
+
+class SofficeSupervisor:
+    def __init__(self, manager=connection):
+        self.connection = manager
+        self.process = None
+        self.started_at = None
+        self.restarts = 0
+        self.last_restart_reason = None
+        self.episodes = 0
+        self.rss = None
+        self.unresponsive = 0
+        # stopped | starting | running | recycling | failed
+        self.phase = "stopped"
+        self._lock = threading.RLock()
+        self._restart_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._recycling = threading.Event()
+
+    def command(self):
+        args = [
+            SOFFICE_BIN,
+            "--impress",
+            f"-env:UserInstallation=file://{os.path.abspath(SOFFICE_PROFILE)}",
+            f"--accept={SOFFICE_ACCEPT}",
+            "--nologo",
+            "--norestore",
+            "--nolockcheck",
+        ]
+        if HEADLESS:
+            args.append("--headless")
+        return args + SOFFICE_EXTRA_ARGS
+
+    def spawn(self, reason):
+        """启动 soffice 并等待桥接可用（不持有 _lock）；超时返回 False"""
+        os.makedirs(SOFFICE_PROFILE, exist_ok=True)
+        logger.info(f"启动 soffice（{reason}）: {' '.join(self.command())}")
+        # 独立进程组，回收时连同 oosplash 派生的 soffice.bin 一起杀掉
+        process = subprocess.Popen(
+            self.command(),
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+        with self._lock:
+            self.process = process
+            self.started_at = time.time()
+            self.episodes = 0
+            self.unresponsive = 0
+            self.last_restart_reason = reason
+            if self.phase != "recycling":
+                self.phase = "starting"
+        SOFFICE_RESTARTS.inc(reason)
+
+        started = False
+        deadline = time.monotonic() + START_TIMEOUT
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                logger.error(f"soffice 启动后立即退出，返回码 {process.returncode}")
+                break
+            if self.connection.connect(reason) is not None:
+                self.connection.warm_up()
+                started = True
+                break
+            time.sleep(1.0)
+        else:
+            logger.error(f"soffice 在 {START_TIMEOUT:.0f}s 内没有接受连接")
+        with self._lock:
+            self.phase = "running" if started else "failed"
+        return started
+
+    def _detach_process(self, reason):
+        """在锁内丢弃旧桥接并摘下当前进程，返回它供锁外 terminate()"""
+        with self._lock:
+            self.connection.mark_dead(reason)
+            process, self.process = self.process, None
+        return process
+
+    def terminate(self, process):
+        if process is None or process.poll() is not None:
+            return
+        for sig, timeout in ((signal.SIGTERM, STOP_TIMEOUT), (signal.SIGKILL, None)):
+            try:
+                os.killpg(process.pid, sig)
+            except ProcessLookupError:
+                return
+            try:
+                process.wait(timeout=timeout)
+                return
+            except subprocess.TimeoutExpired:
+                logger.warning("soffice 未响应 SIGTERM，强制结束")
+
+    def recycle(self, reason, expected=_ANY):
+        """
+        丢弃旧桥接、结束旧进程并重新启动。expected 为巡检时看到的进程:拿到
+        _restart_lock 时进程已被别的回收换掉，就不再重复重启，返回 None
+        """
+        with self._restart_lock:
+            if expected is not _ANY and self.process is not expected:
+                logger.info(f"soffice 已被回收，跳过巡检触发的回收（{reason}）")
+                return None
+            self._recycling.set()
+            try:
+                logger.warning(f"回收 soffice: {reason}")
+                with self._lock:
+                    self.phase = "recycling"
+                    self.restarts += 1
+                self.terminate(self._detach_process(f"soffice recycled: {reason}"))
+                return self.spawn(reason)
+            finally:
+                self._recycling.clear()
+
+    def recycle_async(self, reason):
+        """后台回收；未启用监管或已有回收在进行时返回 False"""
+        if not self.enabled or self._recycling.is_set():
+            return False
+        self._recycling.set()
+
+        def run():
+            try:
+                self.recycle(reason)
+            finally:
+                self._recycling.clear()
+
+        threading.Thread(target=run, name="soffice-recycle", daemon=True).start()
+        return True
+
+    def episode_finished(self):
+        """runner 在 episode 边界上报；达到 RECYCLE_EPISODES 时在后台回收"""
+        with self._lock:
+            self.episodes += 1
+            due = RECYCLE_EPISODES and self.episodes >= RECYCLE_EPISODES
+        return bool(due) and self.recycle_async("episodes")
+
+    def _responsive(self):
+        """带超时的 probe:卡住的 UNO 调用不会把监管线程也卡住"""
+        return self.connection.probe_within(PROBE_TIMEOUT) is not None
+
+    def _unresponsive_check(self):
+        self.unresponsive += 1
+        logger.warning(f"soffice 无响应（连续 {self.unresponsive} 次）")
+        if self.unresponsive >= UNRESPONSIVE_LIMIT:
+            return "unresponsive"
+        return None
+
+    def check(self):
+        """一次巡检；需要回收时返回原因，否则返回 None"""
+        # 回收/启动进行中:进程被摘下或还没接受连接都是预期状态，不能再触发一次回收
+        if self._recycling.is_set() or self.phase in ("recycling", "starting"):
+            return None
+        process = self.process
+        if process is None or process.poll() is not None:
+            return "exited"
+        self.rss = process_group_rss(process.pid)
+        if self.rss is not None:
+            SOFFICE_RSS.set(self.rss)
+            if RECYCLE_RSS_MB and self.rss > RECYCLE_RSS_MB * 1024 * 1024:
+                return "memory"
+        if self.phase == "failed":
+            # 进程活着但启动时没连上:再连一次，连上即恢复，连续连不上按无响应回收
+            if self.connection.desktop is not None or self.connection.connect("retry"):
+                with self._lock:
+                    self.phase = "running"
+                    self.unresponsive = 0
+                return None
+            return self._unresponsive_check()
+        if self.connection.desktop is not None:
+            if self._responsive():
+                self.unresponsive = 0
+            else:
+                return self._unresponsive_check()
+        return None
+
+    def _run(self):
+        self.spawn("start")
+        while not self._stop.wait(CHECK_INTERVAL):
+            try:
+                process = self.process
+                reason = self.check()
+                if reason:
+                    self.recycle(reason, expected=process)
+            except Exception as e:
+                logger.error(f"soffice 巡检失败: {e}", exc_info=True)
+
+    @property
+    def enabled(self):
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="soffice-supervisor", daemon=True
+            )
+            self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._stop.set()
+        self.terminate(self._detach_process("supervisor stopped"))
+        with self._lock:
+            self.phase = "stopped"
+
+    def status(self):
+        process = self.process
+        return {
+            "enabled": self.enabled,
+            "phase": self.phase,
+            "recycling": self._recycling.is_set(),
+            "pid": process.pid if process is not None else None,
+            "running": process is not None and process.poll() is None,
+            "started_at": self.started_at,
+            "restarts": self.restarts,
+            "last_restart_reason": self.last_restart_reason,
+            "episodes_since_start": self.episodes,
+            "recycle_episodes": RECYCLE_EPISODES,
+            "rss_bytes": self.rss,
+            "recycle_rss_mb": RECYCLE_RSS_MB,
+            "unresponsive_checks": self.unresponsive,
+            "headless": HEADLESS,
+            "profile": SOFFICE_PROFILE,
+        }
+
+
+supervisor = SofficeSupervisor()
@@ -0,0 +1,138 @@
+"""
+内存模板缓存
+
+从真实 deck 开始的 episode 原本要先下载文件、再从磁盘打开。这里把模板文件的字节
+按 sha256 缓存在内存里（按总字节数 LRU 淘汰），加载时包成 SequenceInputStream，
+以 "private:stream" 交给 loadComponentFromURL，重置到已知 deck 不再碰磁盘和网络。
+
+URL / 本地路径到 sha256 的映射也会记住（路径额外校验 mtime 与大小），同一来源
+第二次加载直接命中缓存。
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import urllib.request
+from collections import OrderedDict
+
+import uno
+
+from impress_metrics import record_cache
+
+logger = logging.getLogger(__name__)
+
+CACHE_MAX_BYTES = int(float(os.environ.get("IMPRESS_TEMPLATE_CACHE_MB", "256")) * 1024 * 1024)
+DOWNLOAD_TIMEOUT = float(os.environ.get("IMPRESS_TEMPLATE_DOWNLOAD_TIMEOUT", "60"))
+
+
+class _Template:
+    def __init__(self, sha256, data, name):
+        self.sha256 = sha256
+        self.data = data
+        self.name = name
+        self.loads = 0
+
+    def describe(self):
+        return {
+            "sha256": self.sha256,
+            "name": self.name,
+            "size": len(self.data),
+            "loads": self.loads,
+        }
+
+
+class TemplateCache:
+    def __init__(self, max_bytes=CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._templates = OrderedDict()
+        self._bytes = 0
+        # 来源 -> sha256；路径的来源 key 里带 mtime 和大小，文件变了就不会误命中
+        self._sources = {}
+
+    def put(self, data, name=None):
+        """缓存模板字节，返回 sha256；单个文件超过容量上限时不缓存但照样返回"""
+        sha256 = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            if sha256 in self._templates:
+                self._templates.move_to_end(sha256)
+                return sha256
+            if len(data) > self.max_bytes:
+                logger.warning(f"模板 {name} 大小 {len(data)} 超过缓存上限，不缓存")
+                return sha256
+            self._templates[sha256] = _Template(sha256, data, name)
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._templates.popitem(last=False)
+                self._bytes -= len(evicted.data)
+                logger.info(f"淘汰模板 {evicted.name} ({evicted.sha256[:12]})")
+        return sha256
+
+    def get(self, sha256):
+        """按 sha256 取模板，未缓存时返回 None"""
+        with self._lock:
+            template = self._templates.get(sha256)
+            if template is not None:
+                self._templates.move_to_end(sha256)
+        record_cache("template", template is not None)
+        return template
+
+    def _from_source(self, source_key, read, name):
+        sha256 = self._sources.get(source_key)
+        if sha256 is not None:
+            template = self.get(sha256)
+            if template is not None:
+                return template
+        else:
+            record_cache("template", False)
+        data = read()
+        sha256 = self.put(data, name)
+        self._sources[source_key] = sha256
+        with self._lock:
+            template = self._templates.get(sha256)
+        return template or _Template(sha256, data, name)
+
+    def from_url(self, url):
+        def read():
+            logger.info(f"下载模板 {url}")
+            with urllib.request.urlopen(url, timeout=DOWNLOAD_TIMEOUT) as response:
+                return response.read()
+
+        return self._from_source(("url", url), read, url.rsplit("/", 1)[-1])
+
+    def from_path(self, path):
+        path = os.path.abspath(path)
+        st = os.stat(path)
+
+        def read():
+            with open(path, "rb") as f:
+                return f.read()
+
+        return self._from_source(
+            ("path", path, st.st_mtime_ns, st.st_size), read, os.path.basename(path)
+        )
+
+    def list(self):
+        with self._lock:
+            return [t.describe() for t in reversed(self._templates.values())]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "count": len(self._templates),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+def input_stream(ctx, data):
+    """把字节包成 com.sun.star.io.SequenceInputStream"""
+    stream = ctx.ServiceManager.createInstanceWithContext(
+        "com.sun.star.io.SequenceInputStream", ctx
+    )
+    stream.initialize((uno.ByteSequence(data),))
+    return stream
+
+
+templates = TemplateCache()
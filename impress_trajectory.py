@@ -0,0 +1,291 @@
+"""
+episode 轨迹记录
+
+Recorder 订阅 hub 的 "document.modified" 事件，每次文档被修改（短时间内的连续修改
+合并为一步）就记录一步文档状态，追加写入每个 episode 一个的轨迹文件:
+- 关键帧（keyframe）:全部页的内容；第 0 步以及之后每 keyframe_interval 步写一次
+- 增量（delta）:页数，以及内容变过的页的完整内容（未变的页不写）
+页内容复用快照的按页缓存，没变的页不会重新读取 UNO。
+
+文件由若干帧首尾相接组成，每帧 = 9 字节头（payload 长度 u32、类型 u8、步号 u32，
+小端）+ zlib 压缩的 JSON。只追加不改写，进程崩溃时最多丢最后一个不完整的帧。
+TrajectoryReader 只读帧头建立索引，还原第 n 步状态时从不晚于 n 的最近关键帧开始
+依次应用增量，不需要 LibreOffice。
+"""
+
+import json
+import logging
+import os
+import queue
+import re
+import struct
+import threading
+import time
+import uuid
+import zlib
+
+from impress_codec import dumps_json
+from impress_events import hub
+
+logger = logging.getLogger(__name__)
+
+TRAJECTORY_DIR = os.environ.get("IMPRESS_TRAJECTORY_DIR", "trajectories")
+KEYFRAME_INTERVAL = int(os.environ.get("IMPRESS_TRAJECTORY_KEYFRAME_INTERVAL", "20"))
+# 收到修改事件后再等这么久，把连续修改合并为一步
+DEBOUNCE = float(os.environ.get("IMPRESS_TRAJECTORY_DEBOUNCE", "0.05"))
+
+_HEADER = struct.Struct("<IBI")
+KEYFRAME, DELTA = 0, 1
+_EPISODE_ID = re.compile(r"^[A-Za-z0-9._-]{1,128}$")
+
+
+class UnknownTrajectory(LookupError):
+    def __init__(self, episode):
+        super().__init__(f"Unknown trajectory: {episode}")
+        self.episode = episode
+
+
+def trajectory_path(episode, directory=None):
+    if not _EPISODE_ID.match(episode):
+        raise ValueError("episode must match [A-Za-z0-9._-]{1,128}")
+    return os.path.join(directory or TRAJECTORY_DIR, f"{episode}.traj")
+
+
+def write_frame(f, kind, step, record):
+    payload = zlib.compress(dumps_json(record))
+    f.write(_HEADER.pack(len(payload), kind, step) + payload)
+    f.flush()
+    return _HEADER.size + len(payload)
+
+
+class Recorder:
+    def __init__(self, episode, doc_key, capture, path, keyframe_interval=KEYFRAME_INTERVAL):
+        """capture() 返回 (页内容列表, generation, 重新读取的页数)，即 snapshots.capture 的结果"""
+        self.episode = episode
+        self.doc_key = doc_key
+        self.path = path
+        self.keyframe_interval = keyframe_interval
+        self._capture = capture
+        self._lock = threading.Lock()
+        self._file = open(path, "ab")
+        self._slides = None
+        self._generation = None
+        self.steps = 0
+        self.bytes = 0
+        self.started_at = time.time()
+        self.stopped = False
+        self._events = hub.subscribe()
+        self._thread = threading.Thread(
+            target=self._run, name=f"trajectory-{episode}", daemon=True
+        )
+
+    def start(self):
+        self.step(label="start")
+        self._thread.start()
+
+    def step(self, label=None, force=True):
+        """
+        记录一步，返回步号；force=False 且状态没有变化时不写，返回 None。
+        第 0 步与每 keyframe_interval 步写关键帧。读取在锁外进行，只有比较与追加写
+        在锁内；读到的 generation 比已写入的旧时丢弃，返回 None。
+        """
+        if self.stopped:
+            return None
+        # 读取 UNO 可能很慢甚至卡住，不能持有 _lock:桥接断开时 stop() 要拿这把锁关文件
+        slides, generation, _ = self._capture()
+        with self._lock:
+            if self.stopped:
+                return None
+            if (
+                generation is not None
+                and self._generation is not None
+                and generation < self._generation
+            ):
+                # 并发的另一步已经写了更新的状态，这次读到的已过时
+                return None
+            record = {"t": time.time(), "generation": generation, "slide_count": len(slides)}
+            if label is not None:
+                record["label"] = label
+            previous = self._slides
+            if previous is None or self.steps % self.keyframe_interval == 0:
+                kind = KEYFRAME
+                record["slides"] = slides
+            else:
+                changed = [
+                    [i, slide]
+                    for i, slide in enumerate(slides)
+                    if i >= len(previous) or (previous[i] is not slide and previous[i] != slide)
+                ]
+                if not changed and len(slides) == len(previous) and not force:
+                    return None
+                kind = DELTA
+                record["changed"] = changed
+            step = self.steps
+            self.bytes += write_frame(self._file, kind, step, record)
+            self._slides = slides
+            self._generation = generation
+            self.steps += 1
+            return step
+
+    def _run(self):
+        while not self.stopped:
+            try:
+                event, data = self._events.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if event != "document.modified" or data.get("doc") != self.doc_key:
+                continue
+            time.sleep(DEBOUNCE)
+            while True:
+                try:
+                    self._events.get_nowait()
+                except queue.Empty:
+                    break
+            try:
+                self.step(force=False)
+            except Exception as e:
+                logger.warning(f"轨迹 {self.episode} 记录失败: {e}")
+
+    def stop(self, final_step=True):
+        """停止记录；final_step 时先补记一步（状态有变化才写）"""
+        if final_step:
+            try:
+                self.step(label="stop", force=False)
+            except Exception as e:
+                logger.warning(f"轨迹 {self.episode} 结束时记录失败: {e}")
+        with self._lock:
+            self.stopped = True
+            self._file.close()
+        hub.unsubscribe(self._events)
+
+    def describe(self):
+        return {
+            "episode": self.episode,
+            "path": self.path,
+            "steps": self.steps,
+            "bytes": self.bytes,
+            "started_at": self.started_at,
+            "recording": not self.stopped,
+        }
+
+
+class TrajectoryRecorders:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._recorders = {}
+
+    def start(self, doc_key, capture, episode=None, keyframe_interval=KEYFRAME_INTERVAL):
+        """开始记录 doc_key 对应的文档；同一文档或同名 episode 已在记录时抛 ValueError"""
+        episode = episode or uuid.uuid4().hex[:12]
+        path = trajectory_path(episode)
+        with self._lock:
+            if episode in self._recorders:
+                raise ValueError(f"Trajectory {episode} is already recording")
+            if any(r.doc_key == doc_key for r in self._recorders.values()):
+                raise ValueError("This document is already being recorded")
+            if os.path.exists(path):
+                raise ValueError(f"Trajectory file {path} already exists")
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            recorder = Recorder(episode, doc_key, capture, path, keyframe_interval)
+            self._recorders[episode] = recorder
+        try:
+            recorder.start()
+        except Exception:
+            recorder.stop(final_step=False)
+            with self._lock:
+                self._recorders.pop(episode, None)
+            raise
+        return recorder
+
+    def get(self, episode):
+        recorder = self._recorders.get(episode)
+        if recorder is None:
+            raise UnknownTrajectory(episode)
+        return recorder
+
+    def stop(self, episode):
+        with self._lock:
+            recorder = self._recorders.pop(episode, None)
+        if recorder is None:
+            raise UnknownTrajectory(episode)
+        recorder.stop()
+        return recorder
+
+    def list(self):
+        with self._lock:
+            return [r.describe() for r in self._recorders.values()]
+
+    def clear(self):
+        """桥接断开后调用:文档句柄失效，关闭文件但不再补记"""
+        with self._lock:
+            recorders = list(self._recorders.values())
+            self._recorders.clear()
+        for recorder in recorders:
+            recorder.stop(final_step=False)
+
+
+class TrajectoryReader:
+    """读取轨迹文件并还原任一步的状态"""
+
+    def __init__(self, path):
+        self.path = path
+        # [(步号, 类型, payload 偏移, payload 长度)]
+        self.frames = []
+        with open(path, "rb") as f:
+            offset = 0
+            while True:
+                header = f.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    break
+                length, kind, step = _HEADER.unpack(header)
+                offset += _HEADER.size
+                if f.seek(length, os.SEEK_CUR) > os.path.getsize(path):
+                    # 写到一半的最后一帧
+                    break
+                self.frames.append((step, kind, offset, length))
+                offset += length
+
+    def __len__(self):
+        return len(self.frames)
+
+    def _record(self, f, frame):
+        f.seek(frame[2])
+        return json.loads(zlib.decompress(f.read(frame[3])))
+
+    def record(self, step):
+        """第 step 步的原始记录"""
+        with open(self.path, "rb") as f:
+            return self._record(f, self.frames[step])
+
+    def state_at(self, step=None):
+        """还原第 step 步（默认最后一步）的状态:{"step", "t", "generation", "label", "slides"}"""
+        if not self.frames:
+            raise IndexError("trajectory is empty")
+        if step is None:
+            step = len(self.frames) - 1
+        if not 0 <= step < len(self.frames):
+            raise IndexError(f"step {step} out of range (0..{len(self.frames) - 1})")
+        start = step
+        while self.frames[start][1] != KEYFRAME:
+            start -= 1
+        with open(self.path, "rb") as f:
+            slides = None
+            for frame in self.frames[start : step + 1]:
+                record = self._record(f, frame)
+                if frame[1] == KEYFRAME:
+                    slides = list(record["slides"])
+                    continue
+                del slides[record["slide_count"] :]
+                slides.extend([None] * (record["slide_count"] - len(slides)))
+                for slide_index, slide in record["changed"]:
+                    slides[slide_index] = slide
+        return {
+            "step": step,
+            "t": record["t"],
+            "generation": record["generation"],
+            "label": record.get("label"),
+            "slides": slides,
+        }
+
+
+trajectories = TrajectoryRecorders()
@@ -0,0 +1,195 @@
+"""
+UNO 调用计量（可选开启）
+
+用 TracedUno 代理包装 UNO 对象：每次方法调用、属性读写都会被计时并按名字累计，
+由此派生的对象（getByIndex、createTextCursor 返回值等）也会被自动包装。
+属性读记为 "get:<名字>"，属性写记为 "set:<名字>"。
+"""
+
+import json
+import os
+import threading
+import time
+
+_PASSTHROUGH = (str, bytes, int, float, bool, type(None), tuple, list, dict)
+
+
+class UnoCallRecorder:
+    """单个请求内的 UNO 调用统计，可选保留 Chrome trace 事件"""
+
+    def __init__(self, chrome_trace=False):
+        self.stats = {}  # name -> [calls, seconds]
+        self.events = [] if chrome_trace else None
+        self.t0 = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def record(self, name, start, end):
+        with self._lock:
+            entry = self.stats.get(name)
+            if entry is None:
+                entry = self.stats[name] = [0, 0.0]
+            entry[0] += 1
+            entry[1] += end - start
+            if self.events is not None:
+                self.events.append(
+                    {
+                        "name": name,
+                        "cat": "uno",
+                        "ph": "X",
+                        "ts": (start - self.t0) * 1e6,
+                        "dur": (end - start) * 1e6,
+                        "pid": os.getpid(),
+                        "tid": threading.get_ident(),
+                    }
+                )
+
+    @property
+    def total_calls(self):
+        return sum(calls for calls, _ in self.stats.values())
+
+    @property
+    def total_seconds(self):
+        return sum(seconds for _, seconds in self.stats.values())
+
+    def top(self, n=5):
+        """按耗时排序的前 n 个调用 [(name, calls, seconds)]"""
+        items = sorted(self.stats.items(), key=lambda kv: kv[1][1], reverse=True)
+        return [(name, calls, seconds) for name, (calls, seconds) in items[:n]]
+
+    def summary_header(self, n=5):
+        top = ",".join(
+            f"{name}:{calls}:{seconds * 1000:.3f}" for name, calls, seconds in self.top(n)
+        )
+        return (
+            f"calls={self.total_calls}; "
+            f"time_ms={self.total_seconds * 1000:.3f}; top={top}"
+        )
+
+    def chrome_trace(self, label="request"):
+        events = list(self.events or [])
+        events.append(
+            {
+                "name": label,
+                "cat": "request",
+                "ph": "X",
+                "ts": 0,
+                "dur": (time.perf_counter() - self.t0) * 1e6,
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+            }
+        )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self, directory, label="request", max_files=None):
+        """把 Chrome trace JSON 写到 directory 下，返回文件路径；给出 max_files 时删掉最旧的多余文件"""
+        os.makedirs(directory, exist_ok=True)
+        safe = "".join(c if c.isalnum() else "_" for c in label).strip("_") or "request"
+        path = os.path.join(
+            directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{time.time_ns() % 10**9:09d}-{safe}.json"
+        )
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.chrome_trace(label), f)
+        if max_files is not None:
+            prune_traces(directory, max_files)
+        return path
+
+
+def prune_traces(directory, max_files):
+    """只保留 directory 下最新的 max_files 个 trace 文件（文件名以时间开头，按名字排序即按时间）"""
+    try:
+        names = sorted(n for n in os.listdir(directory) if n.endswith(".json"))
+    except OSError:
+        return
+    for name in names[: max(0, len(names) - max_files)]:
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            pass
+
+
+def _is_uno_object(value):
+    """只有 UNO 接口对象需要包装；结构体、基本类型、序列原样返回"""
+    if isinstance(value, _PASSTHROUGH) or isinstance(value, TracedUno):
+        return False
+    return hasattr(value, "queryInterface")
+
+
+def wrap(value, recorder):
+    if recorder is None or not _is_uno_object(value):
+        return value
+    return TracedUno(value, recorder)
+
+
+def unwrap(value):
+    if isinstance(value, TracedUno):
+        return object.__getattribute__(value, "_obj")
+    if isinstance(value, tuple):
+        return tuple(unwrap(v) for v in value)
+    return value
+
+
+class _TracedMethod:
+    __slots__ = ("_fn", "_name", "_rec")
+
+    def __init__(self, fn, name, recorder):
+        self._fn = fn
+        self._name = name
+        self._rec = recorder
+
+    def __call__(self, *args):
+        args = tuple(unwrap(a) for a in args)
+        start = time.perf_counter()
+        try:
+            result = self._fn(*args)
+        finally:
+            self._rec.record(self._name, start, time.perf_counter())
+        return wrap(result, self._rec)
+
+
+class TracedUno:
+    """UNO 对象代理，对外表现与原对象一致"""
+
+    __slots__ = ("_obj", "_rec")
+
+    def __init__(self, obj, recorder):
+        object.__setattr__(self, "_obj", obj)
+        object.__setattr__(self, "_rec", recorder)
+
+    def __getattr__(self, name):
+        obj = object.__getattribute__(self, "_obj")
+        rec = object.__getattribute__(self, "_rec")
+        start = time.perf_counter()
+        try:
+            value = getattr(obj, name)
+        except AttributeError:
+            # hasattr() 探测失败同样是一次桥接往返
+            rec.record(f"get:{name}", start, time.perf_counter())
+            raise
+        if callable(value) and not _is_uno_object(value):
+            return _TracedMethod(value, name, rec)
+        rec.record(f"get:{name}", start, time.perf_counter())
+        return wrap(value, rec)
+
+    def __setattr__(self, name, value):
+        obj = object.__getattribute__(self, "_obj")
+        rec = object.__getattribute__(self, "_rec")
+        start = time.perf_counter()
+        try:
+            setattr(obj, name, unwrap(value))
+        finally:
+            rec.record(f"set:{name}", start, time.perf_counter())
+
+    def __eq__(self, other):
+        return object.__getattribute__(self, "_obj") == unwrap(other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(object.__getattribute__(self, "_obj"))
+
+    def __bool__(self):
+        return bool(object.__getattribute__(self, "_obj"))
+
+    def __repr__(self):
+        return f"TracedUno({object.__getattribute__(self, '_obj')!r})"